@@ -0,0 +1,178 @@
+"""
+Purpose: copy every image in a products folder using the asyncio API of s3fs instead of threads.
+One event loop runs all of the copies. The number of copies waiting on S3 at the same time is
+limited by an asyncio.Semaphore, which can be set to thousands because a waiting copy costs a
+small coroutine rather than an OS thread.
+The listing is not read into a list first. Each page of the S3 listing (up to 1000 keys) is
+planned and its copies are started as soon as the page arrives. When the semaphore is full the
+listing waits, so the number of keys held in memory stays bounded.
+The size of each object comes with the listing, so each copy is a single CopyObject request
+(s3fs _copy_basic) with no HEAD request first. Objects larger than multipart_threshold are copied
+as multipart uploads with their parts copied at the same time (multipart_copy.py).
+With a MetricsRegistry (migration_metrics.py) the time of each listing page, plan, copy and on_result
+call is recorded separately.
+"""
+
+#####REQUIRED PACKAGES#####
+import asyncio
+import time
+#will need fs3 package to use s3 in fsspec
+import fsspec
+from filesystem_manager import filesystem_kwargs
+from s3_listing import list_pages_async
+from copy_engine import EngineStats, is_throttle_error, is_retryable_error, backoff_delay
+from multipart_copy import copy_object_async, DEFAULT_MULTIPART_THRESHOLD, DEFAULT_PART_SIZE
+from migration_metrics import optional_timer
+
+
+#####FUNCTIONS#####
+def _count(stats, metrics, **counts):
+    """
+    Add to the run's stats, and to the metrics registry if there is one (same names as CopyEngine).
+    """
+
+    stats.add(**counts)
+    if metrics is not None:
+        for name, count in counts.items():
+            metrics.inc(name + '_total', count)
+    return
+
+
+async def _copy_one(fs, source_filepath, dest_filepath, size, stats, max_retries, base_delay, max_delay,
+                    multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, part_size=DEFAULT_PART_SIZE, metrics=None):
+    """
+    Copy one object, retrying throttling and connection errors with backoff.
+    Output:
+        result - dest_filepath, or a message if the copy failed
+        copied - (bool) False if the copy failed
+    """
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            await copy_object_async(fs, source_filepath, dest_filepath, size, multipart_threshold, part_size)
+        except Exception as error:
+            if is_throttle_error(error):
+                _count(stats, metrics, throttled=1)
+            if not is_retryable_error(error) or attempt >= max_retries:
+                _count(stats, metrics, failed=1)
+                return 'Copy failed: ' + repr(error) + '. Not copied.', False
+            _count(stats, metrics, retries=1)
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+            continue
+        if metrics is not None:
+            metrics.observe('copy_seconds', time.perf_counter() - start)
+        _count(stats, metrics, copied=1)
+        return dest_filepath, True
+
+
+async def copy_folder_async(source_folder, plan_func, concurrency=1000, profile='coastcam', page_size=1000,
+                            skip_func=None, on_result=None, max_retries=8, base_delay=0.1, max_delay=20.0,
+                            report_every=None, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+                            part_size=DEFAULT_PART_SIZE, metrics=None):
+    """
+    Copy every image in source_folder to the path returned by plan_func, on one event loop.
+    Input:
+        source_folder - (string) S3 folder of images, ex. "s3://cmgp-coastcam/cameras/caco-01/products/"
+        plan_func - function that takes a source filepath ("[bucket]/[key]") and returns the
+                    destination filepath. Anything not starting with "s3://" is treated as a message
+                    saying the file should not be copied (same as copy_s3_image()).
+        concurrency - (int) most copies waiting on S3 at the same time. Also the connection pool size.
+        profile - (string) AWS profile name
+        page_size - (int) keys per listing page
+        skip_func - function that takes a source filepath and returns True if it should be skipped
+                    without calling plan_func or on_result, ex. CopyJournal.is_finished
+        on_result - function called with (source filepath, destination filepath or message, ok) after
+                    every file. ok is False if the copy failed after its retries (so the file should be
+                    tried again by a later run) and True for copies and files plan_func chose not to copy.
+                    Runs on the event loop, so it should be quick.
+        max_retries - (int) retries for one object before it is recorded as failed
+        base_delay - (float) seconds of the first backoff
+        max_delay - (float) longest backoff in seconds
+        report_every - (float) optional. Print progress every this many seconds.
+        multipart_threshold - (int) objects larger than this many bytes are copied in parts
+        part_size - (int) bytes per part of a multipart copy
+        metrics - optional MetricsRegistry (migration_metrics.py). Records the time waited for each
+                  listing page as 'list_page_seconds', each plan_func call as 'plan_seconds', each
+                  successful copy as 'copy_seconds' and each on_result call as 'record_seconds', the
+                  counters of CopyEngine and the copies running as the gauge 'copies_in_flight'.
+    Output:
+        stats - (EngineStats) counts of copied, failed, retried and throttled objects
+    """
+
+    loop = asyncio.get_running_loop()
+    fs = fsspec.filesystem('s3', asynchronous=True, loop=loop,
+                           **filesystem_kwargs('s3', profile, pool_size=concurrency))
+    s3 = await fs.set_session()
+
+    stats = EngineStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+    last_report = loop.time()
+
+    async def run_copy(source_filepath, dest_filepath, size):
+        try:
+            result, copied = await _copy_one(fs, source_filepath, dest_filepath, size, stats, max_retries,
+                                             base_delay, max_delay, multipart_threshold, part_size, metrics)
+            if on_result is not None:
+                with optional_timer(metrics, 'record_seconds'):
+                    on_result(source_filepath, result, copied)
+        finally:
+            semaphore.release()
+
+    try:
+        #time waiting for each page, not counting the time its copies are started
+        page_start = time.perf_counter()
+        async for page in list_pages_async(fs, source_folder, page_size):
+            if metrics is not None:
+                metrics.observe('list_page_seconds', time.perf_counter() - page_start)
+                metrics.inc('listed_objects_total', len(page))
+            for info in page:
+                source_filepath = info['name']
+                size = info['size']
+                if skip_func is not None and skip_func(source_filepath):
+                    continue
+                with optional_timer(metrics, 'plan_seconds'):
+                    dest_filepath = plan_func(source_filepath)
+                if not dest_filepath.startswith("s3://"):
+                    if on_result is not None:
+                        on_result(source_filepath, dest_filepath, True)
+                    continue
+
+                #waits here (and so stops listing) while concurrency copies are already running
+                await semaphore.acquire()
+                task = asyncio.ensure_future(run_copy(source_filepath, dest_filepath, size))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if metrics is not None:
+                metrics.set_gauge('copies_in_flight', len(running))
+            if report_every is not None and loop.time() - last_report >= report_every:
+                last_report = loop.time()
+                print(stats, "in flight:", len(running))
+            page_start = time.perf_counter()
+
+        await asyncio.gather(*running)
+    finally:
+        #cancel copies still running if the listing failed
+        for task in running:
+            task.cancel()
+        await s3.close()
+    stats.end_time = time.monotonic()
+    return stats
+
+
+def run_async_copy(source_folder, plan_func, **kwargs):
+    """
+    Run copy_folder_async() from normal (not async) code, ex. the main block of a script.
+    Input:
+        source_folder - (string) S3 folder of images
+        plan_func - function that returns the destination filepath for a source filepath
+        kwargs - passed to copy_folder_async()
+    Output:
+        stats - (EngineStats) counts of copied, failed, retried and throttled objects
+    """
+
+    return asyncio.run(copy_folder_async(source_folder, plan_func, **kwargs))
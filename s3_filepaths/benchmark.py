@@ -0,0 +1,349 @@
+"""
+Purpose: measure how fast the migration code lists, plans, copies and logs, without using S3.
+A local stand-in for S3 (the fsspec memory filesystem, or a folder on local disk) is filled with
+synthetic images named [unix time].c[camera].[image type].jpg in a products folder, at several
+sizes (ex. 10,000, 100,000 and 1,000,000 keys). Then each stage is timed on its own:
+    listing  - s3_listing.iter_keys() of the products folder (latency is per page)
+    planning - path_planner.plan_dest_path() of every key (latency is per key), and
+               plan_batch() of every key in batches of 1000 (throughput only)
+    copy     - copy_engine.CopyEngine copying every image to its new filepath (latency is per copy)
+    csv log  - copy_log.CopyLogWriter.write() of a row for every image (latency is per row)
+For each stage the objects per second, p50 and p99 latency and the peak memory (RSS) of the
+process are reported. Each size is run in its own process, so the peak memory of one size does
+not hide the peak of the next.
+Results are written to a json file along with the git commit and Python version, so runs of
+different versions of the code can be compared with compare_results().
+"""
+
+#####REQUIRED PACKAGES#####
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import fsspec
+from s3_listing import iter_keys
+from path_planner import plan_dest_path, plan_batch
+from copy_engine import CopyEngine
+from copy_log import CopyLogWriter
+try:
+    import resource
+except ImportError:
+    #not available on Windows
+    resource = None
+
+
+#####GLOBALS#####
+BUCKET = 'bench'
+STATION = 'bench-01'
+IMAGE_TYPES = ('snap', 'timex', 'var', 'bright', 'dark', 'rundark')
+CAMERAS = ('c1', 'c2')
+
+#first image time of the synthetic images (2019-12-13)
+FIRST_EPOCH = 1576195200
+
+
+#####FUNCTIONS#####
+def peak_rss():
+    """
+    Get the peak memory (resident set size) of this process in bytes, or None if it cannot be found.
+    """
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def summarize(count, seconds, latencies=None):
+    """
+    Summarize the timing of a stage.
+    Input:
+        count - (int) objects processed
+        seconds - (float) time the stage took
+        latencies - optional list of (float) seconds of each operation
+    Output:
+        summary - (dict) with 'objects', 'seconds', 'objects_per_sec', 'p50_ms', 'p99_ms' and 'peak_rss'
+    """
+
+    summary = {'objects': count, 'seconds': seconds, 'objects_per_sec': count / seconds if seconds > 0 else None,
+               'p50_ms': None, 'p99_ms': None, 'peak_rss': peak_rss()}
+    if latencies is not None and len(latencies) > 0:
+        p50, p99 = np.percentile(np.asarray(latencies), [50, 99]) * 1000
+        summary['p50_ms'] = float(p50)
+        summary['p99_ms'] = float(p99)
+    return summary
+
+
+def synthetic_keys(count):
+    """
+    Generator of count synthetic image filenames, in key order, ex. "1576195200.c1.bright.jpg".
+    Images are every 10 seconds, with an image of every type from every camera at each time.
+    """
+
+    per_time = len(CAMERAS) * len(IMAGE_TYPES)
+    for index in range(count):
+        epoch = FIRST_EPOCH + (index // per_time) * 10
+        camera = CAMERAS[(index // len(IMAGE_TYPES)) % len(CAMERAS)]
+        image_type = IMAGE_TYPES[index % len(IMAGE_TYPES)]
+        yield str(epoch) + "." + camera + "." + image_type + ".jpg"
+
+
+def make_filesystem(kind):
+    """
+    Make an empty local stand-in for S3.
+    Input:
+        kind - (string) 'memory' or 'local' (a temporary folder)
+    Output:
+        fs - fsspec filesystem
+        root - (string) folder the bucket goes in ('' for memory)
+    """
+
+    if kind == 'memory':
+        fs = fsspec.filesystem('memory')
+        fs.store.clear()
+        fs.pseudo_dirs.clear()
+        fs.pseudo_dirs.append('')
+        return fs, ''
+    if kind == 'local':
+        return fsspec.filesystem('file'), tempfile.mkdtemp(prefix='coastcam benchmark ')
+    raise ValueError("kind must be 'memory' or 'local'")
+
+
+def fill_bucket(fs, root, count):
+    """
+    Put count synthetic images in the products folder of the stand-in bucket.
+    Output:
+        source_folder - (string) products folder
+    """
+
+    source_folder = root + "/" + BUCKET + "/cameras/" + STATION + "/products"
+    fs.makedirs(source_folder, exist_ok=True)
+    for filename in synthetic_keys(count):
+        fs.pipe_file(source_folder + "/" + filename, b'x')
+    return source_folder
+
+
+def bench_listing(fs, source_folder):
+    """
+    Time listing the products folder. Latency is the time between pages.
+    Output:
+        summary - (dict) from summarize()
+        keys - (list of strings) listed keys
+    """
+
+    keys = []
+    latencies = []
+    start = time.perf_counter()
+    last = start
+    for key in iter_keys(fs, source_folder):
+        keys.append(key)
+        if len(keys) % 1000 == 0:
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+    return summarize(len(keys), time.perf_counter() - start, latencies), keys
+
+
+def bench_planning(keys):
+    """
+    Time planning the new filepath of every key, one at a time and in batches.
+    Output:
+        summaries - (dict) 'per_key' and 'batch' summaries from summarize()
+        dests - (list of strings) new filepath of each key
+    """
+
+    latencies = []
+    dests = []
+    start = time.perf_counter()
+    for key in keys:
+        key_start = time.perf_counter()
+        dests.append(plan_dest_path(key))
+        latencies.append(time.perf_counter() - key_start)
+    per_key = summarize(len(keys), time.perf_counter() - start, latencies)
+
+    start = time.perf_counter()
+    for batch_start in range(0, len(keys), 1000):
+        plan_batch(keys[batch_start:batch_start + 1000])
+    batch = summarize(len(keys), time.perf_counter() - start)
+    return {'per_key': per_key, 'batch': batch}, dests
+
+
+def bench_copy(fs, root, keys, dests, max_workers):
+    """
+    Time copying every key to its new filepath with CopyEngine.
+    Input:
+        root - (string) folder the bucket is in, from make_filesystem()
+        keys - (list of strings) filepaths in the bucket, without root
+        dests - (list of strings) new filepath of each key
+    Output:
+        summary - (dict) from summarize()
+    """
+
+    dest_of = dict(zip(keys, dests))
+    latencies = []
+
+    #S3 has no folders to make. Day folders are made before timing, for the local filesystem
+    for folder in set(dest.rsplit("/", 1)[0] for dest in dests):
+        fs.makedirs(root + "/" + folder[5:], exist_ok=True)
+
+    def copy_func(source_filepath):
+        copy_start = time.perf_counter()
+        dest_filepath = root + "/" + dest_of[source_filepath][5:]
+        #cp_file, since fs.copy() of the memory filesystem looks through every file to expand the path
+        fs.cp_file(root + source_filepath, dest_filepath)
+        #list.append is thread safe
+        latencies.append(time.perf_counter() - copy_start)
+        return dest_filepath
+
+    engine = CopyEngine(copy_func, max_workers=max_workers)
+    start = time.perf_counter()
+    copied = 0
+    for source_filepath, dest_filepath in engine.run(keys):
+        if not dest_filepath.startswith('Copy failed'):
+            copied += 1
+    summary = summarize(copied, time.perf_counter() - start, latencies)
+    summary['failed'] = len(keys) - copied
+    return summary
+
+
+def bench_csv_log(keys, dests):
+    """
+    Time writing a csv log row for every key, including writing the last rows when the log is closed.
+    Output:
+        summary - (dict) from summarize()
+    """
+
+    csv_dir = tempfile.mkdtemp(prefix='coastcam benchmark log ')
+    latencies = []
+    try:
+        start = time.perf_counter()
+        copy_log = CopyLogWriter(csv_dir + "/")
+        for source_filepath, dest_filepath in zip(keys, dests):
+            write_start = time.perf_counter()
+            copy_log.write("s3://" + source_filepath, dest_filepath)
+            latencies.append(time.perf_counter() - write_start)
+        copy_log.close()
+        summary = summarize(len(keys), time.perf_counter() - start, latencies)
+    finally:
+        shutil.rmtree(csv_dir, ignore_errors=True)
+    return summary
+
+
+def run_scale(count, fs_kind='memory', max_workers=32):
+    """
+    Fill a stand-in bucket with count images and time every stage. Run in its own process by run_benchmark().
+    Output:
+        results - (dict) stage -> summary
+    """
+
+    fs, root = make_filesystem(fs_kind)
+    try:
+        start = time.perf_counter()
+        source_folder = fill_bucket(fs, root, count)
+        results = {'fill': summarize(count, time.perf_counter() - start)}
+
+        results['listing'], keys = bench_listing(fs, source_folder)
+        #plan "/[bucket]/cameras/..." whatever folder the stand-in bucket is in
+        keys = [key[len(root):] for key in keys]
+        planning, dests = bench_planning(keys)
+        results['planning'] = planning['per_key']
+        results['planning_batch'] = planning['batch']
+        results['copy'] = bench_copy(fs, root, keys, dests, max_workers)
+        results['csv_log'] = bench_csv_log(keys, dests)
+    finally:
+        if fs_kind == 'local':
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    """
+    Get the git commit of this folder, or None if git is not available.
+    """
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales, results_path, fs_kind='memory', max_workers=32):
+    """
+    Run the benchmark at each scale and write the results to a json file.
+    Input:
+        scales - (list of int) number of keys, ex. [10000, 100000, 1000000]
+        results_path - (string) json file to write
+        fs_kind - (string) 'memory' or 'local', see make_filesystem()
+        max_workers - (int) copy threads
+    Output:
+        report - (dict) written to results_path
+    """
+
+    report = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'python': platform.python_version(), 'platform': platform.platform(), 'fs': fs_kind,
+              'max_workers': max_workers, 'results': {}}
+    for count in scales:
+        #new process for each scale, so peak memory is measured for that scale alone
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = executor.submit(run_scale, count, fs_kind, max_workers).result()
+        report['results'][str(count)] = results
+        for stage, summary in results.items():
+            print("%9d %-15s %12.0f objects/sec  p50 %8s ms  p99 %8s ms  peak rss %6.0f MB" % (
+                count, stage, summary['objects_per_sec'] or 0,
+                "%.3f" % summary['p50_ms'] if summary['p50_ms'] is not None else "-",
+                "%.3f" % summary['p99_ms'] if summary['p99_ms'] is not None else "-",
+                (summary['peak_rss'] or 0) / 2**20))
+
+    with open(results_path, 'w', encoding='UTF8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare_results(old_path, new_path):
+    """
+    Print the change in objects/sec of every stage between two benchmark json files.
+    Output:
+        changes - (dict) (scale, stage) -> new objects/sec divided by old objects/sec
+    """
+
+    with open(old_path, 'r', encoding='UTF8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='UTF8') as f:
+        new = json.load(f)
+
+    changes = {}
+    print("old:", old['commit'], old['time'], " new:", new['commit'], new['time'])
+    for scale, stages in new['results'].items():
+        for stage, summary in stages.items():
+            old_summary = old['results'].get(scale, {}).get(stage)
+            if old_summary is None or not old_summary['objects_per_sec'] or not summary['objects_per_sec']:
+                continue
+            ratio = summary['objects_per_sec'] / old_summary['objects_per_sec']
+            changes[(scale, stage)] = ratio
+            print("%9s %-15s %6.2fx" % (scale, stage, ratio))
+    return changes
+
+
+#####MAIN#####
+if __name__ == "__main__":
+    print("start:", datetime.datetime.now())
+    scales = [10000, 100000, 1000000]
+    results_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/benchmark " + \
+                   datetime.datetime.now().strftime("%d-%m-%Y %H_%M_%S") + ".json"
+
+    run_benchmark(scales, results_path, fs_kind='memory')
+    print("end:", datetime.datetime.now())
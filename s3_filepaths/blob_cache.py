@@ -0,0 +1,280 @@
+"""
+Purpose: keep local copies of files read from S3, so running an analysis again does not download the same images again.
+Files are saved in a cache folder under the sha256 of their S3 key and ETag. S3 gives a file a
+new ETag when it is written again, so a changed file is never served from the cache. Files are
+spread over 256 subfolders by the first two characters of the name.
+    - files are written to a temporary file and moved into place with os.replace(), so a file in
+      the cache is never half written, even if several processes write the same file at once
+    - each time a cached file is read its modified time is updated. When the cache is larger than
+      max_bytes, the files read longest ago are deleted until it is below 90% of max_bytes.
+      Deleting is done while holding a lock file, so only one process deletes at a time.
+    - hits, misses and bytes are counted, see stats()
+image_loader.py reads through the cache when it is given one.
+"""
+
+#####REQUIRED PACKAGES#####
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+#####GLOBALS#####
+#cache is cut down to this fraction of max_bytes when it is too large
+EVICT_TO = 0.9
+
+#lock files older than this (seconds) are left over from a process that stopped, and are removed
+STALE_LOCK_SECONDS = 300
+
+
+#####CLASSES#####
+class LockFile:
+    """
+    Lock shared between processes, held by creating a file that must not exist yet.
+    Works the same on Windows and Linux. Use as a context manager.
+    """
+
+    def __init__(self, lock_path, poll_interval=0.05, stale_seconds=STALE_LOCK_SECONDS):
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+
+    def acquire(self):
+        while True:
+            try:
+                handle = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(handle, str(os.getpid()).encode())
+                os.close(handle)
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > self.stale_seconds:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    #removed by the process holding it
+                    continue
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+        return
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+class BlobCache:
+    """
+    Local disk cache of S3 files, keyed by S3 key and ETag.
+    Example:
+        cache = BlobCache("D:/coastcam cache/", max_bytes=200 * 2**30)
+        data = cache.read(fs, "cmgp-coastcam/cameras/caco-01/products/1600866001.c2.timex.jpg")
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 2**30):
+        """
+        Input:
+            cache_dir - (string) local folder for the cache. Can be shared by several processes.
+            max_bytes - (int) size of the cache folder at which the files read longest ago are deleted
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_from_cache = 0
+        self.bytes_downloaded = 0
+        self.files_evicted = 0
+        self._lock = threading.Lock()
+        self._temp_dir = os.path.join(cache_dir, 'tmp')
+        os.makedirs(self._temp_dir, exist_ok=True)
+        self._lock_file = LockFile(os.path.join(cache_dir, 'evict.lock'))
+        #estimate of the size of the cache folder. Counted when the first file is added (not here, so
+        #unpickling the cache in a worker process does not scan the folder), updated when files are
+        #added and counted again when evicting
+        self._size = None
+
+    def __getstate__(self):
+        """
+        Only the settings are pickled (ex. to pass the cache to a worker process). Locks can not be
+        pickled, and the counts are kept by each process.
+        """
+
+        return {'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['cache_dir'], state['max_bytes'])
+        return
+
+    def blob_path(self, key, etag):
+        """
+        Local filepath of the cached copy of a file.
+        Input:
+            key - (string) S3 filepath, with or without "s3://"
+            etag - (string) ETag of the file, or None if not known
+        Output:
+            (string) filepath in the cache folder
+        """
+
+        if key.startswith("s3://"):
+            key = key[5:]
+        name = hashlib.sha256((key + "\n" + (etag or "")).encode('UTF8')).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name[2:] + '.blob')
+
+    def _scan(self):
+        """
+        List the cached files as (modified time, size, filepath).
+        """
+
+        blobs = []
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir() or len(folder.name) != 2:
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    #evicted by another process
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        return blobs
+
+    def _scan_size(self):
+        return sum(size for mtime, size, path in self._scan())
+
+    def get(self, key, etag):
+        """
+        Get a file from the cache.
+        Input:
+            key - (string) S3 filepath
+            etag - (string) ETag of the file, or None
+        Output:
+            data - (bytes) contents of the file, or None if it is not cached
+        """
+
+        path = self.blob_path(key, etag)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            #mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self.bytes_from_cache += len(data)
+        return data
+
+    def put(self, key, etag, data):
+        """
+        Add a file to the cache.
+        Input:
+            key - (string) S3 filepath
+            etag - (string) ETag of the file, or None
+            data - (bytes) contents of the file
+        Output:
+            None
+        """
+
+        path = self.blob_path(key, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self._temp_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is None:
+                #the scan includes the file just written
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+        return
+
+    def evict(self):
+        """
+        Delete the files read longest ago until the cache is below EVICT_TO of max_bytes.
+        """
+
+        with self._lock_file:
+            blobs = self._scan()
+            size = sum(blob_size for mtime, blob_size, path in blobs)
+            target = self.max_bytes * EVICT_TO
+            evicted = 0
+            if size > self.max_bytes:
+                for mtime, blob_size, path in sorted(blobs):
+                    if size <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        #already removed, or open in another process on Windows
+                        continue
+                    size -= blob_size
+                    evicted += 1
+        with self._lock:
+            self._size = size
+            self.files_evicted += evicted
+        return
+
+    def read(self, fs, key, etag=None):
+        """
+        Read a file through the cache: from the cache if it is there, otherwise from fs, saving a copy.
+        Input:
+            fs - fsspec filesystem
+            key - (string) S3 filepath
+            etag - (string) ETag of the file, ex. from a listing or BucketCatalog. Looked up with
+                   fs.info() if not given.
+        Output:
+            data - (bytes) contents of the file
+        """
+
+        if etag is None:
+            etag = fs.info(key).get('ETag')
+        data = self.get(key, etag)
+        if data is None:
+            data = fs.cat_file(key)
+            self.put(key, etag, data)
+            with self._lock:
+                self.bytes_downloaded += len(data)
+        return data
+
+    def stats(self):
+        """
+        Counts of cache use by this process.
+        Output:
+            (dict) with 'hits', 'misses', 'hit_rate', 'bytes_from_cache', 'bytes_downloaded',
+            'files_evicted' and 'size' (estimated bytes in the cache folder, None until a file is added)
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                    'bytes_from_cache': self.bytes_from_cache, 'bytes_downloaded': self.bytes_downloaded,
+                    'files_evicted': self.files_evicted, 'size': self._size}
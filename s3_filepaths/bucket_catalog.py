@@ -0,0 +1,310 @@
+"""
+Purpose: keep a local catalog of the files in the CoastCam bucket, so files can be found without listing S3.
+Finding "every timex from caco-01 c2 in December 2019" used to mean globbing the station's folders
+on S3, which takes minutes. The catalog is a SQLite database with one row per file:
+key, station, camera, epoch (unix time from the filename), image type, extension, size and ETag,
+indexed on (station, camera, epoch), so a query like that takes milliseconds.
+Both folder layouts are cataloged:
+    products - s3://[bucket]/cameras/[station]/products/[filename]
+    raw      - s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/[filename]
+The catalog is refreshed without listing everything again. Filenames start with the unix time,
+so S3 lists each folder in time order. The last filename of every folder is saved, and a refresh
+lists each products folder from there on with StartAfter (s3_listing.py). For the raw layout,
+only the day folder that was synced last and the day folders after it are listed.
+"""
+
+#####REQUIRED PACKAGES#####
+import calendar
+import datetime
+import sqlite3
+import time
+from filesystem_manager import get_filesystem
+from s3_listing import iter_pages
+from path_planner import parse_source_filepath
+
+
+#####GLOBALS#####
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    station TEXT,
+    camera TEXT,
+    epoch INTEGER,
+    image_type TEXT,
+    extension TEXT,
+    layout TEXT,
+    size INTEGER,
+    etag TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_station_camera_epoch ON objects (station, camera, epoch);
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    last_filename TEXT,
+    synced_at REAL
+);
+"""
+
+#columns returned by BucketCatalog.find()
+COLUMNS = ('key', 'station', 'camera', 'epoch', 'image_type', 'extension', 'layout', 'size', 'etag')
+
+
+#####FUNCTIONS#####
+def to_epoch(time_value):
+    """
+    Convert a time to unix time.
+    Input:
+        time_value - (int or float) unix time, (datetime.datetime) naive times are taken as UTC,
+                     or (datetime.date) midnight UTC
+    Output:
+        epoch - (int) unix time
+    """
+
+    if isinstance(time_value, datetime.datetime):
+        if time_value.tzinfo is None:
+            return calendar.timegm(time_value.timetuple())
+        return int(time_value.timestamp())
+    if isinstance(time_value, datetime.date):
+        return calendar.timegm(time_value.timetuple())
+    return int(time_value)
+
+
+def _folder_names(fs, folder):
+    """
+    Names of the folders directly inside a folder, ex. ['c1', 'c2', 'products'].
+    """
+
+    try:
+        #refresh so s3fs does not answer from its cache of earlier listings
+        infos = fs.ls(folder, detail=True, refresh=True)
+    except FileNotFoundError:
+        return []
+    return sorted(info['name'].rstrip("/").rsplit("/", 1)[-1] for info in infos if info['type'] == 'directory')
+
+
+def _day_of_year(day):
+    """
+    Day of the year of a day folder name, ex. '347_Dec.13' -> 347. None if not a day folder.
+    """
+
+    number = day.split("_", 1)[0]
+    return int(number) if number.isdigit() else None
+
+
+#####CLASSES#####
+class BucketCatalog:
+    """
+    SQLite catalog of the files in a bucket.
+    Example:
+        with BucketCatalog("coastcam catalog.db") as catalog:
+            catalog.refresh(['caco-01'])
+            keys = catalog.keys(station='caco-01', camera='c2', image_type='timex',
+                                start=datetime.date(2019, 12, 1), end=datetime.date(2020, 1, 1))
+    """
+
+    def __init__(self, db_path, bucket='cmgp-coastcam', fs=None):
+        """
+        Input:
+            db_path - (string) local filepath of the SQLite database. Created if it does not exist.
+            bucket - (string) name of the bucket
+            fs - fsspec filesystem used for refreshes. Default is the shared s3 filesystem.
+        """
+
+        self.db_path = db_path
+        self.bucket = bucket
+        self._fs = fs
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        #readers do not block the refresh, and the other way around
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = get_filesystem('s3', profile='coastcam')
+        return self._fs
+
+    def refresh_folder(self, folder, layout):
+        """
+        Add the files of a folder that are newer than the last refresh of that folder.
+        Input:
+            folder - (string) folder in the format "[bucket]/cameras/..." without "s3://"
+            layout - (string) 'products' or 'raw'
+        Output:
+            added - (int) number of files added or updated
+        """
+
+        row = self.connection.execute("SELECT last_filename FROM folders WHERE folder = ?", (folder,)).fetchone()
+        last_filename = row[0] if row is not None else None
+
+        added = 0
+        for page in iter_pages(self.fs, "s3://" + folder, start_after=last_filename):
+            rows = []
+            for info in page:
+                key = info['name'].lstrip("/")
+                parts = parse_source_filepath(key)
+                if parts is None:
+                    rows.append((key, None, None, None, None, None, layout, info.get('size'), info.get('ETag')))
+                else:
+                    rows.append((key, parts['station'], parts['camera'], parts['epoch'], parts['image_type'],
+                                 parts['extension'], layout, info.get('size'), info.get('ETag')))
+            if len(rows) == 0:
+                continue
+            last_filename = rows[-1][0].rsplit("/", 1)[-1]
+            #files and the folder position are saved together, so a stopped refresh continues from here
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.connection.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)",
+                                        (folder, last_filename, time.time()))
+            added += len(rows)
+
+        if added == 0 and row is None:
+            #empty folder. Saved so the raw layout knows it was synced
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)", (folder, None, time.time()))
+        return added
+
+    def _last_day_folder(self, camera_folder):
+        """
+        Get the (year, day of year) of the newest day folder of a camera that has been synced, or None.
+        """
+
+        newest = None
+        for (folder,) in self.connection.execute("SELECT folder FROM folders WHERE folder LIKE ?",
+                                                 (camera_folder + "/%",)):
+            elements = folder[len(camera_folder) + 1:].split("/")
+            #elements are [year], [day], 'raw'
+            if len(elements) != 3 or not elements[0].isdigit() or _day_of_year(elements[1]) is None:
+                continue
+            synced = (int(elements[0]), _day_of_year(elements[1]))
+            if newest is None or synced > newest:
+                newest = synced
+        return newest
+
+    def refresh_station(self, station):
+        """
+        Add the files of a station that are newer than the last refresh: the products folder and
+        the day folders of every camera, starting at the day folder synced last.
+        Input:
+            station - (string) station name, ex. 'caco-01'
+        Output:
+            added - (int) number of files added or updated
+        """
+
+        station_folder = self.bucket + "/cameras/" + station
+        added = 0
+        for name in _folder_names(self.fs, station_folder):
+            if name == 'products':
+                added += self.refresh_folder(station_folder + "/products", 'products')
+                continue
+
+            camera_folder = station_folder + "/" + name
+            newest = self._last_day_folder(camera_folder)
+            for year in _folder_names(self.fs, camera_folder):
+                if not year.isdigit() or (newest is not None and int(year) < newest[0]):
+                    continue
+                for day in _folder_names(self.fs, camera_folder + "/" + year):
+                    day_of_year = _day_of_year(day)
+                    if day_of_year is None or (newest is not None and (int(year), day_of_year) < newest):
+                        continue
+                    added += self.refresh_folder(camera_folder + "/" + year + "/" + day + "/raw", 'raw')
+        return added
+
+    def refresh(self, stations=None):
+        """
+        Refresh the catalog for several stations.
+        Input:
+            stations - (list of strings) station names, or None for every station in the bucket
+        Output:
+            added - (int) number of files added or updated
+        """
+
+        if stations is None:
+            stations = _folder_names(self.fs, self.bucket + "/cameras")
+        added = 0
+        for station in stations:
+            added += self.refresh_station(station)
+        return added
+
+    def _where(self, station, camera, image_type, start, end, layout):
+        """
+        WHERE clause and parameters for a query.
+        """
+
+        conditions = []
+        parameters = []
+        for column, value in (('station', station), ('camera', camera), ('image_type', image_type), ('layout', layout)):
+            if value is not None:
+                conditions.append(column + " = ?")
+                parameters.append(value)
+        if start is not None:
+            conditions.append("epoch >= ?")
+            parameters.append(to_epoch(start))
+        if end is not None:
+            conditions.append("epoch < ?")
+            parameters.append(to_epoch(end))
+        where = " WHERE " + " AND ".join(conditions) if len(conditions) > 0 else ""
+        return where, parameters
+
+    def find(self, station=None, camera=None, image_type=None, start=None, end=None, layout=None):
+        """
+        Find files in the catalog, in time order.
+        Input:
+            station - (string) optional station name, ex. 'caco-01'
+            camera - (string) optional camera, ex. 'c2'
+            image_type - (string) optional image type, ex. 'timex'
+            start - optional first time (unix time, datetime or date, see to_epoch())
+            end - optional time after the last file (not included)
+            layout - (string) optional 'products' or 'raw'
+        Output:
+            rows - (list of dicts) with keys COLUMNS
+        """
+
+        where, parameters = self._where(station, camera, image_type, start, end, layout)
+        cursor = self.connection.execute("SELECT " + ", ".join(COLUMNS) + " FROM objects" + where
+                                         + " ORDER BY epoch, key", parameters)
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def keys(self, station=None, camera=None, image_type=None, start=None, end=None, layout=None):
+        """
+        Same as find(), but only the filepaths, in the format "[bucket]/[key]".
+        """
+
+        where, parameters = self._where(station, camera, image_type, start, end, layout)
+        cursor = self.connection.execute("SELECT key FROM objects" + where + " ORDER BY epoch, key", parameters)
+        return [row[0] for row in cursor]
+
+    def count(self, station=None, camera=None, image_type=None, start=None, end=None, layout=None):
+        """
+        Same as find(), but only the number of files.
+        """
+
+        where, parameters = self._where(station, camera, image_type, start, end, layout)
+        return self.connection.execute("SELECT COUNT(*) FROM objects" + where, parameters).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+#####MAIN#####
+if __name__ == "__main__":
+    print("start:", datetime.datetime.now())
+    db_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/coastcam catalog.db"
+
+    with BucketCatalog(db_path) as catalog:
+        added = catalog.refresh(['caco-01'])
+        print("files added:", added)
+
+        #all timex for caco-01 c2 in Dec 2019
+        keys = catalog.keys(station='caco-01', camera='c2', image_type='timex', layout='products',
+                            start=datetime.date(2019, 12, 1), end=datetime.date(2020, 1, 1))
+        print("timex images:", len(keys))
+    print("end:", datetime.datetime.now())
@@ -1,8 +1,14 @@
 """
 Eric Swanson
 Purpose: Calculate the sunrise or sunset for a given day.
-Get date and time info from unix time.
-Using Marconi beach caco-01 camera location. Eastern time.
+Get date and time info from unix time (unix2datetime() in time_utils.py).
+Station locations are in STATION_LOCATIONS (Marconi beach caco-01 camera location, Eastern time).
+Sunrise and sunset are calculated with the National Oceanographic and Atmospheric Association (NOAA)
+solar position equations. sun_table() calculates every day of a year at once with NumPy and is
+cached for each location and year, so sunrise_sunset() and is_daylight() can look up an array of
+millions of unix times (ex. the times in image filenames) without calculating each image.
+Days are solar days at the location (centered on local noon), so the sunrise and sunset looked up
+for a time are always those of the daylight period closest to it, whatever the timezone.
 Calculations checked by National Oceanographic and Atmospheric Association sunrise/sunset calcualtor
 """
 
@@ -18,29 +24,146 @@ import imageio
 import calendar
 import datetime
 import csv
-from astral import LocationInfo
-from astral.sun import sun
+import functools
 from dateutil import tz
+from time_utils import unix2datetime, SECONDS_PER_DAY
+
+#####GLOBALS#####
+#station -> (latitude, longitude, timezone)
+STATION_LOCATIONS = {
+    'caco-01': (41.8918, -69.9611, "America/New_York"),
+}
+
+#sun is 0.833 degrees below the horizon at sunrise and sunset (refraction and size of the sun)
+SUNRISE_ZENITH = 90.833
+
 
 #####FUNCTIONS#####
-def unix2datetime(unixnumber):
+@functools.lru_cache(maxsize=256)
+def sun_table(latitude, longitude, year):
+    """
+    Calculate sunrise and sunset for every day of a year with the NOAA solar position equations.
+    Cached, so each location and year is only calculated once.
+    Input:
+        latitude - (float) latitude of the location
+        longitude - (float) longitude of the location (negative west of Greenwich)
+        year - (int) year
+    Output:
+        first_day - (int) days since 1970-01-01 of January 1 of the year
+        sunrise - (numpy array of float) unix time of sunrise for each day of the year
+        sunset - (numpy array of float) unix time of sunset for each day of the year
+        If the sun does not set (or rise) that day, sunrise and sunset are 12 hours before and after solar noon
+        (or both at solar noon).
+    """
+
+    first_day = int(np.datetime64(str(year), 'D').astype(np.int64))
+    last_day = int(np.datetime64(str(year + 1), 'D').astype(np.int64))
+    days = np.arange(first_day, last_day, dtype=np.float64)
+
+    #julian day and julian century at local noon
+    julian_day = days + 2440587.5 + 0.5 - longitude / 360.0
+    julian_century = (julian_day - 2451545.0) / 36525.0
+
+    mean_longitude = np.mod(280.46646 + julian_century * (36000.76983 + julian_century * 0.0003032), 360.0)
+    mean_anomaly = 357.52911 + julian_century * (35999.05029 - 0.0001537 * julian_century)
+    eccentricity = 0.016708634 - julian_century * (0.000042037 + 0.0000001267 * julian_century)
+    anomaly_radians = np.radians(mean_anomaly)
+    equation_of_center = (np.sin(anomaly_radians) * (1.914602 - julian_century * (0.004817 + 0.000014 * julian_century))
+                          + np.sin(2 * anomaly_radians) * (0.019993 - 0.000101 * julian_century)
+                          + np.sin(3 * anomaly_radians) * 0.000289)
+    true_longitude = mean_longitude + equation_of_center
+    omega = np.radians(125.04 - 1934.136 * julian_century)
+    apparent_longitude = true_longitude - 0.00569 - 0.00478 * np.sin(omega)
+    mean_obliquity = 23.0 + (26.0 + (21.448 - julian_century * (46.815 + julian_century * (0.00059 - julian_century * 0.001813))) / 60.0) / 60.0
+    obliquity = np.radians(mean_obliquity + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(np.radians(apparent_longitude)))
+
+    #equation of time in minutes
+    y = np.tan(obliquity / 2) ** 2
+    longitude_radians = np.radians(mean_longitude)
+    equation_of_time = 4 * np.degrees(y * np.sin(2 * longitude_radians)
+                                      - 2 * eccentricity * np.sin(anomaly_radians)
+                                      + 4 * eccentricity * y * np.sin(anomaly_radians) * np.cos(2 * longitude_radians)
+                                      - 0.5 * y * y * np.sin(4 * longitude_radians)
+                                      - 1.25 * eccentricity * eccentricity * np.sin(2 * anomaly_radians))
+
+    #hour angle of sunrise. Clipped for days when the sun does not rise or set (above the arctic circle)
+    latitude_radians = np.radians(latitude)
+    cos_hour_angle = (np.cos(np.radians(SUNRISE_ZENITH)) / (np.cos(latitude_radians) * np.cos(declination))
+                      - np.tan(latitude_radians) * np.tan(declination))
+    hour_angle = np.degrees(np.arccos(np.clip(cos_hour_angle, -1.0, 1.0)))
+
+    #minutes after midnight UTC
+    solar_noon = 720.0 - 4.0 * longitude - equation_of_time
+    day_starts = days * SECONDS_PER_DAY
+    sunrise = day_starts + (solar_noon - 4.0 * hour_angle) * 60.0
+    sunset = day_starts + (solar_noon + 4.0 * hour_angle) * 60.0
+    return first_day, sunrise, sunset
+
+
+def solar_days(unix_times, longitude):
+    """
+    Get the day (days since 1970-01-01) of unix times, with days starting at local midnight by the
+    sun (12 hours before solar noon) instead of midnight UTC.
+    Input:
+        unix_times - (numpy array of int or float) unix times
+        longitude - (float) longitude of the location
+    Output:
+        days - (numpy array of int64) day of each time
+    """
+
+    return np.floor_divide(np.asarray(unix_times, dtype=np.float64) + longitude * 240.0, SECONDS_PER_DAY).astype(np.int64)
+
+
+def sunrise_sunset(unix_times, latitude, longitude):
+    """
+    Get the sunrise and sunset of the day of each unix time, for many times at once.
+    Input:
+        unix_times - (numpy array or list of int) unix times, ex. from image filenames
+        latitude - (float) latitude of the location
+        longitude - (float) longitude of the location
+    Output:
+        sunrise - (numpy array of float) unix time of sunrise for each time
+        sunset - (numpy array of float) unix time of sunset for each time
+    """
+
+    days = solar_days(unix_times, longitude)
+    sunrise = np.empty(days.shape, dtype=np.float64)
+    sunset = np.empty(days.shape, dtype=np.float64)
+    years = days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+    for year in np.unique(years).tolist():
+        in_year = years == year
+        first_day, year_sunrise, year_sunset = sun_table(float(latitude), float(longitude), year)
+        index = days[in_year] - first_day
+        sunrise[in_year] = year_sunrise[index]
+        sunset[in_year] = year_sunset[index]
+    return sunrise, sunset
+
+
+def is_daylight(unix_times, latitude, longitude):
     """
-    Developed from unix2dts by Chris Sherwood. Updates by Eric Swanson.
-    Get datetime object and string (in UTC) from unix/epoch time. datetime object is "aware",
-    meaning it always references a specific point in time rather than a time relative to local time.
-    datetime object will be the same regardless of what timezone the function is run in.
+    Check which unix times are between sunrise and sunset.
     Input:
-        unixnumber - string containing unix time (aka epoch)
-    Returns:
-        date_time_string, date_time_object in utc
+        unix_times - (numpy array or list of int) unix times
+        latitude - (float) latitude of the location
+        longitude - (float) longitude of the location
+    Output:
+        daylight - (numpy array of bool) True for times between sunrise and sunset
     """
 
-    # images other than "snaps" end in 1, 2,...but these are not part of the time stamp.
-    # replace with zero
-    ts = int( unixnumber[:-1]+'0')
-    date_time_obj =  datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
-    date_time_str = date_time_obj.strftime('%Y-%m-%d %H:%M:%S')
-    return date_time_str, date_time_obj
+    unix_times = np.asarray(unix_times, dtype=np.float64)
+    sunrise, sunset = sunrise_sunset(unix_times, latitude, longitude)
+    return (unix_times >= sunrise) & (unix_times <= sunset)
+
+
+def station_sunrise_sunset(unix_times, station):
+    """
+    Same as sunrise_sunset(), using the location of a station in STATION_LOCATIONS.
+    """
+
+    latitude, longitude, timezone = STATION_LOCATIONS[station]
+    return sunrise_sunset(unix_times, latitude, longitude)
+
 
 def getSunriseSunset(unix_time, latitude, longitude, timezone, city = "", country = "United States"):
     """
@@ -51,40 +174,30 @@ def getSunriseSunset(unix_time, latitude, longitude, timezone, city = "", countr
         latitude - (float) latitude of the location
         longitude - (longitude) of the location
         timezone - (string) timezone of the location
-        city (optional) - (string) city where user wants to get sunrise and sunset for
-        Country (optional) - (string) country of location. Can assume United States for most part
+        city (optional) - (string) city where user wants to get sunrise and sunset for. Not used in the calculation.
+        Country (optional) - (string) country of location. Not used in the calculation.
     Outputs:
         sunrise - (string) time of sunrise in format HH:MM:SS
         sunset - (string) time of sunset in format HH:MM:SS
     """
 
-    #Get datetime object. Returned object is in UTC, must convert to local.
-    date_time_str, date_time_obj = unix2datetime(str(unix_time))
-    #convert to EST
-
-    #get sunrise and sunset
-    #Need to first describe location with astral LocationInfo object
-    #Then use astral sun object with attributes sunrise and sunset
-    #sun object is a dictionary
-    loc = LocationInfo(city, country, timezone, 41.8918, -69.9611)
-    s = sun(loc.observer, date = date_time_obj, tzinfo = loc.timezone)
-    #extract hour, minute, second of sunrise/sunset
-    sunrise = str(s["sunrise"])[11:19]
-    sunset = str(s["sunset"])[11:19]
+    #get sunrise and sunset in unix time from the table of that year
+    sunrise, sunset = sunrise_sunset([unix_time], latitude, longitude)
+
+    #convert to local time and extract hour, minute, second of sunrise/sunset
+    local_zone = tz.gettz(timezone)
+    sunrise = datetime.datetime.fromtimestamp(round(sunrise[0]), tz=local_zone).strftime('%H:%M:%S')
+    sunset = datetime.datetime.fromtimestamp(round(sunset[0]), tz=local_zone).strftime('%H:%M:%S')
     return sunrise, sunset
-    
 
 
-#####MAIN#####
 
-#December 13, 2019 6:00pm GMT (2pm EST)
-unix_time = 1576260000
-latitude = 41.8918
-longitude = -69.9611
-timezone = "America/New_York"
-
-sunrise, sunset = getSunriseSunset(unix_time, latitude, longitude, timezone, "Wellfleet", "United States")
-print("Sunrise:", sunrise + ", Timezone:", timezone)
-print("Sunset:", sunset + ", Timezone:", timezone)
-        
+#####MAIN#####
+if __name__ == "__main__":
+    #December 13, 2019 6:00pm GMT (2pm EST)
+    unix_time = 1576260000
+    latitude, longitude, timezone = STATION_LOCATIONS['caco-01']
 
+    sunrise, sunset = getSunriseSunset(unix_time, latitude, longitude, timezone, "Wellfleet", "United States")
+    print("Sunrise:", sunrise + ", Timezone:", timezone)
+    print("Sunset:", sunset + ", Timezone:", timezone)
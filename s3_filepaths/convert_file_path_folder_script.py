@@ -7,13 +7,14 @@ The new filepath is in the format s3:/cmgp-coastcam/cameras/[station]/[camera]/[
 day is the format ddd_mmm.nn. ddd is 3-digit number describing day in the year.
 mmm is 3 letter abbreviation of month. nn is 2 digit number of day of month.
 filenames are in the format [unix datetime].[camera in format c#].[file format].jpg
-This script splits up the filepath of the old path to be used in the new path. The elements used in the
-new path are the [station] and [long filename]. Then it plits up the filename to get elements used in the new path.
-[unix datetime] is used to get [year], [day], and [camera]. unix2datetime() converts the unix time in the filename
-to a human-readable datetime object and string. Once the new filepath is created, the S3 buckets are accessed using
+The new path is made by plan_dest_path() in path_planner.py, which splits up the old path and the filename.
+[station] and [long filename] come from the old path. [unix datetime] is used to get [year] and [day], and
+[camera] comes from the filename. Once the new filepath is created, the S3 buckets are accessed using
 fsspec and the image is copied from one path to another use the fsspec copy() method. This is done using the function
 copy_s3_image(). Only common image type files will be copied.
-write2csv() is used to write the source and destination filepath to a csv file.
+CopyLogWriter in copy_log.py writes the source and destination filepath to a csv file as images are copied.
+If skip_existing is True, images that are already in their new day folder with the same size and ETag
+are not copied again. Each day folder is listed once by DestinationIndex in dest_index.py.
 """
 ##### REQUIERD PACKAGES #####
 import numpy as np
@@ -21,32 +22,17 @@ import os
 import time
 #will need fs3 package to use s3 in fsspec
 import fsspec 
+from copy_log import CopyLogWriter
+from filesystem_manager import get_filesystem
+from path_planner import plan_dest_path, check_image
+from s3_listing import iter_objects
+from dest_index import DestinationIndex
+from daylight_filter import filter_daylight, check_station, station_of, NIGHT_MESSAGE
 import numpy as np
 import imageio
-import calendar
 import datetime
-import csv
 
 ##### FUNCTIONS #####
-def unix2datetime(unixnumber):
-    """
-    Developed from unix2dts by Chris Sherwood. Updates by Eric Swanson.
-    Get datetime object and string (in UTC) from unix/epoch time. datetime object is "aware",
-    meaning it always references a specific point in time rather than a time relative to local time.
-    datetime object will be the same regardless of what timezone the function is run in.
-    Input:
-        unixnumber - string containing unix time (aka epoch)
-    Returns:
-        date_time_string, date_time_object in utc
-    """
-
-    # images other than "snaps" end in 1, 2,...but these are not part of the time stamp.
-    # replace with zero
-    ts = int( unixnumber[:-1]+'0')
-    date_time_obj =  datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
-    date_time_str = date_time_obj.strftime('%Y-%m-%d %H:%M:%S')
-    return date_time_str, date_time_obj
-
 def copy_s3_image(source_filepath):
     """
     Copy an image file from its old filepath in the S3 bucket with the format
@@ -55,89 +41,22 @@ def copy_s3_image(source_filepath):
     day is in the format day is the format ddd_mmm.nn. ddd is 3-digit number describing day in the year.
     mmm is 3 letter abbreviation of month. nn is 2 digit number of day of month.
     filenames are in the format [unix datetime].[camera in format c#].[file format].[image format]
-    New filepath is created and returned as a string by this function.
+    New filepath is made by plan_dest_path() in path_planner.py and returned as a string by this function.
     Input:
         source_filepath - (string) current filepath of image where the image will be copied from.
     Output:
         dest_filepath - (string) new filepath image is copied to.
     """
 
-    old_path_elements = source_filepath.split("/")
-
-    #remove empty space elements from the list
-    #list will have 5 elements: "[bucket]", "cameras", "[station]", "products", "[image filename]"
-    for elements in old_path_elements:
-        #if string element is ''
-        if len(elements) == 0: 
-            old_path_elements.remove(elements)
-
-    bucket = old_path_elements[1]
-    station = old_path_elements[3]
-    filename = old_path_elements[5]
-
-    #splits up elements of filename into a list
-    filename_elements = filename.split(".")
+    dest_filepath = plan_dest_path(source_filepath)
     #check to see if filename is properly formatted
-    if len(filename_elements) != 4:
+    if dest_filepath is None:
         return 'Not properly formatted. Not copied.'
-    else:
-        image_unix_time = filename_elements[0]
-        image_camera = filename_elements[1] 
-        image_type = filename_elements[2]
-        image_file_type = filename_elements[3]
-
-        #convert unix time to date-time str in the format "yyyy-mm-dd HH:MM:SS"
-        image_date_time, date_time_obj = unix2datetime(image_unix_time) 
-        year = image_date_time[0:4]
-        month = image_date_time[5:7]
-        day = image_date_time[8:10]
-        
-        #day format for new filepath will have to be in format ddd_mmm.nn
-        #use built-in python function to convert from known variables to new date
-        #timetuple() method returns tuple with several date and time attributes. tm_yday is the (attribute) day of the year
-        day_of_year = str(datetime.date(int(year), int(month), int(day)).timetuple().tm_yday)
-
-        #can use built-in calendar attribute month_name[month] to get month name from a number. Month cannot have leading zeros
-        #get full month in word form
-        month_word = calendar.month_name[int(month)]
-        #month in the mmm word form
-        month_formatted = month_word[0:3] 
-
-        new_format_day = day_of_year + "_" + month_formatted + "." + day
-        
-        new_filepath = "s3:/" + "/" + bucket + "/cameras/" + station + "/" + image_camera + "/" + year + "/" + new_format_day + "/raw/" #file not included
-        dest_filepath = new_filepath + filename
 
-        #Use fsspec to copy image from old path to new path
-        fs = fsspec.filesystem('s3', profile='coastcam')
-        fs.copy(source_filepath, dest_filepath)
-        return dest_filepath
-
-
-def write2csv(csv_list, csv_path):
-    """
-    Write data pertaining to the copied image files to a csv speified by the user.
-    Input:
-        csv_list - list (of lists) containing data to be written to csv. Each list includes source filepath & destination filepath
-        csv_path - desried location of generated csv file
-    Return:
-        None. However, csv file will appear in filepath the user specified.
-    """
-
-    #header
-    fieldnames = ['source filepath', 'destination filepath'] 
-
-    #datetime info for naming csv
-    now = datetime.datetime.now()
-    now_string = now.strftime("%d-%m-%Y %H_%M_%S")
-    csv_name = csv_path + 'image copy log ' + now_string + '.csv'
-
-    #write to file
-    with open(csv_name, 'w', encoding='UTF8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(fieldnames)
-        writer.writerows(csv_list)
-    return 
+    #Use fsspec to copy image from old path to new path. Filesystem is shared between calls
+    fs = get_filesystem('s3', profile='coastcam')
+    fs.copy(source_filepath, dest_filepath)
+    return dest_filepath
 
 
 ##### MAIN #####
@@ -145,29 +64,35 @@ print("start:", datetime.datetime.now())
 #source folder filepath with format s3:/cmgp-coastcam/cameras/[station]/products/[filename]
 source_folder = "s3://cmgp-coastcam/cameras/nuvuk/products/"  
 
-#access list of images in source folder using fsspec
+#access list of images in source folder using fsspec. Listed page by page as the images are copied
 #station caco-01 for testing
-fs = fsspec.filesystem('s3', profile='coastcam')
-image_list = fs.glob(source_folder+'/*')
+fs = get_filesystem('s3', profile='coastcam')
+#file info (filepath, size, ETag) of each file
+image_list = iter_objects(fs, source_folder)
 
-#list of common image types
-common_image_list = ['.tif', '.tiff', '.bmp', 'jpg', '.jpeg', '.gif', '.png', '.eps', 'raw', 'cr2', '.nef', '.orf', '.sr2']
+#skip images already copied to their new filepath (ex. when re-running a station)
+skip_existing = False
+dest_index = DestinationIndex(fs)
 
-#used to track copied images in a csv
+#used to track copied images in a csv. Rows are written while the images are copied
 csv_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/"
-csv_list = []
+copy_log = CopyLogWriter(csv_path)
+
+#only copy images taken between sunrise and sunset (daylight_filter.py)
+daylight_only = False
+if daylight_only:
+    #stop now if the sunrise and sunset of the station can not be calculated
+    check_station(station_of(source_folder))
+    image_list = filter_daylight(image_list, key=lambda image_info: image_info['name'],
+                                 on_night=lambda image_info: copy_log.write("s3://" + image_info['name'], NIGHT_MESSAGE))
 
 #loop through folder of images
 #check if image is of proper file types
 #if so, copy images
-for image in image_list:
-    #loop through list of possible image types
-    for image_type in common_image_list: 
-        #variable to check if file ends with image type in common_image_list
-        good_ending = False 
-        if image.endswith(image_type):
-            good_ending = True
-            break
+for image_info in image_list:
+    image = image_info['name']
+    #check if file ends with one of the image types in path_planner.common_image_list
+    good_ending = check_image(image)
     if image.endswith('.txt') or good_ending == False:
         #This is not an image. Skip file
         continue
@@ -176,20 +101,20 @@ for image in image_list:
         #get source and destination filepaths
         #copy images
         source_filepath = "s3://" + image
-        dest_filepath = copy_s3_image(source_filepath)
-
-        csv_entry = [source_filepath, dest_filepath]
-        csv_list.append(csv_entry)
-
-#create csv file
-now = datetime.datetime.now()
-now_string = now.strftime("%d-%m-%Y %H_%M_%S")
-csv_name = 'image copy log ' + now_string + '.csv'
-write2csv(csv_list, csv_path)
-print("end:", datetime.datetime.now())
-
-
 
+        #check if already copied. Lists the day folder the first time it is needed
+        if skip_existing:
+            planned_filepath = plan_dest_path(source_filepath)
+            if planned_filepath is not None and \
+                    dest_index.has_copy(planned_filepath, image_info['size'], image_info['ETag']):
+                copy_log.write(source_filepath, 'Already copied. Not copied again.')
+                continue
 
+        dest_filepath = copy_s3_image(source_filepath)
 
+        copy_log.write(source_filepath, dest_filepath)
 
+#write the last rows and close the csv file
+copy_log.close()
+print("day folders listed:", dest_index.folders_listed)
+print("end:", datetime.datetime.now())
@@ -7,205 +7,267 @@ The new filepath is in the format s3:/cmgp-coastcam/cameras/[station]/[camera]/[
 day is the format ddd_mmm.nn. ddd is 3-digit number describing day in the year.
 mmm is 3 letter abbreviation of month. nn is 2 digit number of day of month.
 filenames are in the format [unix datetime].[camera in format c#].[file format].jpg
-This script splits up the filepath of the old path to be used in the new path. The elements used in the
-new path are the [station] and [long filename]. Then it plits up the filename to get elements used in the new path.
-[unix datetime] is used to get [year], [day], and [camera]. unix2datetime() converts the unix time in the filename
-to a human-readable datetime object and string. Once the new filepath is created, the S3 buckets are accessed using
+The new path is made by plan_dest_path() in path_planner.py, which splits up the old path and the filename.
+[station] and [long filename] come from the old path. [unix datetime] is used to get [year] and [day], and
+[camera] comes from the filename. Once the new filepath is created, the S3 buckets are accessed using
 fsspec and the image is copied from one path to another use the fsspec copy() method. This is done using the function
-copy_s3_image(). Only common image type files will be copied. Images are copied using multithreading
-in the concurrent.futures module.
-write2csv() is used to write the source and destination filepath to a csv file.
+copy_s3_image(). Objects larger than multipart_threshold (ex. raw frames) are copied in parts at the same
+time (multipart_copy.py). Only common image type files will be copied. Images are copied using multithreading
+with the CopyEngine in copy_engine.py, which retries throttled copies and adapts how many copies run at once.
+Setting copy_mode to 'async' copies with the asyncio API of s3fs instead (see async_copy.py).
+CopyLogWriter in copy_log.py writes the source and destination filepath to a csv file as images are copied.
+Setting transfer_mode to 'move' also deletes each old filepath once its copy is verified (see source_remover.py).
+Set metrics_port to see how long listing, planning, copying, writing the journal and writing the log take
+while the script is running (migration_metrics.py).
 """
 ##### REQUIERD PACKAGES #####
 import os
 import time
 #will need fs3 package to use s3 in fsspec
 import fsspec 
+from copy_log import CopyLogWriter
+from filesystem_manager import get_filesystem, set_pool_size, DEFAULT_MAX_WORKERS
+from path_planner import plan_dest_path, check_image
+from s3_listing import iter_objects
+from copy_journal import CopyJournal
+from copy_engine import CopyEngine
+from async_copy import run_async_copy
+from daylight_filter import filter_daylight, daylight_image, check_station, station_of, NIGHT_MESSAGE
+from migration_metrics import MetricsRegistry, optional_timer
+from multipart_copy import copy_object, note_large_objects, DEFAULT_MULTIPART_THRESHOLD, DEFAULT_PART_SIZE
+from source_remover import SourceRemover, note_sources
 import imageio
-import calendar
 import datetime
-import csv
-import concurrent.futures
 
 ##### FUNCTIONS #####
-def unix2datetime(unixnumber):
+def get_dest_filepath(source_filepath):
     """
-    Developed from unix2dts by Chris Sherwood. Updates by Eric Swanson.
-    Get datetime object and string (in UTC) from unix/epoch time. datetime object is "aware",
-    meaning it always references a specific point in time rather than a time relative to local time.
-    datetime object will be the same regardless of what timezone the function is run in.
+    Get the new filepath for an image file with the old filepath in the S3 bucket with the format
+    s3://[bucket]/cameras/[station]/products/[long filename]. The new filepath has the format
+    s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/[filename]
+    day is in the format day is the format ddd_mmm.nn. ddd is 3-digit number describing day in the year.
+    mmm is 3 letter abbreviation of month. nn is 2 digit number of day of month.
+    filenames are in the format [unix datetime].[camera in format c#].[file format].[image format]
+    New filepath is made by plan_dest_path() in path_planner.py. Nothing is copied.
     Input:
-        unixnumber - string containing unix time (aka epoch)
-    Returns:
-        date_time_string, date_time_object in utc
+        source_filepath - (string) current filepath of image (as returned by fs.glob(), without "s3://")
+    Output:
+        dest_filepath - (string) new filepath of the image, or a message if the image should not be copied.
     """
 
-    # images other than "snaps" end in 1, 2,...but these are not part of the time stamp.
-    # replace with zero
-    ts = int( unixnumber[:-1]+'0')
-    date_time_obj =  datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
-    date_time_str = date_time_obj.strftime('%Y-%m-%d %H:%M:%S')
-    return date_time_str, date_time_obj
+    #if not image, return message. Will be logged in csv
+    if not check_image(source_filepath):
+        return 'Not an image. Not copied.'
+
+    dest_filepath = plan_dest_path(source_filepath)
+    #check to see if filename is properly formatted
+    if dest_filepath is None:
+        return 'Not properly formatted. Not copied.'
+    return dest_filepath
 
-def check_image(file):
+
+def copy_s3_image(source_filepath, size=None):
     """
-    Check if the file is an image (of the proper type)
+    Copy an image file from its old filepath in the S3 bucket with the format
+    s3://[bucket]/cameras/[station]/products/[long filename]. to a new filepath with the format
+    s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/[filename]
+    New filepath is made by get_dest_filepath().
     Input:
-        file - (string) filepath of the file to be checked
+        source_filepath - (string) current filepath of image where the image will be copied from.
+        size - (int) size of the image in bytes, from the listing. Images larger than multipart_threshold
+               are copied in parts. If None, the size is looked up with a HEAD request.
     Output:
-        good_ending - (bool) variable saying whether or not file is an image
+        dest_filepath - (string) new filepath image is copied to.
     """
-    
-    #list of common image types
-    common_image_list = ['.tif', '.tiff', '.bmp', 'jpg', '.jpeg', '.gif', '.png', '.eps', 'raw', 'cr2', '.nef', '.orf', '.sr2']
-    
-    #good_ending is variable used to check if file is image. True if file is an image
-    good_ending = False
-    for image_type in common_image_list:
-        if file.endswith(image_type):
-            good_ending = True
-    return good_ending
-        
 
-def copy_s3_image(source_filepath):
+    #planning and copying are timed separately when metrics is set
+    with optional_timer(metrics, 'plan_seconds'):
+        dest_filepath = get_dest_filepath(source_filepath)
+
+    #messages for files that are not copied do not start with s3://
+    if dest_filepath.startswith("s3://"):
+        #Use fsspec to copy image from old path to new path. Filesystem is shared between calls and threads
+        fs = get_filesystem('s3', profile='coastcam')
+        with optional_timer(metrics, 'copy_seconds'):
+            copy_object(fs, "s3://" + source_filepath, dest_filepath, size, multipart_threshold, part_size)
+    return dest_filepath
+
+
+def copy_and_record(source_filepath, journal):
     """
-    Copy an image file from its old filepath in the S3 bucket with the format
-    s3://[bucket]/cameras/[station]/products/[long filename]. to a new filepath with the format
-    s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/[filename]
-    day is in the format day is the format ddd_mmm.nn. ddd is 3-digit number describing day in the year.
-    mmm is 3 letter abbreviation of month. nn is 2 digit number of day of month.
-    filenames are in the format [unix datetime].[camera in format c#].[file format].[image format]
-    New filepath is created and returned as a string by this function.
+    Copy an image with copy_s3_image() and record the copy in the journal. Runs in the worker threads.
     Input:
         source_filepath - (string) current filepath of image where the image will be copied from.
+        journal - (CopyJournal) journal of finished copies
     Output:
         dest_filepath - (string) new filepath image is copied to.
     """
-    
-    good_ending = check_image(source_filepath)
-
-    #if image, go ahead and copy
-    if good_ending == True:
-        source_filepath = "s3://" + source_filepath
-        old_path_elements = source_filepath.split("/")
-
-        #remove empty space elements from the list
-        #list will have 5 elements: "[bucket]", "cameras", "[station]", "products", "[image filename]"
-        for elements in old_path_elements:
-            #if string element is ''
-            if len(elements) == 0: 
-                old_path_elements.remove(elements)
-
-        bucket = old_path_elements[1]
-        station = old_path_elements[3]
-        filename = old_path_elements[5]
-
-        #splits up elements of filename into a list
-        filename_elements = filename.split(".")
-        #check to see if filename is properly formatted
-        if len(filename_elements) != 4:
-            return 'Not properly formatted. Not copied.'
-        else:
-            image_unix_time = filename_elements[0]
-            image_camera = filename_elements[1] 
-            image_type = filename_elements[2]
-            image_file_type = filename_elements[3]
-
-            #convert unix time to date-time str in the format "yyyy-mm-dd HH:MM:SS"
-            image_date_time, date_time_obj = unix2datetime(image_unix_time) 
-            year = image_date_time[0:4]
-            month = image_date_time[5:7]
-            day = image_date_time[8:10]
-            
-            #day format for new filepath will have to be in format ddd_mmm.nn
-            #use built-in python function to convert from known variables to new date
-            #timetuple() method returns tuple with several date and time attributes. tm_yday is the (attribute) day of the year
-            day_of_year = str(datetime.date(int(year), int(month), int(day)).timetuple().tm_yday)
-
-            #can use built-in calendar attribute month_name[month] to get month name from a number. Month cannot have leading zeros
-            #get full month in word form
-            month_word = calendar.month_name[int(month)]
-            #month in the mmm word form
-            month_formatted = month_word[0:3] 
-
-            new_format_day = day_of_year + "_" + month_formatted + "." + day
-            
-            new_filepath = "s3:/" + "/" + bucket + "/cameras/" + station + "/" + image_camera + "/" + year + "/" + new_format_day + "/raw/" #file not included
-            dest_filepath = new_filepath + filename
-
-            #Use fsspec to copy image from old path to new path
-            fs = fsspec.filesystem('s3', profile='coastcam')
-            fs.copy(source_filepath, dest_filepath)
-            return dest_filepath
-    #if not image, return blank string. Will be used to determine if file copy needs to be logged in csv
-    else:
-        return 'Not an image. Not copied.'
+
+    #images not in large_sizes were listed as smaller than multipart_threshold
+    dest_filepath = copy_s3_image(source_filepath, large_sizes.get(source_filepath, 0))
+    large_sizes.pop(source_filepath, None)
+    with optional_timer(metrics, 'record_seconds'):
+        journal.record(source_filepath, dest_filepath)
+    return dest_filepath
 
 
-def write2csv(csv_list, csv_path):
+def pending_images(image_list, journal, source_infos, remover=None):
     """
-    Write data pertaining to the copied image files to a csv speified by the user.
+    Generator of the images in image_list that are not in the journal yet. Images copied by an earlier
+    run are dropped from large_sizes and source_infos, so these only hold images still to be copied.
+    With a remover, they are passed to the remover, so their old filepath is deleted once the copy is verified.
     Input:
-        csv_list - list (of lists) containing data to be written to csv. Each list includes source filepath & destination filepath
-        csv_path - desried location of generated csv file
-    Return:
-        None. However, csv file will appear in filepath the user specified.
+        image_list - iterable of source filepaths
+        journal - (CopyJournal) journal of finished copies
+        source_infos - (dict) source filepath -> file info from the listing
+        remover - (SourceRemover) optional
+    Output:
+        source filepaths that still need to be copied
     """
 
-    #header
-    fieldnames = ['source filepath', 'destination filepath'] 
+    for image in image_list:
+        if journal.is_finished(image):
+            large_sizes.pop(image, None)
+            source_info = source_infos.pop(image, None)
+            if remover is not None:
+                remover.add(source_info, journal.finished[image])
+        else:
+            yield image
 
-    #datetime info for naming csv
-    now = datetime.datetime.now()
-    now_string = now.strftime("%d-%m-%Y %H_%M_%S")
-    csv_name = csv_path + 'image copy log ' + now_string + '.csv'
 
-    #write to file
-    with open(csv_name, 'w', encoding='UTF8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(fieldnames)
-        writer.writerows(csv_list)
+def record_copy(source_filepath, dest_filepath, ok, journal, copy_log):
+    """
+    Record a finished file in the journal and the csv log. Failed copies are only written to the csv log,
+    so they are tried again by a later run.
+    Used by the async copy mode, where copies finish on the event loop.
+    Input:
+        source_filepath - (string) filepath the image was copied from (without "s3://")
+        dest_filepath - (string) filepath the image was copied to, or message if not copied
+        ok - (bool) False if the copy failed
+        journal - (CopyJournal) journal of finished copies
+        copy_log - (CopyLogWriter) csv log of copied images
+    Output:
+        None
+    """
+
+    if ok:
+        journal.record(source_filepath, dest_filepath)
+    copy_log.write("s3://" + source_filepath, dest_filepath)
     return
-     
+
 
 ##### MAIN #####
 print("start:", datetime.datetime.now())
+#number of threads copying images. Connection pool of the shared filesystem is sized to match
+max_workers = DEFAULT_MAX_WORKERS
+set_pool_size(max_workers)
+
+#'thread' copies with worker threads. 'async' copies on one asyncio event loop with up to async_concurrency
+#copies at once, starting as soon as the first page of the listing arrives
+copy_mode = 'thread'
+async_concurrency = 1000
+
+#objects larger than multipart_threshold bytes are copied in parts of part_size bytes at the same time
+multipart_threshold = DEFAULT_MULTIPART_THRESHOLD
+part_size = DEFAULT_PART_SIZE
+#size of each large object from the listing, until it is copied
+large_sizes = {}
+
+#'copy' leaves the old filepaths in place. 'move' deletes each old filepath once its copy is verified,
+#with one DeleteObjects request for up to 1000 images. Only done with copy_mode 'thread'
+transfer_mode = 'copy'
+if transfer_mode == 'move' and copy_mode != 'thread':
+    raise ValueError("transfer_mode 'move' needs copy_mode 'thread'")
+
+#only copy images taken between sunrise and sunset (daylight_filter.py)
+daylight_only = False
+
 #source folder filepath with format s3:/cmgp-coastcam/cameras/[station]/products/[filename]
 source_folder = "s3://cmgp-coastcam/cameras/whidbey/products/"  
+if daylight_only:
+    #stop now if the sunrise and sunset of the station can not be calculated
+    check_station(station_of(source_folder))
 
-#access list of images in source folder using fsspec
-#station caco-01 for testing
-fs = fsspec.filesystem('s3', profile='coastcam')
-image_list = fs.glob(source_folder+'/*')
-
-#list of common image types
-common_image_list = ['.tif', '.tiff', '.bmp', 'jpg', '.jpeg', '.gif', '.png', '.eps', 'raw', 'cr2', '.nef', '.orf', '.sr2']
+#serve timing of each stage at http://localhost:[metrics_port]/metrics, and write it to a json file in csv_path
+#at the end. None turns the timing off
+metrics_port = None
+metrics = MetricsRegistry() if metrics_port is not None else None
+if metrics is not None:
+    metrics.serve(metrics_port)
 
-#used to track copied images in a csv
+#used to track copied images in a csv. Rows are written while the images are copied
 csv_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/"
-csv_list = []
+copy_log = CopyLogWriter(csv_path, metrics=metrics)
 
-#ProcessPoolExecutor is used for multithreading (allows multiple instances of function to be run at once)
-#result contains filepaths that were copied (in order that they exist in image_list)
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    results = executor.map(copy_s3_image, image_list)
+#journal of images already copied. Keep the same journal between runs to pick up where the script left off
+journal_path = csv_path + "whidbey copy journal.log"
+journal = CopyJournal(journal_path)
+print("images already copied:", len(journal))
 
-    #iterate over outputted destination filepaths. Need to iterate  i because results is a generator, not a list.
-    #create csv entry pairs from source and destination filepaths. This includes non-image files.
-    i = 0
-    for dest_filepath in results:
-        source_filepath = "s3://" + image_list[i]
-        csv_entry = [source_filepath, dest_filepath]
-        csv_list.append(csv_entry)
-        i = i + 1
-        
-#create csv file
-now = datetime.datetime.now()
-now_string = now.strftime("%d-%m-%Y %H_%M_%S")
-csv_name = 'image copy log ' + now_string + '.csv'
-write2csv(csv_list, csv_path)
-print("end:", datetime.datetime.now())
+if copy_mode == 'async':
+    #listing is done page by page inside run_async_copy(). Images in the journal are not copied again.
+    #night images are skipped without being written to the journal, so they can be copied by a later run
+    if daylight_only:
+        skip_func = lambda source_filepath: journal.is_finished(source_filepath) or not daylight_image(source_filepath)
+    else:
+        skip_func = journal.is_finished
+    stats = run_async_copy(source_folder, get_dest_filepath, concurrency=async_concurrency, profile='coastcam',
+                           skip_func=skip_func, report_every=60, multipart_threshold=multipart_threshold,
+                           part_size=part_size, metrics=metrics,
+                           on_result=lambda source_filepath, dest_filepath, ok: record_copy(
+                               source_filepath, dest_filepath, ok, journal, copy_log))
+    print(stats)
+else:
+    #access list of images in source folder using fsspec. Listed page by page as the images are copied
+    #station caco-01 for testing
+    fs = get_filesystem('s3', profile='coastcam')
+    objects = iter_objects(fs, source_folder, metrics=metrics)
+
+    #in move mode, the listing of each image is kept until its copy is handed to the remover.
+    #sources that are not deleted are written to the csv log
+    source_infos = {}
+    remover = None
+    if transfer_mode == 'move':
+        objects = note_sources(objects, source_infos)
+        remover = SourceRemover(fs, on_error=lambda source_filepath, message: copy_log.write(
+            "s3://" + source_filepath, message))
+    image_list = note_large_objects(objects, large_sizes, multipart_threshold)
+
+    #images in the journal are not copied again
+    image_list = pending_images(image_list, journal, source_infos, remover)
 
+    #night images are written to the csv log but not to the journal, so they can be copied by a later run
+    def skip_night(image):
+        large_sizes.pop(image, None)
+        source_infos.pop(image, None)
+        copy_log.write("s3://" + image, NIGHT_MESSAGE)
 
+    if daylight_only:
+        image_list = filter_daylight(image_list, on_night=skip_night)
 
+    #CopyEngine runs max_workers threads. Throttled copies are retried with backoff and the number of
+    #copies running at once is cut back while S3 is throttling.
+    #results are (source filepath, destination filepath) in the order the copies finish
+    engine = CopyEngine(lambda source_filepath: copy_and_record(source_filepath, journal),
+                        max_workers=max_workers, report_every=60, metrics=metrics)
 
+    #create csv entry pairs from source and destination filepaths. This includes non-image files.
+    for source_filepath, dest_filepath in engine.run(image_list):
+        #also dropped if the copy failed or the file was not copied
+        large_sizes.pop(source_filepath, None)
+        copy_log.write("s3://" + source_filepath, dest_filepath)
+        if remover is not None:
+            remover.add(source_infos.pop(source_filepath), dest_filepath)
+    print(engine.stats)
+    if remover is not None:
+        #verify and delete the last batch
+        remover.close()
+        print(remover)
+journal.close()
+        
+#write the last rows and close the csv file
+copy_log.close()
+if metrics is not None:
+    metrics.write_json(csv_path + "whidbey copy metrics.json")
+    metrics.stop()
+print("end:", datetime.datetime.now())
@@ -0,0 +1,442 @@
+"""
+Purpose: copy many images with a fixed number of worker threads, a bounded queue of waiting work,
+retries with exponential backoff for S3 throttling (SlowDown / 503) and connection errors, and a
+concurrency limit that adapts to how S3 is responding.
+The number of copies running at the same time is controlled by an AIMD (additive increase,
+multiplicative decrease) limiter, the same idea TCP uses for congestion control. Every successful
+copy raises the limit a little. A throttling error, or a copy slower than the latency target,
+cuts the limit in half. The limit never goes above the number of worker threads.
+CopyEngine does not know how to copy an image. It is given a function that takes one source
+filepath and returns the destination filepath (ex. copy_s3_image()), so it can be run against
+an fsspec memory filesystem with a copy function that raises errors on purpose.
+"""
+
+#####REQUIRED PACKAGES#####
+import errno
+import queue
+import random
+import threading
+import time
+from filesystem_manager import DEFAULT_MAX_WORKERS
+
+
+#####GLOBALS#####
+#error codes S3 (and other AWS services) return when requests are being sent too fast
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests',
+                  'TooManyRequestsException', 'RequestThrottled', 'ServiceUnavailable')
+
+#HTTP status of throttled requests
+THROTTLE_STATUSES = (429, 503)
+
+#error codes and HTTP status of server side errors that can be tried again
+RETRYABLE_CODES = ('InternalError', 'RequestTimeout', 'RequestTimeoutException')
+RETRYABLE_STATUSES = (500, 502, 504)
+
+#names of botocore/aiohttp errors for dropped or timed out connections. Compared by name so
+#botocore does not have to be imported here
+CONNECTION_ERROR_NAMES = ('EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError',
+                          'ConnectionClosedError', 'ServerDisconnectedError', 'ClientOSError')
+
+#marks the end of the work queue
+_DONE = object()
+
+
+#####FUNCTIONS#####
+def _error_chain(error):
+    """
+    The error and the errors it was raised from. s3fs raises an OSError from the botocore
+    ClientError, which has the error code and HTTP status.
+    """
+
+    chain = []
+    while error is not None and error not in chain:
+        chain.append(error)
+        error = error.__cause__ if error.__cause__ is not None else error.__context__
+    return chain
+
+
+def error_code(error):
+    """
+    Get the S3 error code and HTTP status of an error. Only the response of the request is used,
+    never the error message, which has the filepath in it (ex. a unix time with '503' in it).
+    Input:
+        error - (Exception) error raised by the copy function
+    Output:
+        code - (string) ex. 'SlowDown', or None if the error has no S3 response
+        status - (int) ex. 503, or None if the error has no S3 response
+    """
+
+    for link in _error_chain(error):
+        response = getattr(link, 'response', None)
+        if isinstance(response, dict):
+            code = response.get('Error', {}).get('Code')
+            status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            return code, status
+    return None, None
+
+
+def is_throttle_error(error):
+    """
+    Check if an error means S3 is asking for requests to slow down.
+    s3fs turns SlowDown and 503 responses into an OSError with errno EBUSY.
+    Input:
+        error - (Exception) error raised by the copy function
+    Output:
+        (bool) True if this is a throttling error
+    """
+
+    if isinstance(error, OSError) and error.errno == errno.EBUSY:
+        return True
+    code, status = error_code(error)
+    return code in THROTTLE_CODES or status in THROTTLE_STATUSES
+
+
+def is_retryable_error(error):
+    """
+    Check if a copy that failed with this error should be tried again.
+    Errors such as a missing file (ENOENT) or no permission (EACCES) are not retried.
+    Input:
+        error - (Exception) error raised by the copy function
+    Output:
+        (bool) True for throttling, server errors, timeouts and dropped connections
+    """
+
+    if is_throttle_error(error):
+        return True
+    code, status = error_code(error)
+    if code in RETRYABLE_CODES or status in RETRYABLE_STATUSES:
+        return True
+    for link in _error_chain(error):
+        if isinstance(link, (ConnectionError, TimeoutError)) or type(link).__name__ in CONNECTION_ERROR_NAMES:
+            return True
+    return False
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    Time to wait before retry number attempt, using exponential backoff with full jitter.
+    The wait is a random time between 0 and base_delay * 2**attempt (capped at max_delay),
+    so threads that were throttled at the same time do not all retry at the same time.
+    Input:
+        attempt - (int) number of the retry, starting at 0
+        base_delay - (float) seconds
+        max_delay - (float) seconds
+    Output:
+        delay - (float) seconds to wait
+    """
+
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+#####CLASSES#####
+class AIMDLimiter:
+    """
+    Limit on the number of copies running at the same time that adapts to throttling and latency.
+    Worker threads call acquire() before a copy and release() after it, then report how the copy
+    went with on_success() or on_throttle().
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None, latency_target=None, cooldown=1.0):
+        """
+        Input:
+            initial - (int) starting limit
+            minimum - (int) limit is never cut below this
+            maximum - (int) limit is never raised above this. Default is initial.
+            latency_target - (float) optional. A successful copy slower than this many seconds
+                             is treated like a throttling error.
+            cooldown - (float) seconds after a cut before the limit can be cut again. A burst of
+                       throttling errors from copies that were already running only counts once.
+        """
+
+        self.minimum = max(1, minimum)
+        self.maximum = maximum if maximum is not None else initial
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until fewer than limit copies are running, then count this copy as running.
+        """
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return
+
+    def release(self):
+        """
+        Count a copy as finished.
+        """
+
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+        return
+
+    def on_success(self, latency):
+        """
+        Additive increase: the limit goes up by about 1 for every limit successful copies.
+        Input:
+            latency - (float) seconds the copy took
+        """
+
+        if self.latency_target is not None and latency > self.latency_target:
+            self.on_throttle()
+            return
+        with self._condition:
+            old_limit = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if int(self.limit) > old_limit:
+                self._condition.notify()
+        return
+
+    def on_throttle(self):
+        """
+        Multiplicative decrease: the limit is cut in half, at most once per cooldown.
+        """
+
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2.0)
+        return
+
+
+class EngineStats:
+    """
+    Counters for a CopyEngine run. Updated by the worker threads.
+    """
+
+    def __init__(self):
+        self.copied = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+        return
+
+    @property
+    def elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.monotonic()
+        return end_time - self.start_time
+
+    @property
+    def objects_per_sec(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return (self.copied + self.failed) / elapsed
+
+    def __str__(self):
+        return ("copied: %d, failed: %d, retries: %d, throttled: %d, elapsed: %.1f s, objects/sec: %.1f"
+                % (self.copied, self.failed, self.retries, self.throttled, self.elapsed, self.objects_per_sec))
+
+
+class CopyEngine:
+    """
+    Copy a stream of images with bounded concurrency, retries and adaptive throttling.
+    Example:
+        engine = CopyEngine(copy_s3_image, max_workers=64)
+        for source_filepath, dest_filepath in engine.run(image_list):
+            csv_list.append([source_filepath, dest_filepath])
+        print(engine.stats)
+    """
+
+    def __init__(self, copy_func, max_workers=DEFAULT_MAX_WORKERS, initial_concurrency=None,
+                 min_concurrency=1, queue_size=None, max_retries=8, base_delay=0.1, max_delay=20.0,
+                 latency_target=None, report_every=None, metrics=None):
+        """
+        Input:
+            copy_func - function that takes a source filepath and returns the destination filepath
+                        (or a message string for files that are not copied)
+            max_workers - (int) number of worker threads. This is also the highest the concurrency
+                          limit can go. Size the filesystem connection pool to match.
+            initial_concurrency - (int) starting concurrency limit. Default is max_workers.
+            min_concurrency - (int) lowest the concurrency limit can be cut to
+            queue_size - (int) number of images read ahead of the workers. Default is 2 * max_workers.
+            max_retries - (int) retries for one image before it is recorded as failed
+            base_delay - (float) seconds of the first backoff
+            max_delay - (float) longest backoff in seconds
+            latency_target - (float) optional. Copies slower than this many seconds cut the limit.
+            report_every - (float) optional. Print progress every this many seconds.
+            metrics - optional MetricsRegistry (migration_metrics.py). Records the time taken by each
+                      successful call of copy_func as 'copy_task_seconds' (this includes anything
+                      copy_func does besides copying, ex. planning and writing the journal, which
+                      copy_func can time on its own), the counters 'copied_total',
+                      'failed_total', 'retries_total' and 'throttled_total', and the concurrency
+                      limit and copies running as the gauges 'concurrency_limit' and 'copies_in_flight'.
+        """
+
+        self.copy_func = copy_func
+        self.max_workers = max_workers
+        self.queue_size = queue_size if queue_size is not None else 2 * max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.report_every = report_every
+        if initial_concurrency is None:
+            initial_concurrency = max_workers
+        self.limiter = AIMDLimiter(initial_concurrency, minimum=min_concurrency, maximum=max_workers,
+                                   latency_target=latency_target)
+        self.stats = EngineStats()
+        self.metrics = metrics
+        self._stop = threading.Event()
+        self._producer_error = None
+
+    def _put(self, q, item):
+        """
+        Put an item in a bounded queue, giving up if the run has been stopped.
+        """
+
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, image_list, work_queue):
+        """
+        Feed images into the work queue. Blocks while the queue is full, so at most queue_size
+        images are read from image_list ahead of the workers.
+        """
+
+        try:
+            for image in image_list:
+                if not self._put(work_queue, image):
+                    return
+        except Exception as error:
+            #ex. listing failed part way. Raised again by run() once the workers stop
+            self._producer_error = error
+        finally:
+            for i in range(self.max_workers):
+                self._put(work_queue, _DONE)
+        return
+
+    def _count(self, **counts):
+        """
+        Add to the run's stats, and to the metrics registry if there is one.
+        """
+
+        self.stats.add(**counts)
+        if self.metrics is not None:
+            for name, count in counts.items():
+                self.metrics.inc(name + '_total', count)
+        return
+
+    def copy_one(self, source_filepath):
+        """
+        Copy one image, retrying throttling and connection errors with backoff.
+        Input:
+            source_filepath - (string) filepath passed to copy_func
+        Output:
+            dest_filepath - (string) value returned by copy_func, or a message if the copy failed
+        """
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                dest_filepath = self.copy_func(source_filepath)
+            except Exception as error:
+                self.limiter.release()
+                throttled = is_throttle_error(error)
+                if throttled:
+                    self.limiter.on_throttle()
+                    self._count(throttled=1)
+                if not is_retryable_error(error) or attempt >= self.max_retries:
+                    self._count(failed=1)
+                    return 'Copy failed: ' + repr(error) + '. Not copied.'
+                self._count(retries=1)
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                attempt += 1
+                continue
+            self.limiter.release()
+            latency = time.monotonic() - start
+            self.limiter.on_success(latency)
+            self._count(copied=1)
+            if self.metrics is not None:
+                self.metrics.observe('copy_task_seconds', latency)
+            return dest_filepath
+
+    def _work(self, work_queue, result_queue):
+        """
+        Worker thread. Copy images from the work queue until the end marker.
+        """
+
+        while not self._stop.is_set():
+            try:
+                source_filepath = work_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if source_filepath is _DONE:
+                break
+            dest_filepath = self.copy_one(source_filepath)
+            if not self._put(result_queue, (source_filepath, dest_filepath)):
+                break
+        self._put(result_queue, _DONE)
+        return
+
+    def run(self, image_list):
+        """
+        Copy every image in image_list. image_list can be a generator, it is read as the workers
+        need more work rather than all at once.
+        Input:
+            image_list - iterable of source filepaths
+        Output:
+            generator of (source filepath, destination filepath) in the order the copies finish
+        """
+
+        self._stop.clear()
+        self._producer_error = None
+        self.stats = EngineStats()
+        work_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._produce, args=(image_list, work_queue), daemon=True)]
+        for i in range(self.max_workers):
+            threads.append(threading.Thread(target=self._work, args=(work_queue, result_queue), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        workers_running = self.max_workers
+        last_report = time.monotonic()
+        try:
+            while workers_running > 0:
+                result = result_queue.get()
+                if result is _DONE:
+                    workers_running -= 1
+                    continue
+                yield result
+
+                if self.metrics is not None:
+                    self.metrics.set_gauge('concurrency_limit', int(self.limiter.limit))
+                    self.metrics.set_gauge('copies_in_flight', self.limiter.in_flight)
+                if self.report_every is not None and time.monotonic() - last_report >= self.report_every:
+                    last_report = time.monotonic()
+                    print(self.stats, "concurrency:", int(self.limiter.limit))
+        finally:
+            #also reached when the caller stops iterating early. Let the threads finish.
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.stats.end_time = time.monotonic()
+        if self._producer_error is not None:
+            raise self._producer_error
+        return
@@ -0,0 +1,158 @@
+"""
+Purpose: keep a local record of which images have already been copied so an interrupted
+migration can be restarted where it left off.
+The journal is an append-only text file. Each line is [source filepath]<tab>[destination filepath]
+and is written as soon as the copy of that image is finished. When the journal is opened again,
+the lines already in the file are read into a dictionary, so checking if an image was already
+copied is a dictionary lookup rather than a search of a list or a comparison of unix times.
+If the script stops in the middle of writing a line (crash, lost connection, closed window),
+the partial line is ignored when the journal is opened again and that image is copied again.
+The journal can be shared by the worker threads of a ThreadPoolExecutor.
+"""
+
+#####REQUIRED PACKAGES#####
+import os
+import threading
+
+
+#####CLASSES#####
+class CopyJournal:
+    """
+    Append-only journal of finished copies.
+    Use as a context manager so the file is flushed and closed at the end of the run:
+        with CopyJournal(journal_path) as journal:
+            for image in journal.pending(image_list):
+                dest_filepath = copy_s3_image(image)
+                journal.record(image, dest_filepath)
+    """
+
+    def __init__(self, journal_path, sync_every=100):
+        """
+        Open (or create) a journal file and read the copies already recorded in it.
+        Input:
+            journal_path - (string) path of the local journal file
+            sync_every - (int) number of records between os.fsync() calls. Every record is flushed
+                         to the operating system right away, so a crash of the script never loses
+                         records. fsync only matters if the computer itself loses power.
+        """
+
+        self.journal_path = journal_path
+        self.sync_every = sync_every
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self.finished, complete_size = self._read(journal_path)
+
+        #partial last line from a crash is cut off so new records start on their own line
+        if os.path.exists(journal_path) and os.path.getsize(journal_path) > complete_size:
+            with open(journal_path, 'rb+') as f:
+                f.truncate(complete_size)
+        self._file = open(journal_path, 'a', encoding='UTF8', newline='\n')
+
+    @staticmethod
+    def _normalize(filepath):
+        """
+        Journal keys never include the s3:// prefix, so paths from fs.glob() and
+        paths with "s3://" added in front of them are the same key.
+        """
+
+        if filepath.startswith("s3://"):
+            return filepath[5:]
+        return filepath
+
+    @staticmethod
+    def _read(journal_path):
+        """
+        Read the finished copies from an existing journal file.
+        Input:
+            journal_path - (string) path of the local journal file
+        Output:
+            finished - (dict) source filepath -> destination filepath
+            complete_size - (int) number of bytes in the file up to the end of the last complete line
+        """
+
+        finished = {}
+        complete_size = 0
+        if not os.path.exists(journal_path):
+            return finished, complete_size
+
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                #line without a newline at the end was only partly written
+                if not line.endswith(b'\n'):
+                    break
+                complete_size += len(line)
+                elements = line[:-1].decode('UTF8').split('\t')
+                if len(elements) != 2:
+                    continue
+                finished[elements[0]] = elements[1]
+        return finished, complete_size
+
+    def is_finished(self, source_filepath):
+        """
+        Check if an image was already copied.
+        Input:
+            source_filepath - (string) source filepath, with or without "s3://"
+        Output:
+            (bool) True if the copy of this image is in the journal
+        """
+
+        return self._normalize(source_filepath) in self.finished
+
+    def pending(self, image_list):
+        """
+        Generator of the images in image_list that are not in the journal yet.
+        Input:
+            image_list - iterable of source filepaths
+        Output:
+            source filepaths that still need to be copied
+        """
+
+        for image in image_list:
+            if self._normalize(image) not in self.finished:
+                yield image
+
+    def record(self, source_filepath, dest_filepath):
+        """
+        Record that an image has been copied. Safe to call from several threads.
+        Input:
+            source_filepath - (string) filepath the image was copied from
+            dest_filepath - (string) filepath the image was copied to. Can also be the message
+                            returned by copy_s3_image() for files that are not copied.
+        Output:
+            None
+        """
+
+        source_key = self._normalize(source_filepath)
+        line = source_key + '\t' + str(dest_filepath) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.finished[source_key] = dest_filepath
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+        return
+
+    def close(self):
+        """
+        Flush and close the journal file.
+        """
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        return
+
+    def __len__(self):
+        return len(self.finished)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
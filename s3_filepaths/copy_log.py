@@ -0,0 +1,199 @@
+"""
+Purpose: write the csv log of copied images while the copy is running instead of at the end.
+write2csv() in the copy scripts wrote the whole log after every image had been copied, so the
+list of rows grew with every image and a crash lost the whole log.
+CopyLogWriter takes rows from the copy loop (or from worker threads) through a queue. A writer
+thread writes them to the csv in batches and flushes after each batch, so the log on disk is
+never more than about flush_interval seconds behind and can be followed (ex. with tail -f or
+Get-Content -Wait) while the run is going. When a log file reaches max_bytes, it is closed
+and a new part is started.
+Log files are named "image copy log [dd-mm-yyyy HH_MM_SS].csv", then "... part 2.csv", etc.
+and have the same 'source filepath', 'destination filepath' header write2csv() used.
+"""
+
+#####REQUIRED PACKAGES#####
+import csv
+import datetime
+import queue
+import threading
+import time
+
+
+#####GLOBALS#####
+#header
+FIELDNAMES = ['source filepath', 'destination filepath']
+
+#marks the end of the log
+_CLOSE = object()
+
+#seconds write() waits for room in the queue before checking the writer thread is still running
+PUT_TIMEOUT = 1.0
+
+
+#####CLASSES#####
+class CopyLogWriter:
+    """
+    Csv log of copied images written by a background thread.
+    Use as a context manager so the last rows are written when the run ends:
+        with CopyLogWriter(csv_path) as copy_log:
+            for image in image_list:
+                copy_log.write(source_filepath, dest_filepath)
+    """
+
+    def __init__(self, csv_path, max_bytes=100 * 2**20, batch_size=1000, flush_interval=1.0, queue_size=100000,
+                 log_name=None, metrics=None):
+        """
+        Input:
+            csv_path - (string) folder the log files are written to (ending in "/")
+            max_bytes - (int) size at which a log file is closed and a new part started
+            batch_size - (int) most rows written between flushes
+            flush_interval - (float) most seconds a row waits before it is written
+            queue_size - (int) most rows waiting to be written. write() waits if the queue is full.
+            log_name - (string) optional name of the log files. Default is "image copy log [date time]".
+                       Give each log a different name when several are started at the same time.
+            metrics - optional MetricsRegistry (migration_metrics.py). Records the time taken to write
+                      and flush each batch as 'log_batch_seconds', the rows written as
+                      'log_rows_total' and the rows waiting to be written as 'log_queue_rows'.
+        """
+
+        self.csv_path = csv_path
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.log_files = []
+        self.metrics = metrics
+
+        if log_name is None:
+            now = datetime.datetime.now()
+            log_name = 'image copy log ' + now.strftime("%d-%m-%Y %H_%M_%S")
+        self._base_name = csv_path + log_name
+        self._file = None
+        self._writer = None
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _open_next_part(self):
+        """
+        Close the current log file (if any) and start the next part.
+        """
+
+        if self._file is not None:
+            self._file.close()
+        part = len(self.log_files) + 1
+        csv_name = self._base_name + ('.csv' if part == 1 else ' part ' + str(part) + '.csv')
+        self._file = open(csv_name, 'w', encoding='UTF8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FIELDNAMES)
+        self.log_files.append(csv_name)
+        return
+
+    def _write_batch(self, rows):
+        """
+        Write a batch of rows and flush them to disk so readers can see them.
+        """
+
+        start = time.perf_counter()
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._open_next_part()
+        self._writer.writerows(rows)
+        self._file.flush()
+        self.rows_written += len(rows)
+        if self.metrics is not None:
+            self.metrics.observe('log_batch_seconds', time.perf_counter() - start)
+            self.metrics.inc('log_rows_total', len(rows))
+            self.metrics.set_gauge('log_queue_rows', self._queue.qsize())
+        return
+
+    def _run(self):
+        """
+        Writer thread. Collects rows from the queue and writes them in batches.
+        """
+
+        rows = []
+        batch_start = None
+        try:
+            while True:
+                #wait at most until the oldest waiting row is flush_interval seconds old
+                timeout = self.flush_interval
+                if batch_start is not None:
+                    timeout = max(0.0, batch_start + self.flush_interval - time.monotonic())
+                try:
+                    row = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    row = None
+                if row is _CLOSE:
+                    break
+                if row is not None:
+                    if len(rows) == 0:
+                        batch_start = time.monotonic()
+                    rows.append(row)
+                if len(rows) > 0 and (len(rows) >= self.batch_size
+                                      or time.monotonic() - batch_start >= self.flush_interval):
+                    self._write_batch(rows)
+                    rows = []
+                    batch_start = None
+            if len(rows) > 0 or self._file is None:
+                self._write_batch(rows)
+        except Exception as error:
+            #raised again by write() or close() in the copy loop
+            self._error = error
+        finally:
+            if self._file is not None:
+                self._file.close()
+        return
+
+    def write(self, source_filepath, dest_filepath):
+        """
+        Add a row to the log. Safe to call from several threads.
+        Input:
+            source_filepath - (string) filepath the image was copied from
+            dest_filepath - (string) filepath the image was copied to, or message if not copied
+        Output:
+            None
+        """
+
+        self._put([source_filepath, dest_filepath])
+        return
+
+    def _put(self, item):
+        """
+        Put an item in the queue. Waits while the queue is full, but raises the error of the
+        writer thread if it stops, rather than waiting for room that never comes.
+        """
+
+        while True:
+            if self._error is not None:
+                raise self._error
+            if not self._thread.is_alive():
+                raise RuntimeError("CopyLogWriter is closed")
+            try:
+                self._queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        """
+        Write the remaining rows and close the log file.
+        """
+
+        if self._thread.is_alive():
+            try:
+                self._put(_CLOSE)
+            except Exception:
+                #stopped with an error, raised below
+                pass
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,151 @@
+"""
+Purpose: keep only the images taken in daylight, so night images are not copied or counted when
+only daylight products are needed.
+Night images are about half of the images of a station. The unix time in each filename is checked
+against the sunrise and sunset of the station on that day (calc_sunrise_sunset.py, which keeps a
+table of every day of the year for each station), a batch of filepaths at a time.
+filter_daylight() is a stage that can be put between the listing and the copy or count loop:
+    image_list = filter_daylight(iter_keys(fs, source_folder), on_night=...)
+Night images are dropped, or passed to on_night (ex. to write them to the copy log or copy them
+somewhere else). Files without a unix time in the filename (ex. .txt files) are always kept, so
+the rest of the script handles them as before.
+The station of each file is taken from its filepath ([bucket]/cameras/[station]/...) and must be
+in STATION_LOCATIONS of calc_sunrise_sunset.py. Scripts call check_station() when they start, so a
+station without a location stops the script before anything is listed or copied.
+"""
+
+#####REQUIRED PACKAGES#####
+import itertools
+import numpy as np
+from calc_sunrise_sunset import STATION_LOCATIONS, sunrise_sunset
+
+
+#####GLOBALS#####
+#written to the copy log for night images that are not copied
+NIGHT_MESSAGE = 'Night image. Not copied.'
+
+
+#####FUNCTIONS#####
+def _split_filepath(filepath):
+    """
+    Get the station and unix time of a filepath, or None for either if it cannot be found.
+    """
+
+    if filepath.startswith("s3://"):
+        filepath = filepath[5:]
+    path_elements = filepath.strip("/").split("/")
+    #elements start with "[bucket]", "cameras", "[station]"
+    station = path_elements[2] if len(path_elements) > 3 and path_elements[1] == 'cameras' else None
+    unix_time = path_elements[-1].split(".", 1)[0]
+    return station, int(unix_time) if unix_time.isdigit() else None
+
+
+def station_of(filepath):
+    """
+    Get the station of a filepath or folder, ex. "s3://cmgp-coastcam/cameras/whidbey/products/" -> 'whidbey'.
+    Output:
+        station - (string) or None if the filepath is not under [bucket]/cameras/[station]/
+    """
+
+    return _split_filepath(filepath)[0]
+
+
+def check_station(station):
+    """
+    Check that the sunrise and sunset of a station can be calculated.
+    Input:
+        station - (string) station name, ex. 'caco-01'
+    Output:
+        None. Raises ValueError if the station is not in STATION_LOCATIONS.
+    """
+
+    if station not in STATION_LOCATIONS:
+        raise ValueError("No location for station " + repr(station) + ". Stations with a location: "
+                         + ", ".join(sorted(STATION_LOCATIONS)) + ". Add (latitude, longitude, timezone) of the "
+                         "station to STATION_LOCATIONS in calc_sunrise_sunset.py, or pass location.")
+    return
+
+
+def daylight_mask(filepaths, station=None, location=None, margin=0):
+    """
+    Check which files were taken in daylight.
+    Input:
+        filepaths - (list of strings) filepaths or filenames of images
+        station - (string) optional station of every file. Default is the station in each filepath.
+        location - (tuple) optional (latitude, longitude) of every file, instead of the station's location
+        margin - (float) seconds before sunrise and after sunset that also count as daylight
+    Output:
+        daylight - (numpy array of bool) True for daylight images and files without a unix time
+    """
+
+    parts = [_split_filepath(filepath) for filepath in filepaths]
+    unix_times = np.array([unix_time if unix_time is not None else -1 for _, unix_time in parts], dtype=np.int64)
+    if station is not None or location is not None:
+        stations = np.full(len(parts), station, dtype=object)
+    else:
+        stations = np.array([file_station for file_station, _ in parts], dtype=object)
+
+    daylight = np.ones(len(parts), dtype=bool)
+    timed = unix_times >= 0
+    for file_station in set(stations[timed].tolist()):
+        if location is not None:
+            latitude, longitude = location
+        else:
+            check_station(file_station)
+            latitude, longitude, timezone = STATION_LOCATIONS[file_station]
+        selected = timed & (stations == file_station)
+        times = unix_times[selected]
+        sunrise, sunset = sunrise_sunset(times, latitude, longitude)
+        daylight[selected] = (times >= sunrise - margin) & (times <= sunset + margin)
+    return daylight
+
+
+def daylight_image(filepath, station=None, location=None, margin=0):
+    """
+    Check if one file was taken in daylight. Same inputs as daylight_mask(), for one filepath.
+    Output:
+        (bool) True for a daylight image or a file without a unix time
+    """
+
+    return bool(daylight_mask([filepath], station, location, margin)[0])
+
+
+def filter_daylight(image_list, station=None, location=None, margin=0, on_night=None, key=None, batch_size=1000):
+    """
+    Generator that passes on the daylight images of image_list and drops (or routes) the night images.
+    image_list can be a generator (ex. s3_listing.iter_keys()), it is read one batch at a time.
+    If station is given without a location, it is checked with check_station() right away rather
+    than when the first batch is read.
+    Input:
+        image_list - iterable of filepaths, or of items with a filepath (see key)
+        station, location, margin - same as daylight_mask()
+        on_night - optional function called with each night item, ex. to log it
+        key - optional function that gets the filepath of an item, ex. lambda info: info['name']
+              for file info dictionaries from s3_listing.iter_objects()
+        batch_size - (int) items checked at a time
+    Output:
+        the daylight items of image_list, in the same order
+    """
+
+    if station is not None and location is None:
+        check_station(station)
+    return _filter_daylight(image_list, station, location, margin, on_night, key, batch_size)
+
+
+def _filter_daylight(image_list, station, location, margin, on_night, key, batch_size):
+    """
+    Generator of filter_daylight().
+    """
+
+    image_iter = iter(image_list)
+    while True:
+        batch = list(itertools.islice(image_iter, batch_size))
+        if len(batch) == 0:
+            return
+        filepaths = batch if key is None else [key(item) for item in batch]
+        daylight = daylight_mask(filepaths, station, location, margin)
+        for item, keep in zip(batch, daylight.tolist()):
+            if keep:
+                yield item
+            elif on_night is not None:
+                on_night(item)
@@ -0,0 +1,125 @@
+"""
+Purpose: check if an image has already been copied to its new filepath without a request per image.
+New filepaths are grouped in day folders: s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/.
+The first time an image in a day folder is checked, the whole day folder is listed (one request per
+1000 files) and the filename, size and ETag of every file in it are kept in a dictionary. Every
+other image in that day folder is then checked with a dictionary lookup.
+An image counts as already copied if a file with the same name is in the day folder and, when they
+are known, the size and ETag match the source. A single request copy keeps the ETag of the source,
+but a multipart copy (ETag ending in "-[number of parts]") does not, so then only the size is compared.
+Source folders are listed in time order, so the day folders are needed in order too. Only the most
+recently used max_folders day folders are kept in memory.
+"""
+
+#####REQUIRED PACKAGES#####
+import collections
+import threading
+from s3_listing import iter_objects
+
+
+#####CLASSES#####
+class DestinationIndex:
+    """
+    Cache of the files already in destination day folders.
+    Example:
+        dest_index = DestinationIndex(fs)
+        if dest_index.has_copy(dest_filepath, info['size'], info['ETag']):
+            #skip this image
+    """
+
+    def __init__(self, fs, max_folders=256):
+        """
+        Input:
+            fs - fsspec filesystem the destination is on
+            max_folders - (int) most day folders kept in memory
+        """
+
+        self.fs = fs
+        self.max_folders = max_folders
+        self.folders_listed = 0
+        self._folders = collections.OrderedDict()
+        self._folder_locks = {}
+        self._lock = threading.Lock()
+
+    def _folder_lock(self, folder):
+        """
+        Lock for one folder, so two threads needing the same folder only list it once.
+        """
+
+        with self._lock:
+            lock = self._folder_locks.get(folder)
+            if lock is None:
+                lock = threading.Lock()
+                self._folder_locks[folder] = lock
+            return lock
+
+    def folder_files(self, folder):
+        """
+        Get the files in a day folder, listing the folder the first time it is asked for.
+        Input:
+            folder - (string) folder, ex. "s3://cmgp-coastcam/cameras/caco-01/c2/2019/347_Dec.13/raw"
+        Output:
+            files - (dict) filename -> (size, ETag)
+        """
+
+        with self._lock:
+            files = self._folders.get(folder)
+            if files is not None:
+                self._folders.move_to_end(folder)
+                return files
+
+        with self._folder_lock(folder):
+            #another thread may have listed it while this one waited
+            with self._lock:
+                files = self._folders.get(folder)
+            if files is None:
+                files = {}
+                try:
+                    for info in iter_objects(self.fs, folder):
+                        files[info['name'].rsplit("/", 1)[-1]] = (info.get('size'), info.get('ETag'))
+                except FileNotFoundError:
+                    #day folder does not exist yet
+                    pass
+                with self._lock:
+                    self.folders_listed += 1
+                    self._folders[folder] = files
+                    while len(self._folders) > self.max_folders:
+                        old_folder, old_files = self._folders.popitem(last=False)
+                        self._folder_locks.pop(old_folder, None)
+        return files
+
+    def has_copy(self, dest_filepath, size=None, etag=None):
+        """
+        Check if the file at dest_filepath already exists and matches the source.
+        Input:
+            dest_filepath - (string) new filepath of the image
+            size - (int) optional size of the source image in bytes
+            etag - (string) optional ETag of the source image
+        Output:
+            (bool) True if the image has already been copied
+        """
+
+        folder, filename = dest_filepath.rsplit("/", 1)
+        found = self.folder_files(folder).get(filename)
+        if found is None:
+            return False
+
+        dest_size, dest_etag = found
+        if size is not None and dest_size is not None and size != dest_size:
+            return False
+        #multipart ETags are not the md5 of the file, so they can differ between copies of the same file
+        if etag is not None and dest_etag is not None and '-' not in etag and '-' not in dest_etag:
+            return etag == dest_etag
+        return True
+
+    def add(self, dest_filepath, size=None, etag=None):
+        """
+        Record a file copied during this run, if its day folder is already in memory.
+        """
+
+        folder, filename = dest_filepath.rsplit("/", 1)
+        with self._lock:
+            files = self._folders.get(folder)
+            if files is not None:
+                files[filename] = (size, etag)
+        return
@@ -0,0 +1,121 @@
+"""
+Purpose: build and share fsspec filesystems for the S3 filepath scripts.
+Creating a filesystem with fsspec.filesystem('s3', profile='coastcam') looks up credentials,
+creates a botocore client and opens a new connection pool. The copy scripts used to do this for
+every image they copied. get_filesystem() creates one filesystem for each (protocol, profile) pair
+the first time it is asked for and hands the same object back on every call after that.
+s3fs filesystems are safe to share between threads, so the worker threads of a ThreadPoolExecutor
+can all use the filesystem returned here.
+The size of the connection pool should match the number of worker threads that use the filesystem,
+otherwise workers wait on each other for a free connection. Use set_pool_size() before the
+first call to get_filesystem(), or pass pool_size to get_filesystem().
+"""
+
+#####REQUIRED PACKAGES#####
+import os
+import threading
+#will need fs3 package to use s3 in fsspec
+import fsspec
+
+
+#####GLOBALS#####
+#number of worker threads used by the copy scripts. Same default as concurrent.futures.ThreadPoolExecutor
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+#botocore default is 10 connections, which is less than the default number of worker threads
+_pool_size = DEFAULT_MAX_WORKERS
+
+#filesystems already created, keyed by (protocol, profile)
+_filesystems = {}
+_filesystems_lock = threading.Lock()
+
+
+#####FUNCTIONS#####
+def set_pool_size(pool_size):
+    """
+    Set the number of connections in the connection pool of filesystems created after this call.
+    This should be at least the number of worker threads that will share the filesystem.
+    Input:
+        pool_size - (int) maximum number of open connections per filesystem
+    Output:
+        None
+    """
+
+    global _pool_size
+    if pool_size < 1:
+        raise ValueError("pool_size must be at least 1")
+    _pool_size = int(pool_size)
+    return
+
+
+def get_pool_size():
+    """
+    Get the connection pool size used for new filesystems.
+    Output:
+        pool_size - (int) maximum number of open connections per filesystem
+    """
+
+    return _pool_size
+
+
+def filesystem_kwargs(protocol, profile, pool_size=None):
+    """
+    Build the keyword arguments passed to fsspec.filesystem() for a protocol and profile.
+    Input:
+        protocol - (string) fsspec protocol, ex. 's3'
+        profile - (string) AWS profile name. Ignored for protocols other than s3.
+        pool_size - (int) optional connection pool size. Uses get_pool_size() if not given.
+    Output:
+        kwargs - (dict) keyword arguments for fsspec.filesystem()
+    """
+
+    if protocol not in ('s3', 's3a'):
+        return {}
+
+    if pool_size is None:
+        pool_size = _pool_size
+    #skip_instance_cache so clear_filesystems() really does create a new client
+    kwargs = {'config_kwargs': {'max_pool_connections': pool_size}, 'skip_instance_cache': True}
+    if profile is not None:
+        kwargs['profile'] = profile
+    return kwargs
+
+
+def get_filesystem(protocol='s3', profile='coastcam', pool_size=None):
+    """
+    Get the shared filesystem for a protocol and profile, creating it on the first call.
+    The returned filesystem is shared by every caller (and every thread) asking for the
+    same protocol and profile. pool_size only has an effect the first time a filesystem is created.
+    Input:
+        protocol - (string) fsspec protocol. Default is 's3'.
+        profile - (string) AWS profile name. Default is 'coastcam'.
+        pool_size - (int) optional connection pool size. Uses get_pool_size() if not given.
+    Output:
+        fs - fsspec filesystem
+    """
+
+    key = (protocol, profile)
+    fs = _filesystems.get(key)
+    if fs is not None:
+        return fs
+
+    #only one thread creates the filesystem. The others wait for it and then reuse it.
+    with _filesystems_lock:
+        fs = _filesystems.get(key)
+        if fs is None:
+            fs = fsspec.filesystem(protocol, **filesystem_kwargs(protocol, profile, pool_size))
+            _filesystems[key] = fs
+    return fs
+
+
+def clear_filesystems():
+    """
+    Forget all shared filesystems, ex. after credentials have been refreshed.
+    The next call to get_filesystem() creates a new filesystem.
+    Output:
+        None
+    """
+
+    with _filesystems_lock:
+        _filesystems.clear()
+    return
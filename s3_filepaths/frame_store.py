@@ -0,0 +1,284 @@
+"""
+Purpose: keep decoded images of a station and camera on local disk as one array, so time stacks can be
+read without downloading or decoding JPEGs again.
+A frame store is a folder with
+    frames.npy - array of shape (time, y, x, band), opened with numpy memmap
+    epochs.npy - unix time of each frame, in increasing order
+    meta.json  - number of frames filled in, frame shape and dtype
+Both arrays are allocated with room for more frames than are filled in (capacity), so frames
+can be added without rewriting the file. When the store is full the capacity is doubled.
+Frames are found by unix time with a binary search on epochs, and slice_time() returns a view of
+the memmap, so a time range of frames is read straight from disk without being copied or decoded.
+fill_frame_store() fills a store from S3 with image_loader.py. Run it again with the same keys
+to add frames newer than the last frame in the store.
+Example:
+    store = fill_frame_store(store_path("D:/frames", 'caco-01', 'c2', 'timex'), keys)
+    epochs, frames = store.slice_time(start, end)
+    mean_image = frames.mean(axis=0)
+"""
+
+#####REQUIRED PACKAGES#####
+import json
+import os
+import numpy as np
+from image_loader import iter_images
+from path_planner import parse_source_filepath
+
+
+#####GLOBALS#####
+FRAMES_FILE = 'frames.npy'
+EPOCHS_FILE = 'epochs.npy'
+META_FILE = 'meta.json'
+
+#frames copied at a time when the store grows
+COPY_FRAMES = 256
+
+
+#####FUNCTIONS#####
+def store_path(root, station, camera, image_type):
+    """
+    Folder of the frame store of a station, camera and image type, ex. "[root]/caco-01/c2/timex".
+    """
+
+    return os.path.join(root, station, camera, image_type)
+
+
+def epoch_of(filepath):
+    """
+    Get the unix time of an image from its filename, or None if the filename is not properly formatted.
+    """
+
+    parts = parse_source_filepath(filepath)
+    return parts['epoch'] if parts is not None else None
+
+
+def _write_meta(path, count, frame_shape, dtype):
+    """
+    Write meta.json to a temporary file and move it into place, so it is never half written.
+    The count is written after the frames, so a store is never read with frames that were not written.
+    """
+
+    temp_path = os.path.join(path, META_FILE + '.tmp')
+    with open(temp_path, 'w', encoding='UTF8') as f:
+        json.dump({'count': count, 'frame_shape': list(frame_shape), 'dtype': dtype.str}, f)
+    os.replace(temp_path, os.path.join(path, META_FILE))
+    return
+
+
+def fill_frame_store(path, keys, fs=None, cache=None, flush_every=256, **loader_kwargs):
+    """
+    Load images from S3 and add them to a frame store, creating the store if it does not exist.
+    Images at or before the last frame already in the store are skipped, so the same keys can be
+    given again to add only new images.
+    Input:
+        path - (string) folder of the store, ex. from store_path()
+        keys - list of (string) filepaths of images of one camera and image type
+        fs - fsspec filesystem. Default is the shared s3 filesystem.
+        cache - optional BlobCache for reading the images
+        flush_every - (int) frames added between writes of the frame count to disk
+        loader_kwargs - other arguments of image_loader.iter_images(), ex. decode_workers
+    Output:
+        store - (FrameStore) opened with mode 'r+'
+    """
+
+    #sort by time. Keys without a unix time in the filename are skipped
+    timed = sorted((epoch_of(key), key) for key in keys if epoch_of(key) is not None)
+
+    store = FrameStore(path, mode='r+') if os.path.exists(os.path.join(path, META_FILE)) else None
+    if store is not None and store.count > 0:
+        last_epoch = int(store.epochs[-1])
+        timed = [(epoch, key) for epoch, key in timed if epoch > last_epoch]
+    epochs = {key: epoch for epoch, key in timed}
+
+    added = 0
+    for key, image in iter_images([key for epoch, key in timed], fs=fs, cache=cache, **loader_kwargs):
+        if store is None:
+            store = FrameStore.create(path, image.shape, image.dtype, capacity=max(len(timed), 1))
+        store.append(epochs[key], image)
+        added += 1
+        if added % flush_every == 0:
+            store.flush()
+    if store is not None:
+        store.flush()
+    return store
+
+
+#####CLASSES#####
+class FrameStore:
+    """
+    Memory-mapped array of frames of one camera, indexed by unix time.
+    Create with FrameStore.create(), open an existing store with FrameStore(path).
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        Input:
+            path - (string) folder of the store
+            mode - (string) 'r' to read, 'r+' to read and add frames
+        """
+
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, META_FILE), 'r', encoding='UTF8') as f:
+            meta = json.load(f)
+        self.count = meta['count']
+        self.frame_shape = tuple(meta['frame_shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self._open()
+
+    def _open(self):
+        self._frames = np.load(os.path.join(self.path, FRAMES_FILE), mmap_mode=self.mode)
+        self._epochs = np.load(os.path.join(self.path, EPOCHS_FILE), mmap_mode=self.mode)
+        return
+
+    @classmethod
+    def create(cls, path, frame_shape, dtype=np.uint8, capacity=1024):
+        """
+        Create an empty frame store.
+        Input:
+            path - (string) folder of the store. Created if it does not exist.
+            frame_shape - (tuple) shape of each frame, ex. (1080, 1920, 3)
+            dtype - numpy dtype of the frames
+            capacity - (int) number of frames to allocate room for
+        Output:
+            store - (FrameStore) opened with mode 'r+'
+        """
+
+        os.makedirs(path, exist_ok=True)
+        frames = np.lib.format.open_memmap(os.path.join(path, FRAMES_FILE), mode='w+', dtype=dtype,
+                                           shape=(capacity,) + tuple(frame_shape))
+        epochs = np.lib.format.open_memmap(os.path.join(path, EPOCHS_FILE), mode='w+', dtype=np.int64,
+                                           shape=(capacity,))
+        del frames, epochs
+        _write_meta(path, 0, frame_shape, np.dtype(dtype))
+        return cls(path, mode='r+')
+
+    @property
+    def capacity(self):
+        return self._frames.shape[0]
+
+    @property
+    def epochs(self):
+        """
+        (numpy array of int64) unix time of each frame. View of the memmap.
+        """
+
+        return self._epochs[:self.count]
+
+    @property
+    def frames(self):
+        """
+        (numpy memmap) every frame, of shape (time, y, x, band). View of the memmap.
+        """
+
+        return self._frames[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, capacity):
+        """
+        Make room for capacity frames by writing the arrays again with a larger size.
+        """
+
+        for filename, old, shape, dtype in ((FRAMES_FILE, self._frames, (capacity,) + self.frame_shape, self.dtype),
+                                            (EPOCHS_FILE, self._epochs, (capacity,), np.dtype(np.int64))):
+            temp_path = os.path.join(self.path, filename + '.tmp')
+            new = np.lib.format.open_memmap(temp_path, mode='w+', dtype=dtype, shape=shape)
+            for start in range(0, self.count, COPY_FRAMES):
+                stop = min(start + COPY_FRAMES, self.count)
+                new[start:stop] = old[start:stop]
+            new.flush()
+            del new
+        #memmaps of the old files must be closed before they are replaced (Windows)
+        del old
+        self._frames = self._epochs = None
+        for filename in (FRAMES_FILE, EPOCHS_FILE):
+            os.replace(os.path.join(self.path, filename + '.tmp'), os.path.join(self.path, filename))
+        self._open()
+        return
+
+    def append(self, epoch, frame):
+        """
+        Add a frame. Frames must be added in time order.
+        Input:
+            epoch - (int) unix time of the frame
+            frame - (numpy array) of shape frame_shape
+        Output:
+            None
+        """
+
+        if self.mode != 'r+':
+            raise ValueError("frame store was opened read only")
+        if frame.shape != self.frame_shape:
+            raise ValueError("frame has shape " + str(frame.shape) + ", store has shape " + str(self.frame_shape))
+        if self.count > 0 and epoch <= self._epochs[self.count - 1]:
+            raise ValueError("frame at " + str(epoch) + " is not after the last frame in the store")
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        self._frames[self.count] = frame
+        self._epochs[self.count] = epoch
+        self.count += 1
+        return
+
+    def index_range(self, start=None, end=None):
+        """
+        Get the index range of frames from start up to (not including) end.
+        Input:
+            start - (int) optional unix time
+            end - (int) optional unix time
+        Output:
+            first, last - (int) frames[first:last] are in the time range
+        """
+
+        epochs = self.epochs
+        first = int(np.searchsorted(epochs, start, side='left')) if start is not None else 0
+        last = int(np.searchsorted(epochs, end, side='left')) if end is not None else self.count
+        return first, last
+
+    def slice_time(self, start=None, end=None):
+        """
+        Get the frames from start up to (not including) end, without copying them.
+        Input:
+            start - (int) optional unix time
+            end - (int) optional unix time
+        Output:
+            epochs - (numpy array of int64) unix time of each frame
+            frames - (numpy memmap) of shape (time, y, x, band). View of the file on disk.
+        """
+
+        first, last = self.index_range(start, end)
+        return self._epochs[first:last], self._frames[first:last]
+
+    def frame_at(self, epoch):
+        """
+        Get the frame with a unix time, or None if there is no frame at that time.
+        """
+
+        index = int(np.searchsorted(self.epochs, epoch))
+        if index < self.count and self._epochs[index] == epoch:
+            return self._frames[index]
+        return None
+
+    def flush(self):
+        """
+        Write added frames and the number of frames to disk.
+        """
+
+        if self.mode == 'r+':
+            self._frames.flush()
+            self._epochs.flush()
+            _write_meta(self.path, self.count, self.frame_shape, self.dtype)
+        return
+
+    def close(self):
+        self.flush()
+        self._frames = self._epochs = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
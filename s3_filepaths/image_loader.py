@@ -0,0 +1,152 @@
+"""
+Purpose: load many images from S3 as NumPy arrays, with downloading and decoding running at the same time.
+test_bucket_read.py opens one image with fs.open() and imageio, which downloads and decodes one
+frame at a time. iter_images() takes a list of keys (ex. from s3_listing.iter_keys() or a
+BucketCatalog query) and
+    - downloads up to fetch_workers images at the same time in threads
+    - decodes the downloaded JPEGs in a pool of decode_workers processes
+    - yields (key, image array) in the same order as the keys
+At most read_ahead images are downloaded or decoded ahead of the one being yielded, so memory
+use does not depend on how many images are loaded.
+With a BlobCache (blob_cache.py), images already read once are loaded from local disk instead of S3.
+load_stack() puts the images into one preallocated array of shape (number of images, y, x, band).
+Example:
+    keys = catalog.keys(station='caco-01', camera='c2', image_type='timex', start=..., end=...)
+    stack, keys = load_stack(keys)
+"""
+
+#####REQUIRED PACKAGES#####
+import collections
+import concurrent.futures
+import io
+import multiprocessing
+import numpy as np
+try:
+    import imageio.v2 as imageio
+except ImportError:
+    #imageio before 2.16
+    import imageio
+from filesystem_manager import get_filesystem
+
+
+#####FUNCTIONS#####
+def decode_image(data):
+    """
+    Decode an image file. Runs in a decode process.
+    Input:
+        data - (bytes) contents of an image file (ex. jpg)
+    Output:
+        image - (numpy array) of shape (y, x, band) or (y, x)
+    """
+
+    return np.asarray(imageio.imread(io.BytesIO(data)))
+
+
+def fetch_image(fs, key, cache=None, etag=None):
+    """
+    Download the contents of an image file.
+    Input:
+        fs - fsspec filesystem
+        key - (string) filepath, with or without "s3://"
+        cache - optional BlobCache to read through
+        etag - (string) optional ETag of the file, used as part of the cache key
+    Output:
+        data - (bytes) contents of the file
+    """
+
+    if cache is not None:
+        return cache.read(fs, key, etag)
+    return fs.cat_file(key)
+
+
+def iter_images(keys, fs=None, read_ahead=32, fetch_workers=16, decode_workers=None, cache=None, etags=None):
+    """
+    Generator that downloads and decodes images, in the same order as keys.
+    Input:
+        keys - iterable of (string) filepaths, ex. "cmgp-coastcam/cameras/caco-01/products/1600866001.c2.timex.jpg"
+        fs - fsspec filesystem. Default is the shared s3 filesystem.
+        read_ahead - (int) most images downloaded or decoded ahead of the one being yielded
+        fetch_workers - (int) number of download threads
+        decode_workers - (int) number of decode processes. Default is the number of cores.
+                         0 decodes in the download threads instead.
+        cache - optional BlobCache. Images are read from it if cached, and saved to it if not.
+        etags - (dict) optional key -> ETag, ex. from a listing or BucketCatalog.find(). Keys not
+                in it are looked up with fs.info() when a cache is used.
+    Output:
+        (key, image) for each key. image is a numpy array.
+    """
+
+    if fs is None:
+        fs = get_filesystem('s3', profile='coastcam')
+    key_iter = iter(keys)
+    fetching = collections.deque()
+    decoding = collections.deque()
+
+    fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=fetch_workers)
+    decode_pool = None
+    if decode_workers != 0:
+        #spawn so the decode processes do not inherit the download threads of this process
+        decode_pool = concurrent.futures.ProcessPoolExecutor(max_workers=decode_workers,
+                                                             mp_context=multiprocessing.get_context('spawn'))
+
+    def start_decode(key, fetch_future):
+        data = fetch_future.result()
+        if decode_pool is None:
+            decoding.append((key, fetch_pool.submit(decode_image, data)))
+        else:
+            decoding.append((key, decode_pool.submit(decode_image, data)))
+
+    try:
+        keys_left = True
+        while True:
+            #keep read_ahead images downloading or decoding
+            while keys_left and len(fetching) + len(decoding) < read_ahead:
+                key = next(key_iter, None)
+                if key is None:
+                    keys_left = False
+                    break
+                etag = etags.get(key) if etags is not None else None
+                fetching.append((key, fetch_pool.submit(fetch_image, fs, key, cache, etag)))
+
+            #start decoding images that have finished downloading, in order
+            while len(fetching) > 0 and fetching[0][1].done():
+                start_decode(*fetching.popleft())
+
+            if len(decoding) > 0:
+                key, decode_future = decoding.popleft()
+                yield key, decode_future.result()
+            elif len(fetching) > 0:
+                #wait for the next download
+                start_decode(*fetching.popleft())
+            elif not keys_left:
+                return
+    finally:
+        for key, future in list(fetching) + list(decoding):
+            future.cancel()
+        fetch_pool.shutdown(wait=True)
+        if decode_pool is not None:
+            decode_pool.shutdown(wait=True)
+
+
+def load_stack(keys, fs=None, read_ahead=32, fetch_workers=16, decode_workers=None, cache=None, etags=None):
+    """
+    Load images into one array. Every image must have the same shape.
+    Input:
+        keys - list of (string) filepaths
+        fs, read_ahead, fetch_workers, decode_workers, cache, etags - same as iter_images()
+    Output:
+        stack - (numpy array) of shape (number of images, y, x, band). Allocated once, when the first image is loaded.
+        keys - (list of strings) key of each image in stack
+    """
+
+    keys = list(keys)
+    stack = None
+    for index, (key, image) in enumerate(iter_images(keys, fs, read_ahead, fetch_workers, decode_workers, cache, etags)):
+        if stack is None:
+            stack = np.empty((len(keys),) + image.shape, dtype=image.dtype)
+        elif image.shape != stack.shape[1:]:
+            raise ValueError(key + " has shape " + str(image.shape) + ", other images have shape " + str(stack.shape[1:]))
+        stack[index] = image
+    if stack is None:
+        stack = np.empty((0,), dtype=np.uint8)
+    return stack, keys
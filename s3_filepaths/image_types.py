@@ -0,0 +1,78 @@
+"""
+Purpose: find the image type (snap, timex, var, bright, dark, rundark) of image files and count them.
+filenames are in the format [unix datetime].[camera in format c#].[image type].[image format], so the
+image type is the third part of the filename. It is read straight from the filename in one step,
+instead of trying a regular expression for every image type on the whole filepath.
+count_image_types() gives each filepath a number for its image type (an index into IMAGE_TYPES)
+and counts them all at once with NumPy, so a year of keys from every camera is counted in well
+under a second.
+"""
+
+#####REQUIRED PACKAGES#####
+import numpy as np
+from path_planner import check_image
+
+
+#####GLOBALS#####
+#image types in the order they are counted and plotted
+IMAGE_TYPES = ('snap', 'timex', 'var', 'bright', 'dark', 'rundark')
+
+#image type -> index into IMAGE_TYPES
+_TYPE_CODES = {image_type: code for code, image_type in enumerate(IMAGE_TYPES)}
+
+
+#####FUNCTIONS#####
+def _type_code(filepath):
+    """
+    Get the index into IMAGE_TYPES of the image type of a file, or -1 if it is not an image or
+    the image type is not one of IMAGE_TYPES.
+    """
+
+    if not check_image(filepath):
+        return -1
+    filename = filepath[filepath.rfind("/") + 1:]
+    parts = filename.split(".")
+    if len(parts) != 4:
+        return -1
+    return _TYPE_CODES.get(parts[2], -1)
+
+
+def classify_image(filepath):
+    """
+    Get the image type of a file.
+    Input:
+        filepath - (string) filepath or filename, ex. ".../raw/1576260000.c2.snap.jpg"
+    Output:
+        image_type - (string) one of IMAGE_TYPES, ex. 'snap'. None if not an image or not a known image type.
+    """
+
+    code = _type_code(filepath)
+    if code < 0:
+        return None
+    return IMAGE_TYPES[code]
+
+
+def image_type_codes(filepaths):
+    """
+    Get the image type of many files as numbers.
+    Input:
+        filepaths - iterable of (string) filepaths or filenames
+    Output:
+        codes - (numpy array of int8) index into IMAGE_TYPES of each file, -1 if not counted
+    """
+
+    return np.fromiter((_type_code(filepath) for filepath in filepaths), dtype=np.int8)
+
+
+def count_image_types(filepaths):
+    """
+    Count how many files there are of each image type.
+    Input:
+        filepaths - iterable of (string) filepaths or filenames. Files that are not images are skipped.
+    Output:
+        counts - (dict) image type -> count, with every type in IMAGE_TYPES (0 if there are none)
+    """
+
+    codes = image_type_codes(filepaths)
+    counts = np.bincount(codes[codes >= 0], minlength=len(IMAGE_TYPES))
+    return dict(zip(IMAGE_TYPES, counts.tolist()))
@@ -0,0 +1,283 @@
+"""
+Purpose: count how many of each image type were captured by every camera of a station over a range of days.
+s3_image_metrics.py counts one day folder of one camera. For a station-year completeness report
+that is hundreds of day folders per camera, each listed from S3 every time the report is made.
+Here the day folders of every camera are listed at the same time with a ThreadPoolExecutor and
+the filenames in each day folder are saved in a local cache (one json file per day folder).
+A cached listing is used again until it is ttl seconds old. Once a day is over (more than
+settle_seconds ago, to give late uploads time to arrive) no more images are added to its
+folder, so its cached listing never expires and the day is never listed from S3 again.
+Image types are counted with image_types.py. The result is a tidy pyarrow Table with one row per
+station, camera, day and image type, which can be written to csv or turned into a pandas
+DataFrame with to_pandas() to pivot or plot.
+"""
+
+#####REQUIRED PACKAGES#####
+import concurrent.futures
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import pyarrow as pa
+import pyarrow.csv
+from filesystem_manager import get_filesystem
+from s3_listing import iter_keys
+from time_utils import day_folder, SECONDS_PER_DAY
+from image_types import IMAGE_TYPES, count_image_types
+from daylight_filter import daylight_mask, check_station
+
+
+#####GLOBALS#####
+#camera folders are named c1, c2, etc.
+CAMERA_PATTERN = re.compile(r"^c\d+$")
+
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+COUNTS_SCHEMA = pa.schema([
+    ('station', pa.string()),
+    ('camera', pa.string()),
+    ('date', pa.date32()),
+    ('year', pa.string()),
+    ('day', pa.string()),
+    ('image_type', pa.string()),
+    ('count', pa.int64()),
+])
+
+
+#####CLASSES#####
+class ListingCache:
+    """
+    Local cache of the filenames in S3 day folders, one json file per day folder.
+    Example:
+        cache = ListingCache("C:/coastcam/listing cache/")
+        filenames = cache.get(fs, day_folder_path, day_number)
+    """
+
+    def __init__(self, cache_dir, ttl=3600, settle_seconds=SECONDS_PER_DAY):
+        """
+        Input:
+            cache_dir - (string) local folder the cached listings are kept in
+            ttl - (float) seconds a cached listing of a day that is not over yet is used for
+            settle_seconds - (float) seconds after the end of a day before its listing never expires
+        """
+
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.settle_seconds = settle_seconds
+        self.hits = 0
+        self.misses = 0
+        #get() is called from the threads of aggregate_counts()
+        self._lock = threading.Lock()
+
+    def _cache_file(self, folder):
+        """
+        Local file for the cached listing of a folder. Follows the folder structure of the bucket.
+        """
+
+        if folder.startswith("s3://"):
+            folder = folder[5:]
+        return os.path.join(self.cache_dir, *folder.strip("/").split("/")) + ".json"
+
+    def is_final(self, day_number):
+        """
+        Check if a day ended long enough ago that no more images will be added to its folder.
+        """
+
+        return (day_number + 1) * SECONDS_PER_DAY + self.settle_seconds <= time.time()
+
+    def get(self, fs, folder, day_number):
+        """
+        Get the filenames in a day folder, from the cache if possible, otherwise from S3.
+        Input:
+            fs - fsspec filesystem to list with
+            folder - (string) day folder, ex. "s3://cmgp-coastcam/cameras/caco-01/c1/2019/348_Dec.14/raw"
+            day_number - (int) days since 1970-01-01 of the folder
+        Output:
+            filenames - (list of strings) filenames in the folder
+        """
+
+        cache_file = self._cache_file(folder)
+        final = self.is_final(day_number)
+        try:
+            age = time.time() - os.path.getmtime(cache_file)
+            if final or age < self.ttl:
+                with open(cache_file, 'r', encoding='UTF8') as f:
+                    cached = json.load(f)
+                #a listing saved before the day was over can still be missing images
+                if cached['final'] or not final:
+                    with self._lock:
+                        self.hits += 1
+                    return cached['filenames']
+        except (OSError, ValueError, KeyError):
+            #not cached, or cache file is damaged
+            pass
+
+        with self._lock:
+            self.misses += 1
+        try:
+            filenames = [key.rsplit("/", 1)[-1] for key in iter_keys(fs, folder)]
+        except FileNotFoundError:
+            #no images that day
+            filenames = []
+        self._save(cache_file, {'folder': folder, 'final': final, 'filenames': filenames})
+        return filenames
+
+    def _save(self, cache_file, listing):
+        """
+        Write a cached listing to a temporary file and move it into place, so a listing that is
+        read while being written (or after a crash) is never half written.
+        """
+
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='UTF8') as f:
+                json.dump(listing, f)
+            os.replace(temp_file, cache_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        return
+
+
+#####FUNCTIONS#####
+def discover_cameras(fs, station, bucket='cmgp-coastcam'):
+    """
+    Find the camera folders (c1, c2, etc.) of a station.
+    Input:
+        fs - fsspec filesystem
+        station - (string) station name, ex. 'caco-01'
+        bucket - (string) name of the bucket
+    Output:
+        cameras - (list of strings) ex. ['c1', 'c2']
+    """
+
+    cameras = []
+    for info in fs.ls(bucket + "/cameras/" + station + "/", detail=True):
+        name = info['name'].rstrip("/").rsplit("/", 1)[-1]
+        if info['type'] == 'directory' and CAMERA_PATTERN.match(name):
+            cameras.append(name)
+    return sorted(cameras, key=lambda camera: int(camera[1:]))
+
+
+def day_numbers(start_date, end_date):
+    """
+    Days since 1970-01-01 of every day from start_date to end_date (both included).
+    Input:
+        start_date - (datetime.date) first day
+        end_date - (datetime.date) last day
+    Output:
+        (range) day numbers
+    """
+
+    return range((start_date - EPOCH_DATE).days, (end_date - EPOCH_DATE).days + 1)
+
+
+def count_day(fs, cache, bucket, station, camera, day_number, daylight_only=False):
+    """
+    Count the image types in one day folder of one camera.
+    Input:
+        fs - fsspec filesystem
+        cache - ListingCache, or None to always list from S3
+        bucket - (string) name of the bucket
+        station - (string) station name
+        camera - (string) camera, ex. 'c1'
+        day_number - (int) days since 1970-01-01
+        daylight_only - (bool) only count images taken between sunrise and sunset (daylight_filter.py)
+    Output:
+        counts - (dict) image type -> count
+    """
+
+    year, day = day_folder(day_number)
+    folder = "s3://" + bucket + "/cameras/" + station + "/" + camera + "/" + year + "/" + day + "/raw"
+    if cache is not None:
+        filenames = cache.get(fs, folder, day_number)
+    else:
+        try:
+            filenames = list(iter_keys(fs, folder))
+        except FileNotFoundError:
+            filenames = []
+    if daylight_only and len(filenames) > 0:
+        filenames = [filename for filename, keep in zip(filenames, daylight_mask(filenames, station=station)) if keep]
+    return count_image_types(filenames)
+
+
+def aggregate_counts(station, start_date, end_date, cameras=None, bucket='cmgp-coastcam', fs=None, cache=None,
+                     max_workers=16, daylight_only=False):
+    """
+    Count the image types of every camera of a station for every day from start_date to end_date.
+    Input:
+        station - (string) station name, ex. 'caco-01'
+        start_date - (datetime.date) first day
+        end_date - (datetime.date) last day (included)
+        cameras - (list of strings) cameras to count, ex. ['c1', 'c2']. Default is every camera of the station.
+        bucket - (string) name of the bucket
+        fs - fsspec filesystem. Default is the shared s3 filesystem.
+        cache - ListingCache, or None to always list from S3
+        max_workers - (int) number of day folders listed at the same time
+        daylight_only - (bool) only count images taken between sunrise and sunset (daylight_filter.py)
+    Output:
+        table - (pyarrow.Table) with the columns of COUNTS_SCHEMA. One row per camera, day and image
+                type, including days with no images (count 0).
+    """
+
+    if daylight_only:
+        #stop before listing anything if the sunrise and sunset of the station can not be calculated
+        check_station(station)
+    if fs is None:
+        fs = get_filesystem('s3', profile='coastcam')
+    if cameras is None:
+        cameras = discover_cameras(fs, station, bucket)
+
+    tasks = [(camera, day_number) for camera in cameras for day_number in day_numbers(start_date, end_date)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda task: count_day(fs, cache, bucket, station, task[0], task[1], daylight_only), tasks)
+
+        columns = {name: [] for name in COUNTS_SCHEMA.names}
+        for (camera, day_number), counts in zip(tasks, results):
+            year, day = day_folder(day_number)
+            date = EPOCH_DATE + datetime.timedelta(days=day_number)
+            for image_type in IMAGE_TYPES:
+                columns['station'].append(station)
+                columns['camera'].append(camera)
+                columns['date'].append(date)
+                columns['year'].append(year)
+                columns['day'].append(day)
+                columns['image_type'].append(image_type)
+                columns['count'].append(counts[image_type])
+    return pa.Table.from_pydict(columns, schema=COUNTS_SCHEMA)
+
+
+def write_counts(table, csv_filepath):
+    """
+    Write a counts table to a csv file.
+    Input:
+        table - (pyarrow.Table) from aggregate_counts()
+        csv_filepath - (string) local filepath of the csv
+    Output:
+        None
+    """
+
+    pyarrow.csv.write_csv(table, csv_filepath)
+    return
+
+
+#####MAIN#####
+if __name__ == "__main__":
+    print("start:", datetime.datetime.now())
+    station = 'caco-01'
+    start_date = datetime.date(2019, 1, 1)
+    end_date = datetime.date(2019, 12, 31)
+
+    #local folders for the listing cache and the counts csv
+    cache_dir = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/listing cache/"
+    csv_filepath = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/" + station + " image counts 2019.csv"
+
+    cache = ListingCache(cache_dir)
+    table = aggregate_counts(station, start_date, end_date, cache=cache)
+    write_counts(table, csv_filepath)
+    print("rows:", table.num_rows, "listed from S3:", cache.misses, "from cache:", cache.hits)
+    print("end:", datetime.datetime.now())
@@ -0,0 +1,117 @@
+"""
+Purpose: plan a migration without copying anything, and write the plan to a columnar manifest file.
+The source folder is listed page by page (s3_listing.py) and every page is planned with the same
+naming rules the copy scripts use (path_planner.py). Each page becomes a row group of a Parquet
+file (or a record batch of an Arrow IPC file), so the manifest is written as the listing goes and
+memory use does not depend on how many images there are.
+Columns are source, dest, station, camera, image_type, epoch and size. dest is null for files that
+would not be copied (not an image, or not properly formatted).
+The manifest can be read back with pandas.read_parquet() or pyarrow to count images per camera
+and per day, estimate how long a migration will take, split it into shards, or compare it to
+the copy log after the migration.
+"""
+
+#####REQUIRED PACKAGES#####
+import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from filesystem_manager import get_filesystem
+from s3_listing import iter_pages
+from path_planner import plan_batch, check_image
+
+
+#####GLOBALS#####
+MANIFEST_SCHEMA = pa.schema([
+    ('source', pa.string()),
+    ('dest', pa.string()),
+    ('station', pa.string()),
+    ('camera', pa.string()),
+    ('image_type', pa.string()),
+    ('epoch', pa.int64()),
+    ('size', pa.int64()),
+])
+
+
+#####FUNCTIONS#####
+def plan_page(page):
+    """
+    Plan one page of a listing and return it as an Arrow record batch.
+    Input:
+        page - list of file info dictionaries from s3_listing.iter_pages()
+    Output:
+        batch - (pyarrow.RecordBatch) with the columns of MANIFEST_SCHEMA
+    """
+
+    sources = [info['name'] for info in page]
+    plan = plan_batch(sources)
+
+    #files that are not images are listed in the manifest but have no destination
+    dests = [dest if check_image(source) else None for source, dest in zip(sources, plan['dest'])]
+    epochs = [int(epoch) if epoch >= 0 else None for epoch in plan['epoch'].tolist()]
+
+    return pa.RecordBatch.from_arrays([
+        pa.array(["s3://" + source.lstrip("/") for source in sources], pa.string()),
+        pa.array(dests, pa.string()),
+        pa.array(plan['station'], pa.string()),
+        pa.array(plan['camera'], pa.string()),
+        pa.array(plan['image_type'], pa.string()),
+        pa.array(epochs, pa.int64()),
+        pa.array([info.get('size') for info in page], pa.int64()),
+    ], schema=MANIFEST_SCHEMA)
+
+
+def write_manifest(source_folder, manifest_path, fs=None, file_format='parquet', page_size=1000, report_every=100):
+    """
+    List source_folder, plan the new filepath of every file, and write the plan to manifest_path.
+    Nothing is copied.
+    Input:
+        source_folder - (string) S3 folder, ex. "s3://cmgp-coastcam/cameras/caco-01/products/"
+        manifest_path - (string) local filepath of the manifest to write
+        fs - fsspec filesystem to list with. Default is the shared s3 filesystem.
+        file_format - (string) 'parquet' or 'arrow' (Arrow IPC file, also readable as feather)
+        page_size - (int) keys per listing page. Each page is one row group / record batch.
+        report_every - (int) print a progress line every this many pages. None for no output.
+    Output:
+        counts - (dict) with 'files', 'planned' (files that would be copied) and 'bytes' (size of planned files)
+    """
+
+    if fs is None:
+        fs = get_filesystem('s3', profile='coastcam')
+
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(manifest_path, MANIFEST_SCHEMA)
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_file(manifest_path, MANIFEST_SCHEMA)
+    else:
+        raise ValueError("file_format must be 'parquet' or 'arrow'")
+
+    counts = {'files': 0, 'planned': 0, 'bytes': 0}
+    try:
+        for page_number, page in enumerate(iter_pages(fs, source_folder, page_size), start=1):
+            if len(page) == 0:
+                continue
+            batch = plan_page(page)
+            writer.write_batch(batch)
+
+            planned = batch.column('dest').is_valid()
+            counts['files'] += batch.num_rows
+            counts['planned'] += planned.true_count
+            counts['bytes'] += pc.sum(pc.filter(batch.column('size'), planned)).as_py() or 0
+            if report_every is not None and page_number % report_every == 0:
+                print(datetime.datetime.now(), "files listed:", counts['files'], "to copy:", counts['planned'])
+    finally:
+        writer.close()
+    return counts
+
+
+#####MAIN#####
+if __name__ == "__main__":
+    print("start:", datetime.datetime.now())
+    #source folder filepath with format s3:/cmgp-coastcam/cameras/[station]/products/[filename]
+    source_folder = "s3://cmgp-coastcam/cameras/caco-01/products/"
+    manifest_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/caco-01 manifest.parquet"
+
+    counts = write_manifest(source_folder, manifest_path)
+    print("files:", counts['files'], "to copy:", counts['planned'], "bytes to copy:", counts['bytes'])
+    print("end:", datetime.datetime.now())
@@ -0,0 +1,365 @@
+"""
+Purpose: measure where a migration spends its time while it is running.
+The copy scripts only printed start and end times, so a slow run could not be told apart as
+slow listing, S3 throttling or slow Python. A MetricsRegistry keeps
+    - counters (ex. copies finished, retries, throttled requests)
+    - gauges (ex. current concurrency limit)
+    - histograms of how long each operation took (ex. one listing page, one copy, one csv write)
+with labels (ex. station='caco-01'). The listing (s3_listing.py), planning (path_planner.py),
+copy engine (copy_engine.py), async copy (async_copy.py) and csv log (copy_log.py) take an optional
+registry as metrics= and record into it. With metrics=None nothing is timed, so there is no cost.
+Each stage has its own histogram (ex. 'plan_seconds', 'copy_seconds', 'record_seconds'), so the time
+of one copy request is not mixed up with the planning and journal writes around it.
+ProgressTracker counts finished images per station and gives throughput and, when the number
+of images of a station is known (ex. from a migration manifest or BucketCatalog.count()), the ETA.
+The registry can be
+    - read by Prometheus (or a browser) at http://localhost:[port]/metrics with serve()
+    - written to a json file every few seconds with start_json_writer()
+"""
+
+#####REQUIRED PACKAGES#####
+import bisect
+import contextlib
+import datetime
+import http.server
+import json
+import os
+import threading
+import time
+
+
+#####GLOBALS#####
+#upper bounds (seconds) of the histogram buckets, from 10 microseconds to 1 minute
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+#####FUNCTIONS#####
+def _label_key(labels):
+    """
+    Labels as a sorted tuple, so they can be used as a dictionary key.
+    """
+
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(label_key, extra=()):
+    """
+    Labels in Prometheus text format, ex. '{station="caco-01"}'.
+    """
+
+    items = list(label_key) + list(extra)
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in items) + "}"
+
+
+def optional_timer(metrics, name, **labels):
+    """
+    Time a with block with metrics.timer(), or do nothing if metrics is None.
+    Input:
+        metrics - MetricsRegistry or None
+        name - (string) histogram name, ex. 'plan_seconds'
+    Output:
+        context manager
+    """
+
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(name, **labels)
+
+
+#####CLASSES#####
+class Histogram:
+    """
+    Count of observed values in each bucket, with their sum. Not thread safe on its own,
+    MetricsRegistry holds its lock while observing.
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        #last bucket is for values above every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        return
+
+    def quantile(self, q):
+        """
+        Estimate a quantile (ex. 0.99) as the upper bound of the bucket it falls in.
+        """
+
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count > 0 else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.bounds] + ['+Inf'], self.counts))}
+
+
+class MetricsRegistry:
+    """
+    Thread safe counters, gauges and histograms with labels.
+    Example:
+        metrics = MetricsRegistry()
+        with metrics.timer('copy_seconds', station='caco-01'):
+            fs.copy(source_filepath, dest_filepath)
+        metrics.inc('copied_total', station='caco-01')
+        metrics.serve(8000)
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._server = None
+        self._json_stop = None
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add value to a counter.
+        """
+
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        return
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set a gauge to value.
+        """
+
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+        return
+
+    def observe(self, name, seconds, **labels):
+        """
+        Add a time (or other value) to a histogram.
+        """
+
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+        return
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager that adds the time the with block took to a histogram.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self.counters.get((name, _label_key(labels)), 0)
+
+    def to_prometheus(self):
+        """
+        Get every metric in the Prometheus text format.
+        Output:
+            text - (string)
+        """
+
+        lines = []
+        with self._lock:
+            for (name, label_key), value in sorted(self.counters.items()):
+                lines.append(name + _label_text(label_key) + " " + repr(value))
+            for (name, label_key), value in sorted(self.gauges.items()):
+                lines.append(name + _label_text(label_key) + " " + repr(value))
+            for (name, label_key), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(name + "_bucket" + _label_text(label_key, [('le', bound)]) + " " + str(cumulative))
+                lines.append(name + "_bucket" + _label_text(label_key, [('le', '+Inf')]) + " " + str(histogram.count))
+                lines.append(name + "_sum" + _label_text(label_key) + " " + repr(histogram.sum))
+                lines.append(name + "_count" + _label_text(label_key) + " " + str(histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """
+        Get every metric as a dictionary that can be written as json.
+        """
+
+        def entries(items, convert):
+            return [{'name': name, 'labels': dict(label_key), 'value': convert(value)}
+                    for (name, label_key), value in sorted(items)]
+
+        with self._lock:
+            return {'time': time.time(), 'elapsed': time.time() - self.start_time,
+                    'counters': entries(self.counters.items(), lambda value: value),
+                    'gauges': entries(self.gauges.items(), lambda value: value),
+                    'histograms': entries(self.histograms.items(), lambda histogram: histogram.to_dict())}
+
+    def write_json(self, json_path):
+        """
+        Write every metric to a json file. Written to a temporary file and moved into place, so
+        the file can be read at any time.
+        """
+
+        temp_path = json_path + '.tmp'
+        with open(temp_path, 'w', encoding='UTF8') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(temp_path, json_path)
+        return
+
+    def start_json_writer(self, json_path, every=10.0):
+        """
+        Write the metrics to json_path every few seconds from a background thread, until stop() is called.
+        """
+
+        self._json_stop = threading.Event()
+
+        def run(stop):
+            while not stop.wait(every):
+                self.write_json(json_path)
+            self.write_json(json_path)
+
+        threading.Thread(target=run, args=(self._json_stop,), daemon=True).start()
+        return
+
+    def serve(self, port=8000, host='127.0.0.1'):
+        """
+        Serve the metrics in the Prometheus text format at http://[host]:[port]/metrics from a background thread.
+        """
+
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('UTF8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                #no line printed for every request
+                return
+
+        self._server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        """
+        Stop the json writer (writing the file one last time) and the http server.
+        """
+
+        if self._json_stop is not None:
+            self._json_stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        return
+
+
+class ProgressTracker:
+    """
+    Images finished per station, with throughput and ETA. Counts are kept in a MetricsRegistry as
+    the counter 'images_done_total' (and 'images_failed_total') labeled by station.
+    Example:
+        progress = ProgressTracker(metrics, totals={'caco-01': 1200000})
+        progress.advance('caco-01')
+        print(progress.report())
+    """
+
+    def __init__(self, metrics, totals=None):
+        """
+        Input:
+            metrics - MetricsRegistry
+            totals - (dict) optional station -> number of images to migrate, for the ETA
+        """
+
+        self.metrics = metrics
+        self.totals = dict(totals) if totals is not None else {}
+        self.stations = set(self.totals)
+        self.start_time = time.monotonic()
+
+    def set_total(self, station, total):
+        self.totals[station] = total
+        self.stations.add(station)
+        self.metrics.set_gauge('images_total', total, station=station)
+        return
+
+    def advance(self, station, done=1, failed=0):
+        """
+        Add finished images of a station.
+        """
+
+        self.stations.add(station)
+        self.metrics.inc('images_done_total', done, station=station)
+        if failed > 0:
+            self.metrics.inc('images_failed_total', failed, station=station)
+        return
+
+    def status(self, station):
+        """
+        Progress of one station.
+        Output:
+            (dict) with 'done', 'failed', 'total' (None if not known), 'per_sec' and 'eta_seconds' (None if not known)
+        """
+
+        done = self.metrics.counter_value('images_done_total', station=station)
+        failed = self.metrics.counter_value('images_failed_total', station=station)
+        elapsed = time.monotonic() - self.start_time
+        per_sec = done / elapsed if elapsed > 0 else 0.0
+        total = self.totals.get(station)
+        eta = None
+        if total is not None and per_sec > 0:
+            eta = max(0, total - done) / per_sec
+        self.metrics.set_gauge('images_per_sec', per_sec, station=station)
+        if eta is not None:
+            self.metrics.set_gauge('eta_seconds', eta, station=station)
+        return {'done': done, 'failed': failed, 'total': total, 'per_sec': per_sec, 'eta_seconds': eta}
+
+    def report(self):
+        """
+        One line of progress for each station.
+        Output:
+            (string)
+        """
+
+        lines = []
+        for station in sorted(self.stations):
+            status = self.status(station)
+            line = "%-12s done: %9d  failed: %6d  %8.1f images/sec" % (station, status['done'], status['failed'],
+                                                                        status['per_sec'])
+            if status['total'] is not None:
+                line += "  %5.1f%% of %d" % (100.0 * status['done'] / max(status['total'], 1), status['total'])
+            if status['eta_seconds'] is not None:
+                line += "  ETA: " + str(datetime.timedelta(seconds=int(status['eta_seconds'])))
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,304 @@
+"""
+Purpose: migrate the products folders of many stations at once, using every core of the computer.
+The copy scripts each have one hardcoded source_folder, so stations were migrated one at a time by
+editing and restarting a script. This script takes a list of stations (or finds every station under
+cameras/) and splits the work into shards by station and by time range. Filenames start with the
+unix time, so a time range of one station is a range of keys that can be listed on its own
+(s3_listing.py).
+Shards are run in a ProcessPoolExecutor. Inside each process a CopyEngine (copy_engine.py) copies
+the shard with several threads. The number of threads per process is total_concurrency divided by
+the number of processes, so total_concurrency is the most copies running at once across all processes.
+Each shard has its own journal (copy_journal.py) and csv log (copy_log.py), so a stopped run can be
+started again and images that were already copied are skipped. Journals are named after the shard's time
+range, so start_time, end_time and shard_days must stay the same between runs of one migration. Processes report progress through a queue
+and the main process prints copied and failed counts for each station. The counts are kept in a
+MetricsRegistry (migration_metrics.py), which gives images/sec and, if the number of images of each
+station is known, the ETA. The registry can be served for Prometheus (metrics_port) or written to a
+json file (metrics_json) while the run is going.
+"""
+
+#####REQUIRED PACKAGES#####
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import queue
+import time
+from filesystem_manager import get_filesystem, set_pool_size
+from path_planner import plan_dest_path, check_image
+from s3_listing import iter_objects, start_after_for
+from copy_journal import CopyJournal
+from copy_log import CopyLogWriter
+from copy_engine import CopyEngine
+from migration_metrics import MetricsRegistry, ProgressTracker
+from multipart_copy import copy_object, note_large_objects
+
+
+#####GLOBALS#####
+SECONDS_PER_DAY = 86400
+
+
+#####FUNCTIONS#####
+def discover_stations(fs, bucket='cmgp-coastcam'):
+    """
+    Find the stations in a bucket. Every folder under cameras/ is a station.
+    Input:
+        fs - fsspec filesystem
+        bucket - (string) name of the bucket
+    Output:
+        stations - (list of strings) ex. ['caco-01', 'nuvuk', 'whidbey']
+    """
+
+    stations = []
+    for info in fs.ls(bucket + "/cameras/", detail=True):
+        if info['type'] == 'directory':
+            stations.append(info['name'].rstrip("/").rsplit("/", 1)[-1])
+    return sorted(stations)
+
+
+def time_shards(start_time, end_time, shard_days):
+    """
+    Split a time span into ranges of shard_days. The first range has no start and the last has no
+    end, so images from before start_time or after end_time are still in a shard.
+    Boundaries are start_time plus whole steps of shard_days, so any end_time between the same two
+    boundaries gives the same shards.
+    Input:
+        start_time - (int) unix time of the first boundary
+        end_time - (int) unix time after which there are no more boundaries
+        shard_days - (float) length of each range in days
+    Output:
+        shards - list of (start, end) unix times. start is None for the first range, end is None for the last.
+    """
+
+    step = int(shard_days * SECONDS_PER_DAY)
+    boundaries = list(range(int(start_time), int(end_time), step))
+    edges = [None] + boundaries + [None]
+    return [(edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+
+
+def shard_name(station, start, end):
+    """
+    Name used for the journal and csv log of a shard, ex. "caco-01 1575158400-1577750400".
+    """
+
+    return station + " " + (str(start) if start is not None else "start") + "-" + (str(end) if end is not None else "end")
+
+
+def copy_s3_image(source_filepath, large_sizes):
+    """
+    Copy an image from its old filepath to its new filepath (see path_planner.py).
+    Input:
+        source_filepath - (string) current filepath of image, without "s3://"
+        large_sizes - (dict) filepath -> size of images to copy in parts (see multipart_copy.note_large_objects())
+    Output:
+        dest_filepath - (string) new filepath image is copied to, or message if not copied
+    """
+
+    if not check_image(source_filepath):
+        return 'Not an image. Not copied.'
+    dest_filepath = plan_dest_path(source_filepath)
+    if dest_filepath is None:
+        return 'Not properly formatted. Not copied.'
+
+    #Use fsspec to copy image from old path to new path. Filesystem is shared between the threads of a process
+    #images not in large_sizes were listed as smaller than the multipart threshold, so no HEAD request is needed
+    fs = get_filesystem('s3', profile='coastcam')
+    copy_object(fs, "s3://" + source_filepath, dest_filepath, large_sizes.get(source_filepath, 0))
+    large_sizes.pop(source_filepath, None)
+    return dest_filepath
+
+
+def migrate_shard(bucket, station, start, end, threads, csv_path, progress_queue, report_every=10.0):
+    """
+    Copy the images of one station in one time range. Runs in a worker process.
+    Input:
+        bucket - (string) name of the bucket
+        station - (string) station name
+        start - (int) unix time of the first image in the range, or None
+        end - (int) unix time after the last image in the range, or None
+        threads - (int) number of copy threads in this process
+        csv_path - (string) folder for journals and csv logs (ending in "/")
+        progress_queue - queue for (station, copied, failed) progress messages
+        report_every - (float) seconds between progress messages
+    Output:
+        stats - (tuple) station, copied, failed
+    """
+
+    set_pool_size(threads)
+    fs = get_filesystem('s3', profile='coastcam')
+    source_folder = "s3://" + bucket + "/cameras/" + station + "/products/"
+    name = shard_name(station, start, end)
+
+    start_after = start_after_for(str(start)) if start is not None else None
+    end_before = str(end) if end is not None else None
+    large_sizes = {}
+    engine = CopyEngine(lambda source_filepath: copy_s3_image(source_filepath, large_sizes), max_workers=threads)
+    copied = failed = 0
+    reported_copied = reported_failed = 0
+    last_report = time.monotonic()
+    with CopyJournal(csv_path + name + " journal.log") as journal, \
+            CopyLogWriter(csv_path, log_name="image copy log " + name) as copy_log:
+        #images in the journal are dropped before their sizes are noted, so large_sizes only holds images to copy
+        objects = iter_objects(fs, source_folder, start_after=start_after, end_before=end_before)
+        pending = (info for info in objects if not journal.is_finished(info['name']))
+        image_list = note_large_objects(pending, large_sizes)
+        for source_filepath, dest_filepath in engine.run(image_list):
+            #also dropped if the copy failed or the file was not copied
+            large_sizes.pop(source_filepath, None)
+            if dest_filepath.startswith('Copy failed'):
+                #not in the journal, so it is tried again next time
+                failed += 1
+            else:
+                journal.record(source_filepath, dest_filepath)
+                copied += 1
+            copy_log.write("s3://" + source_filepath, dest_filepath)
+
+            if time.monotonic() - last_report >= report_every:
+                last_report = time.monotonic()
+                progress_queue.put((station, copied - reported_copied, failed - reported_failed))
+                reported_copied, reported_failed = copied, failed
+
+    progress_queue.put((station, copied - reported_copied, failed - reported_failed))
+    return station, copied, failed
+
+
+def print_progress(progress, start_time, tracker=None):
+    """
+    Print copied and failed counts for each station and the total objects/sec.
+    Input:
+        progress - (dict) station -> [copied, failed, shards done, shards total]
+        start_time - (float) time.monotonic() when the run started
+        tracker - optional ProgressTracker. Adds images/sec and ETA of each station.
+    """
+
+    elapsed = time.monotonic() - start_time
+    total = 0
+    for station in sorted(progress):
+        copied, failed, done, shards = progress[station]
+        total += copied + failed
+        line = "  %-12s copied: %9d  failed: %6d  shards: %d/%d" % (station, copied, failed, done, shards)
+        if tracker is not None:
+            status = tracker.status(station)
+            line += "  %.1f images/sec" % status['per_sec']
+            if status['eta_seconds'] is not None:
+                line += "  ETA: " + str(datetime.timedelta(seconds=int(status['eta_seconds'])))
+        print(line)
+    print(datetime.datetime.now(), "total: %d objects, %.1f objects/sec" % (total, total / max(elapsed, 1e-9)))
+    return
+
+
+def run_migration(stations, csv_path, bucket='cmgp-coastcam', start_time=None, end_time=None, shard_days=30,
+                  processes=None, total_concurrency=256, report_every=60.0, totals=None, metrics_port=None,
+                  metrics_json=None):
+    """
+    Migrate the products folders of several stations, split into shards by station and time range.
+    Input:
+        stations - (list of strings) station names, or None to migrate every station in the bucket
+        csv_path - (string) folder for journals and csv logs (ending in "/")
+        bucket - (string) name of the bucket
+        start_time - (int) unix time of the first shard boundary. Default is 2015-01-01.
+        end_time - (int) unix time after which there are no more shard boundaries. Required, and must stay
+                   the same between runs (not the time of the run) so the shards and their journals keep their names.
+        shard_days - (float) length of each time range in days
+        processes - (int) number of worker processes. Default is the number of cores.
+        total_concurrency - (int) most copies running at once across all processes
+        report_every - (float) seconds between progress reports
+        totals - (dict) optional station -> number of images to migrate (ex. from BucketCatalog.count()), for the ETA
+        metrics_port - (int) optional. Serve the progress for Prometheus at http://localhost:[metrics_port]/metrics
+        metrics_json - (string) optional filepath the progress is written to as json every report_every seconds
+    Output:
+        progress - (dict) station -> [copied, failed, shards done, shards total]
+    """
+
+    if stations is None:
+        stations = discover_stations(get_filesystem('s3', profile='coastcam'), bucket)
+    if start_time is None:
+        start_time = int(datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    if end_time is None:
+        #a default of now would move the last boundaries (and rename their journals) between runs
+        raise ValueError("end_time is required. Use the same end_time in every run of a migration.")
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    shards = [(station, start, end) for station in stations for start, end in time_shards(start_time, end_time, shard_days)]
+    processes = max(1, min(processes, len(shards)))
+    threads = max(1, total_concurrency // processes)
+    print("stations:", len(stations), "shards:", len(shards), "processes:", processes, "threads per process:", threads)
+
+    progress = {station: [0, 0, 0, 0] for station in stations}
+    for station, start, end in shards:
+        progress[station][3] += 1
+
+    metrics = MetricsRegistry()
+    tracker = ProgressTracker(metrics)
+    for station in stations:
+        if totals is not None and station in totals:
+            tracker.set_total(station, totals[station])
+        else:
+            tracker.advance(station, 0)
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+    if metrics_json is not None:
+        metrics.start_json_writer(metrics_json, every=report_every)
+
+    run_start = time.monotonic()
+    last_report = run_start
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+        #spawn (the only option on Windows) so workers do not inherit the s3 filesystem of this process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(migrate_shard, bucket, station, start, end, threads, csv_path, progress_queue): station
+                       for station, start, end in shards}
+            pending = set(futures)
+            while len(pending) > 0:
+                done, pending = concurrent.futures.wait(pending, timeout=1.0)
+                for future in done:
+                    station = futures[future]
+                    progress[station][2] += 1
+                    if future.exception() is not None:
+                        print("shard of", station, "stopped with error:", repr(future.exception()))
+
+                #add up progress messages from the worker processes
+                while True:
+                    try:
+                        station, copied, failed = progress_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    progress[station][0] += copied
+                    progress[station][1] += failed
+                    tracker.advance(station, copied + failed, failed)
+                metrics.set_gauge('shards_done', sum(counts[2] for counts in progress.values()))
+
+                if time.monotonic() - last_report >= report_every:
+                    last_report = time.monotonic()
+                    print_progress(progress, run_start, tracker)
+
+            #last messages from shards that finished
+            while True:
+                try:
+                    station, copied, failed = progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                progress[station][0] += copied
+                progress[station][1] += failed
+                tracker.advance(station, copied + failed, failed)
+    print_progress(progress, run_start, tracker)
+    metrics.stop()
+    return progress
+
+
+#####MAIN#####
+if __name__ == "__main__":
+    print("start:", datetime.datetime.now())
+    #stations to migrate. None migrates every station under s3://cmgp-coastcam/cameras/
+    stations = ['caco-01', 'nuvuk', 'whidbey']
+
+    #folder for journals and csv logs. Keep the same folder between runs to pick up where the last run left off
+    csv_path = "C:/Users/eswanson/OneDrive - DOI/Documents/GitHub/CoastCam/s3_filepaths/csv/"
+
+    #unix time after the last shard boundary. Keep start_time, end_time and shard_days the same between runs,
+    #the journals of the shards are named after their time ranges. Images after end_time are in the last shard
+    end_time = int(datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+    run_migration(stations, csv_path, end_time=end_time, shard_days=30, total_concurrency=256)
+    print("end:", datetime.datetime.now())
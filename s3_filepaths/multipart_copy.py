@@ -0,0 +1,200 @@
+"""
+Purpose: copy an S3 object with the request that suits its size.
+fs.copy() sends a HEAD request for every object to find its size, then copies it with one
+CopyObject request, which S3 does as one stream. Raw frames (.tif, .raw, .cr2) can be hundreds of
+MB, so a worker thread copying one waits much longer than for a jpg, and objects over 5 GB can not
+be copied with CopyObject at all (s3fs then copies the parts one after another).
+copy_object() takes the size from the listing, so no HEAD request is needed, and
+    - copies objects up to multipart_threshold with one CopyObject request
+    - copies larger objects as a multipart upload, with UploadPartCopy requests for byte ranges of
+      part_size sent at the same time (up to part_concurrency at once)
+Throttled or dropped part copies are retried with backoff (copy_engine.py). If a part can not be
+copied the multipart upload is aborted, so no half copied upload is left in the bucket.
+Filesystems other than s3 (ex. the fsspec memory filesystem) are copied with fs.cp_file().
+"""
+
+#####REQUIRED PACKAGES#####
+import asyncio
+#will need fs3 package to use s3 in fsspec
+from fsspec.asyn import sync
+from s3_listing import is_s3_filesystem
+from copy_engine import is_retryable_error, backoff_delay
+
+
+#####GLOBALS#####
+#smallest and largest part S3 allows in a multipart upload (except the last part, which can be smaller)
+MIN_PART_SIZE = 5 * 2**20
+MAX_PART_SIZE = 5 * 2**30
+
+#most parts in one multipart upload
+MAX_PARTS = 10000
+
+#objects larger than this are copied in parts
+DEFAULT_MULTIPART_THRESHOLD = 128 * 2**20
+
+DEFAULT_PART_SIZE = 64 * 2**20
+
+#headers of the source kept on a copy made in parts. CopyObject keeps them itself, but a multipart
+#upload starts as a new object
+COPIED_HEADERS = ('ContentType', 'ContentEncoding', 'ContentLanguage', 'ContentDisposition', 'CacheControl',
+                  'Expires', 'Metadata')
+
+
+#####FUNCTIONS#####
+def part_ranges(size, part_size=DEFAULT_PART_SIZE):
+    """
+    Split an object into the byte ranges of its parts. part_size is raised if the object would
+    have more than MAX_PARTS parts.
+    Input:
+        size - (int) size of the object in bytes
+        part_size - (int) bytes per part, between MIN_PART_SIZE and MAX_PART_SIZE
+    Output:
+        ranges - list of (first byte, last byte) of each part. Last byte is included, as in the HTTP Range header.
+    """
+
+    if part_size < MIN_PART_SIZE or part_size > MAX_PART_SIZE:
+        raise ValueError("part_size must be between 5 MB and 5 GB")
+    if size > part_size * MAX_PARTS:
+        #smallest whole number of MB that fits the object in MAX_PARTS parts
+        part_size = -(-size // (MAX_PARTS * 2**20)) * 2**20
+    return [(first, min(first + part_size, size) - 1) for first in range(0, size, part_size)]
+
+
+async def _copy_part(fs, bucket, key, upload_id, part_number, copy_source, byte_range, semaphore,
+                     max_retries, base_delay, max_delay):
+    """
+    Copy one byte range of the source as one part, retrying throttling and connection errors with backoff.
+    Output:
+        part - (dict) 'PartNumber' and 'ETag' of the part
+    """
+
+    attempt = 0
+    while True:
+        try:
+            async with semaphore:
+                response = await fs._call_s3("upload_part_copy", Bucket=bucket, Key=key, UploadId=upload_id,
+                                             PartNumber=part_number, CopySource=copy_source,
+                                             CopySourceRange="bytes=%d-%d" % byte_range)
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+        except Exception as error:
+            if not is_retryable_error(error) or attempt >= max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+
+
+async def copy_multipart_async(fs, source_filepath, dest_filepath, size, part_size=DEFAULT_PART_SIZE,
+                               part_concurrency=16, max_retries=5, base_delay=0.1, max_delay=20.0):
+    """
+    Copy an object as a multipart upload, with its parts copied at the same time.
+    The content type and user metadata of the source are read with one HEAD request (the listing does
+    not have them) and given to the new upload.
+    Input:
+        fs - s3fs filesystem
+        source_filepath - (string) filepath of the object, with or without "s3://"
+        dest_filepath - (string) filepath to copy to
+        size - (int) size of the object in bytes
+        part_size - (int) bytes per part
+        part_concurrency - (int) most UploadPartCopy requests waiting on S3 at once for this object
+        max_retries, base_delay, max_delay - retries of each part (see copy_engine.backoff_delay())
+    Output:
+        None
+    """
+
+    source_bucket, source_key, version = fs.split_path(source_filepath)
+    bucket, key, dest_version = fs.split_path(dest_filepath)
+    copy_source = {'Bucket': source_bucket, 'Key': source_key}
+    if version:
+        copy_source['VersionId'] = version
+
+    head_version = {'VersionId': version} if version else {}
+    head = await fs._call_s3("head_object", Bucket=source_bucket, Key=source_key, **head_version)
+    headers = {name: head[name] for name in COPIED_HEADERS if head.get(name) is not None}
+    upload = await fs._call_s3("create_multipart_upload", Bucket=bucket, Key=key, **headers)
+    upload_id = upload['UploadId']
+    semaphore = asyncio.Semaphore(part_concurrency)
+    tasks = [asyncio.ensure_future(_copy_part(fs, bucket, key, upload_id, index + 1, copy_source, byte_range,
+                                              semaphore, max_retries, base_delay, max_delay))
+             for index, byte_range in enumerate(part_ranges(size, part_size))]
+    try:
+        parts = await asyncio.gather(*tasks)
+        await fs._call_s3("complete_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id,
+                          MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])})
+    except BaseException:
+        #gather() does not stop the other parts when one fails. Stop them and wait for them to end,
+        #so no part is added to the upload after it is aborted
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        #parts of an upload that is never completed are kept (and billed) until it is aborted
+        await fs._call_s3("abort_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    fs.invalidate_cache(dest_filepath)
+    return
+
+
+async def copy_object_async(fs, source_filepath, dest_filepath, size=None,
+                            multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, part_size=DEFAULT_PART_SIZE,
+                            part_concurrency=16):
+    """
+    Copy an object with CopyObject, or in parts if it is larger than multipart_threshold.
+    Input:
+        fs - s3fs filesystem
+        source_filepath - (string) filepath of the object, with or without "s3://"
+        dest_filepath - (string) filepath to copy to
+        size - (int) size of the object in bytes, ex. from the listing. Looked up with a HEAD request if None.
+        multipart_threshold - (int) objects larger than this many bytes are copied in parts. Can not be
+                              more than 5 GB, the largest object CopyObject can copy.
+        part_size - (int) bytes per part
+        part_concurrency - (int) most parts of the object copied at once
+    Output:
+        None
+    """
+
+    if size is None:
+        size = (await fs._info(source_filepath))['size']
+    if size > min(multipart_threshold, MAX_PART_SIZE):
+        await copy_multipart_async(fs, source_filepath, dest_filepath, size, part_size, part_concurrency)
+    else:
+        await fs._copy_basic(source_filepath, dest_filepath)
+    return
+
+
+def copy_object(fs, source_filepath, dest_filepath, size=None, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+                part_size=DEFAULT_PART_SIZE, part_concurrency=16):
+    """
+    Run copy_object_async() from normal (not async) code, ex. a worker thread of CopyEngine.
+    The parts are copied on the event loop of the filesystem, so a worker thread waits for one
+    object however many parts it has.
+    Input:
+        same as copy_object_async()
+    Output:
+        None
+    """
+
+    if not is_s3_filesystem(fs):
+        fs.cp_file(source_filepath, dest_filepath)
+        return
+    sync(fs.loop, copy_object_async, fs, source_filepath, dest_filepath, size, multipart_threshold,
+         part_size, part_concurrency)
+    return
+
+
+def note_large_objects(objects, large_sizes, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD):
+    """
+    Generator of the filepaths of a listing that keeps the size of the objects that will be copied
+    in parts. Only the (few) large objects are kept, so memory use does not grow with the listing.
+    Objects not in large_sizes are known to be smaller than multipart_threshold.
+    Input:
+        objects - iterable of file info dictionaries, ex. from s3_listing.iter_objects()
+        large_sizes - (dict) filled with filepath -> size of objects larger than multipart_threshold.
+                      Remove entries with large_sizes.pop() once the object is copied or skipped.
+        multipart_threshold - (int) bytes
+    Output:
+        filepaths in the format "[bucket]/[key]", same as s3_listing.iter_keys()
+    """
+
+    for info in objects:
+        if info['size'] > multipart_threshold:
+            large_sizes[info['name']] = info['size']
+        yield info['name']
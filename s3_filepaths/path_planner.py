@@ -0,0 +1,164 @@
+"""
+Purpose: work out the new S3 filepath of images without copying them.
+The old filepath is in the format s3://[bucket]/cameras/[station]/products/[long filename].
+The new filepath is in the format s3://[bucket]/cameras/[station]/[camera]/[year]/[day]/raw/[long filename].
+filenames are in the format [unix datetime].[camera in format c#].[file format].[image format]
+day is in the format ddd_Mmm.nn. ddd is the day of the year (no leading zeros, same as the folders
+already in the bucket), Mmm is the 3 letter abbreviation of the month and nn is the 2 digit day of the month.
+This used to be done one image at a time inside copy_s3_image() of every copy script, by formatting
+a datetime as a string and slicing the string back apart. Every image taken on the same day gets
+the same [year] and [day] folders, so here the folders are worked out once per day (time_utils.py):
+    - plan_dest_path() uses day_folder(), which caches the folders of each day number (unix time // 86400)
+    - plan_batch() converts a whole array of unix times at once with day_folders(), which works out
+      the folders of each different day once with datetime64 arithmetic and looks them up by index
+plan_dest_path() plans one image. plan_batch() and iter_planned() plan many images at a time, so
+planning can be done as its own stage ahead of copying.
+"""
+
+#####REQUIRED PACKAGES#####
+import itertools
+import numpy as np
+from time_utils import day_folder, day_folders, SECONDS_PER_DAY
+
+
+#####GLOBALS#####
+#list of common image types
+common_image_list = ['.tif', '.tiff', '.bmp', 'jpg', '.jpeg', '.gif', '.png', '.eps', 'raw', 'cr2', '.nef', '.orf', '.sr2']
+
+
+#####FUNCTIONS#####
+def check_image(file):
+    """
+    Check if the file is an image (of the proper type)
+    Input:
+        file - (string) filepath of the file to be checked
+    Output:
+        good_ending - (bool) variable saying whether or not file is an image
+    """
+
+    return file.endswith(tuple(common_image_list))
+
+
+def _split_source(source_filepath):
+    """
+    Split an old filepath into a tuple of (bucket, station, filename, epoch, camera, image_type, extension),
+    or None if it is not properly formatted. Used by parse_source_filepath() and plan_batch().
+    """
+
+    if source_filepath.startswith("s3://"):
+        source_filepath = source_filepath[5:]
+    #list will have 5 elements: "[bucket]", "cameras", "[station]", "products", "[image filename]"
+    path_elements = source_filepath.strip("/").split("/")
+    if len(path_elements) < 4:
+        return None
+    filename = path_elements[-1]
+
+    #splits up elements of filename into a list
+    filename_elements = filename.split(".")
+    if len(filename_elements) != 4 or not filename_elements[0].isdigit():
+        return None
+    return (path_elements[0], path_elements[2], filename, int(filename_elements[0]),
+            filename_elements[1], filename_elements[2], filename_elements[3])
+
+
+def parse_source_filepath(source_filepath):
+    """
+    Split an old filepath into the parts used to make the new filepath.
+    Input:
+        source_filepath - (string) filepath in the format [bucket]/cameras/[station]/products/[filename],
+                          with or without "s3://" in front
+    Output:
+        parts - (dict) with keys 'bucket', 'station', 'filename', 'epoch' (int), 'camera', 'image_type'
+                and 'extension', or None if the filepath is not properly formatted
+    """
+
+    parts = _split_source(source_filepath)
+    if parts is None:
+        return None
+    return dict(zip(('bucket', 'station', 'filename', 'epoch', 'camera', 'image_type', 'extension'), parts))
+
+
+def plan_dest_path(source_filepath):
+    """
+    Get the new filepath of one image.
+    Input:
+        source_filepath - (string) old filepath, with or without "s3://" in front
+    Output:
+        dest_filepath - (string) new filepath starting with "s3://", or None if the filepath
+                        is not properly formatted
+    """
+
+    parts = _split_source(source_filepath)
+    if parts is None:
+        return None
+
+    bucket, station, filename, epoch, camera, image_type, extension = parts
+    year, day = day_folder(epoch // SECONDS_PER_DAY)
+    return "s3://" + bucket + "/cameras/" + station + "/" + camera + "/" + year + "/" + day + "/raw/" + filename
+
+
+def plan_batch(source_list):
+    """
+    Get the new filepaths of a batch of images, along with the parts of each filename.
+    Input:
+        source_list - list of old filepaths, with or without "s3://" in front
+    Output:
+        plan - (dict) of columns, each the same length as source_list:
+            'source' - (list of strings) old filepaths as given
+            'dest' - (list of strings) new filepaths, None where not properly formatted
+            'station', 'camera', 'image_type' - (lists of strings) None where not properly formatted
+            'epoch' - (numpy array of int64) unix time from the filename, -1 where not properly formatted
+    """
+
+    count = len(source_list)
+    parts_list = [_split_source(source_filepath) for source_filepath in source_list]
+    epochs = np.array([parts[3] if parts is not None else -1 for parts in parts_list], dtype=np.int64)
+
+    #folders are only worked out once for each different day in the batch
+    good = epochs >= 0
+    years, days = day_folders(epochs[good])
+
+    dests = [None] * count
+    good_positions = np.flatnonzero(good).tolist()
+    for position, year, day in zip(good_positions, years.tolist(), days.tolist()):
+        bucket, station, filename, epoch, camera, image_type, extension = parts_list[position]
+        dests[position] = ("s3://" + bucket + "/cameras/" + station + "/" + camera
+                           + "/" + year + "/" + day + "/raw/" + filename)
+
+    def column(index):
+        return [parts[index] if parts is not None else None for parts in parts_list]
+
+    return {'source': list(source_list),
+            'dest': dests,
+            'station': column(1),
+            'camera': column(4),
+            'image_type': column(5),
+            'epoch': epochs}
+
+
+def iter_planned(image_list, batch_size=1000, metrics=None):
+    """
+    Plan a stream of images in batches. image_list can be a generator (ex. s3_listing.iter_keys()),
+    it is read one batch at a time.
+    Input:
+        image_list - iterable of old filepaths
+        batch_size - (int) images planned at a time
+        metrics - optional MetricsRegistry (migration_metrics.py). Records the time taken to plan
+                  each batch as 'plan_batch_seconds' and the images planned as 'planned_images_total'.
+    Output:
+        generator of (source filepath, destination filepath). Destination filepath is None for
+        images that are not properly formatted.
+    """
+
+    image_iter = iter(image_list)
+    while True:
+        batch = list(itertools.islice(image_iter, batch_size))
+        if len(batch) == 0:
+            return
+        if metrics is None:
+            plan = plan_batch(batch)
+        else:
+            with metrics.timer('plan_batch_seconds'):
+                plan = plan_batch(batch)
+            metrics.inc('planned_images_total', len(batch))
+        yield from zip(plan['source'], plan['dest'])
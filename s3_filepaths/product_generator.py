@@ -0,0 +1,183 @@
+"""
+Purpose: make the timex, var, bright and dark products of a collection from its snap images.
+A collection is a burst of frames from one camera. The products are made from the frames:
+    timex  - time-mean of every pixel
+    var    - variance of every pixel
+    bright - brightest value of every pixel
+    dark   - darkest value of every pixel
+The frames are added to running totals one at a time (ProductAccumulator), so only the running
+totals and a few frames are in memory however long the burst is. The mean and variance are
+kept with Welford's method, which does not lose precision the way a running sum of squares does.
+make_products() makes the products of one collection from a list of frame keys, loaded with
+image_loader.py. make_products_parallel() runs several collections (ex. every camera of a
+station) in a ProcessPoolExecutor, one collection per process.
+The products can be compared to the ones in the bucket to check them, or written as images.
+"""
+
+#####REQUIRED PACKAGES#####
+import concurrent.futures
+import multiprocessing
+import numpy as np
+from image_loader import iter_images
+
+
+#####GLOBALS#####
+PRODUCT_TYPES = ('timex', 'var', 'bright', 'dark')
+
+
+#####CLASSES#####
+class ProductAccumulator:
+    """
+    Running mean, variance, minimum and maximum of every pixel of a stream of frames.
+    Example:
+        accumulator = ProductAccumulator()
+        for frame in frames:
+            accumulator.add(frame)
+        products = accumulator.products()
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        #sum of squared differences from the mean (Welford's M2)
+        self._m2 = None
+        self.minimum = None
+        self.maximum = None
+        self.dtype = None
+
+    def add(self, frame):
+        """
+        Add a frame to the running totals.
+        Input:
+            frame - (numpy array) of shape (y, x, band) or (y, x). Every frame must have the same shape.
+        Output:
+            None
+        """
+
+        frame = np.asarray(frame)
+        if self.count == 0:
+            self.dtype = frame.dtype
+            self.mean = np.zeros(frame.shape, dtype=np.float64)
+            self._m2 = np.zeros(frame.shape, dtype=np.float64)
+            self.minimum = frame.copy()
+            self.maximum = frame.copy()
+        elif frame.shape != self.mean.shape:
+            raise ValueError("frame has shape " + str(frame.shape) + ", other frames have shape " + str(self.mean.shape))
+        else:
+            np.minimum(self.minimum, frame, out=self.minimum)
+            np.maximum(self.maximum, frame, out=self.maximum)
+
+        self.count += 1
+        #Welford's method: delta from the old mean times delta from the new mean
+        delta = frame - self.mean
+        self.mean += delta / self.count
+        delta *= frame - self.mean
+        self._m2 += delta
+        return
+
+    def merge(self, other):
+        """
+        Add the running totals of another accumulator (ex. of another part of the same collection).
+        """
+
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.dtype = other.count, other.dtype
+            self.mean, self._m2 = other.mean.copy(), other._m2.copy()
+            self.minimum, self.maximum = other.minimum.copy(), other.maximum.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self._m2 += other._m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+        np.minimum(self.minimum, other.minimum, out=self.minimum)
+        np.maximum(self.maximum, other.maximum, out=self.maximum)
+        return
+
+    def variance(self):
+        """
+        Population variance of every pixel (0 if there is one frame).
+        """
+
+        if self.count == 0:
+            return None
+        return self._m2 / self.count
+
+    def products(self):
+        """
+        Get the products of the frames added so far.
+        Output:
+            products - (dict) 'timex' (float64 mean), 'var' (float64 variance), 'bright' and 'dark'
+                       (same dtype as the frames), and 'count' (number of frames). None if no frames were added.
+        """
+
+        if self.count == 0:
+            return None
+        return {'timex': self.mean.copy(), 'var': self.variance(), 'bright': self.maximum.copy(),
+                'dark': self.minimum.copy(), 'count': self.count}
+
+
+#####FUNCTIONS#####
+def make_products(keys, fs=None, cache=None, read_ahead=8, fetch_workers=8, decode_workers=0):
+    """
+    Make the products of one collection from its frames.
+    Input:
+        keys - list of (string) filepaths of the frames of the collection (ex. snaps of one camera)
+        fs - fsspec filesystem. Default is the shared s3 filesystem.
+        cache - optional BlobCache for reading the frames
+        read_ahead, fetch_workers, decode_workers - same as image_loader.iter_images(). Frames are
+            decoded in the download threads by default, since this often runs in a worker process already.
+    Output:
+        products - (dict) from ProductAccumulator.products(), or None if there are no frames
+    """
+
+    accumulator = ProductAccumulator()
+    for key, frame in iter_images(keys, fs=fs, read_ahead=read_ahead, fetch_workers=fetch_workers,
+                                  decode_workers=decode_workers, cache=cache):
+        accumulator.add(frame)
+    return accumulator.products()
+
+
+def make_products_parallel(collections, fs=None, cache=None, processes=None, **loader_kwargs):
+    """
+    Make the products of several collections at the same time, one collection per worker process.
+    Input:
+        collections - (dict) name -> list of frame keys, ex. {'c1 1576260000': [...], 'c2 1576260000': [...]}
+        fs - fsspec filesystem. Must be picklable. Default is the shared s3 filesystem of each process.
+        cache - optional BlobCache (the cache folder is shared by the processes)
+        processes - (int) number of worker processes. Default is the number of cores.
+        loader_kwargs - other arguments of make_products()
+    Output:
+        products - (dict) name -> products of the collection
+    """
+
+    results = {}
+    #spawn (the only option on Windows) so workers do not inherit the s3 filesystem of this process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(make_products, keys, fs, cache, **loader_kwargs): name
+                   for name, keys in collections.items()}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def compare_products(products, reference, tolerance=1.0):
+    """
+    Compare generated products with products from the bucket (ex. loaded with image_loader.load_stack()).
+    Input:
+        products - (dict) from make_products()
+        reference - (dict) product type -> image array, ex. {'timex': ..., 'bright': ...}
+        tolerance - (float) largest difference of a pixel that counts as the same (products in the
+                    bucket are rounded and saved as jpg)
+    Output:
+        differences - (dict) product type -> (largest pixel difference, fraction of pixels over tolerance)
+    """
+
+    differences = {}
+    for product_type, image in reference.items():
+        difference = np.abs(products[product_type].astype(np.float64) - np.asarray(image, dtype=np.float64))
+        differences[product_type] = (float(difference.max()), float(np.mean(difference > tolerance)))
+    return differences
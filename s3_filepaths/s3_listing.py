@@ -0,0 +1,397 @@
+"""
+Purpose: list the files in an S3 folder one page at a time instead of all at once.
+fs.glob(source_folder+'/*') does not return until every key in the folder has been listed, which
+for a products folder with millions of images takes minutes and holds every key in memory.
+The generators in this module yield each page of the S3 listing (up to 1000 keys) as soon as it
+arrives, so copying or counting can start on the first page and memory use does not grow with
+the size of the folder.
+S3 returns keys in lexicographic order. Since filenames start with a 10 digit unix time, that is
+also time order. iter_objects_sharded() uses this to list several key ranges of one folder at the
+same time and still yield the keys in order, and iter_objects_time_range() to list only the images
+of a time window [start_time, end_time) by starting the listing at start_time instead of scanning the folder.
+Filepaths are returned in the same format as fs.glob(): "[bucket]/[key]" without "s3://".
+Filesystems other than s3 (ex. the fsspec memory filesystem) are listed with fs.ls() and split
+into pages, so the same code can be run without S3.
+"""
+
+#####REQUIRED PACKAGES#####
+import queue
+import threading
+import time
+#will need fs3 package to use s3 in fsspec
+from fsspec.asyn import sync
+
+
+#####GLOBALS#####
+#most keys S3 returns in one ListObjectsV2 request
+MAX_PAGE_SIZE = 1000
+
+#marks the end of a shard's listing
+_DONE = object()
+
+
+#####FUNCTIONS#####
+def split_folder(folder):
+    """
+    Split an S3 folder into bucket and key prefix.
+    Input:
+        folder - (string) ex. "s3://cmgp-coastcam/cameras/caco-01/products/"
+    Output:
+        bucket - (string) ex. "cmgp-coastcam"
+        prefix - (string) ex. "cameras/caco-01/products/"
+    """
+
+    if folder.startswith("s3://"):
+        folder = folder[5:]
+    folder = folder.lstrip("/")
+    bucket, _, prefix = folder.partition("/")
+    if len(prefix) > 0 and not prefix.endswith("/"):
+        prefix = prefix + "/"
+    return bucket, prefix
+
+
+def is_s3_filesystem(fs):
+    """
+    Check if fs is an s3fs filesystem that can be listed with the S3 paginator.
+    """
+
+    protocol = fs.protocol if isinstance(fs.protocol, str) else fs.protocol[0]
+    return protocol in ('s3', 's3a') and hasattr(fs, 'get_s3')
+
+
+async def list_pages_async(fs, folder, page_size=MAX_PAGE_SIZE, start_after=None, end_before=None):
+    """
+    Async generator of the pages of an S3 listing.
+    Input:
+        fs - s3fs filesystem created with asynchronous=True (or one whose loop this runs on)
+        folder - (string) S3 folder to list
+        page_size - (int) keys per page, at most 1000
+        start_after - (string) optional. Only list filenames after this (ex. "1576260000")
+        end_before - (string) optional. Stop at the first filename at or after this
+    Output:
+        lists of file info dictionaries for each page, with keys 'name' ("[bucket]/[key]"),
+        'size', 'ETag' and 'LastModified'
+    """
+
+    bucket, prefix = split_folder(folder)
+    await fs.set_session()
+    s3 = await fs.get_s3(bucket)
+    paginator = s3.get_paginator('list_objects_v2')
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': '/',
+              'PaginationConfig': {'PageSize': page_size}}
+    if start_after is not None:
+        kwargs['StartAfter'] = prefix + start_after
+    end_key = prefix + end_before if end_before is not None else None
+
+    async for page in paginator.paginate(**kwargs):
+        infos = []
+        for item in page.get('Contents', []):
+            if end_key is not None and item['Key'] >= end_key:
+                yield infos
+                return
+            infos.append({'name': bucket + "/" + item['Key'], 'size': item['Size'],
+                          'ETag': item.get('ETag'), 'LastModified': item.get('LastModified')})
+        yield infos
+
+
+def _iter_pages_ls(fs, folder, page_size, start_after, end_before):
+    """
+    Pages of a listing from fs.ls(), for filesystems that are not s3.
+    """
+
+    #s3:// paths can be used with a local stand-in for S3, ex. "s3://[bucket]/..." -> "/[bucket]/..." in memory
+    if folder.startswith("s3://"):
+        folder = folder[5:]
+    folder = fs._strip_protocol(folder).rstrip("/")
+    infos = sorted((info for info in fs.ls(folder, detail=True) if info['type'] == 'file'),
+                   key=lambda info: info['name'])
+    page = []
+    for info in infos:
+        filename = info['name'].rsplit("/", 1)[-1]
+        if start_after is not None and filename <= start_after:
+            continue
+        if end_before is not None and filename >= end_before:
+            break
+        page.append(info)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if len(page) > 0:
+        yield page
+
+
+def _timed_pages(pages, metrics):
+    """
+    Record the time taken to list each page, and the number of files listed, in a MetricsRegistry.
+    """
+
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        if page is None:
+            return
+        metrics.observe('list_page_seconds', time.perf_counter() - start)
+        metrics.inc('listed_objects_total', len(page))
+        yield page
+
+
+def iter_pages(fs, folder, page_size=MAX_PAGE_SIZE, start_after=None, end_before=None, metrics=None):
+    """
+    Generator of the pages of a folder listing. Each page is yielded as soon as it is listed.
+    Input:
+        fs - fsspec filesystem, ex. from filesystem_manager.get_filesystem()
+        folder - (string) folder to list, ex. "s3://cmgp-coastcam/cameras/caco-01/products/"
+        page_size - (int) keys per page, at most 1000
+        start_after - (string) optional. Only list filenames after this
+        end_before - (string) optional. Stop at the first filename at or after this
+        metrics - optional MetricsRegistry (migration_metrics.py). Records the time taken to list
+                  each page as 'list_page_seconds' and the files listed as 'listed_objects_total'.
+    Output:
+        lists of file info dictionaries (see list_pages_async())
+    """
+
+    if metrics is not None:
+        yield from _timed_pages(iter_pages(fs, folder, page_size, start_after, end_before), metrics)
+        return
+
+    if not is_s3_filesystem(fs):
+        yield from _iter_pages_ls(fs, folder, page_size, start_after, end_before)
+        return
+
+    #run the async listing on the filesystem's event loop, one page at a time
+    pages = list_pages_async(fs, folder, page_size, start_after, end_before)
+    try:
+        while True:
+            try:
+                page = sync(fs.loop, pages.__anext__)
+            except StopAsyncIteration:
+                return
+            yield page
+    finally:
+        sync(fs.loop, pages.aclose)
+
+
+def iter_objects(fs, folder, page_size=MAX_PAGE_SIZE, start_after=None, end_before=None, metrics=None):
+    """
+    Generator of the file info dictionaries of every file in a folder, in key order.
+    Input:
+        same as iter_pages()
+    Output:
+        file info dictionaries with keys 'name', 'size', 'ETag' and 'LastModified'
+    """
+
+    for page in iter_pages(fs, folder, page_size, start_after, end_before, metrics):
+        yield from page
+
+
+def iter_keys(fs, folder, page_size=MAX_PAGE_SIZE, start_after=None, end_before=None, metrics=None):
+    """
+    Generator of the filepaths of every file in a folder. Lazy replacement for fs.glob(folder+'/*').
+    Input:
+        same as iter_pages()
+    Output:
+        filepaths in the format "[bucket]/[key]"
+    """
+
+    for page in iter_pages(fs, folder, page_size, start_after, end_before, metrics):
+        for info in page:
+            yield info['name']
+
+
+def _put(page_queue, item, stop):
+    """
+    Put an item in a bounded queue, giving up if the consumer has stopped.
+    """
+
+    while not stop.is_set():
+        try:
+            page_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _list_shard(fs, folder, page_size, start_after, end_before, page_queue, stop, metrics=None):
+    """
+    Thread that lists one key range of a folder into a bounded queue.
+    """
+
+    try:
+        for page in iter_pages(fs, folder, page_size, start_after, end_before, metrics):
+            if not _put(page_queue, page, stop):
+                return
+    except Exception as error:
+        _put(page_queue, error, stop)
+        return
+    _put(page_queue, _DONE, stop)
+    return
+
+
+def start_after_for(start):
+    """
+    Get the StartAfter value that makes a listing start at the first filename >= start.
+    S3 StartAfter skips keys up to and including its value, so this is start with its last
+    character moved back by one, followed by '~' (the last printable ASCII character).
+    Input:
+        start - (string) ex. "158"
+    Output:
+        start_after - (string) ex. "157~", which sorts after every filename starting with "157"
+    """
+
+    return start[:-1] + chr(ord(start[-1]) - 1) + '~'
+
+
+def iter_objects_sharded(fs, folder, boundaries, max_workers=8, read_ahead=4, page_size=MAX_PAGE_SIZE, metrics=None,
+                         start_after=None, end_before=None):
+    """
+    List a folder as several key ranges at the same time and yield the files in key order.
+    The ranges are split at boundaries. For products folders, boundaries are leading digits of
+    the unix time, ex. ['157', '158', '159', '160'].
+    Up to max_workers ranges are listed at once. Each listing thread stays at most read_ahead pages
+    ahead of the files being yielded, so memory use stays bounded.
+    Input:
+        fs - fsspec filesystem
+        folder - (string) folder to list
+        boundaries - list of filename strings in increasing order to split the listing at
+        max_workers - (int) most ranges listed at the same time
+        read_ahead - (int) pages each range can list ahead of the consumer
+        page_size - (int) keys per page, at most 1000
+        metrics - optional MetricsRegistry, same as iter_pages()
+        start_after - (string) optional. Only list filenames after this (start of the first range)
+        end_before - (string) optional. Stop at the first filename at or after this (end of the last range)
+    Output:
+        file info dictionaries, in the same order as iter_objects()
+    """
+
+    edges = [None] + list(boundaries) + [None]
+    #(start_after, end_before) of each range. A filename equal to a boundary is in the range starting there
+    ranges = []
+    for i in range(len(edges) - 1):
+        range_start = start_after_for(edges[i]) if edges[i] else None
+        ranges.append((range_start, edges[i + 1]))
+    ranges[0] = (start_after, ranges[0][1])
+    ranges[-1] = (ranges[-1][0], end_before)
+
+    stop = threading.Event()
+    started = []
+
+    def start_next():
+        index = len(started)
+        if index >= len(ranges):
+            return
+        page_queue = queue.Queue(maxsize=read_ahead)
+        thread = threading.Thread(target=_list_shard, daemon=True,
+                                  args=(fs, folder, page_size, ranges[index][0], ranges[index][1], page_queue, stop,
+                                        metrics))
+        thread.start()
+        started.append((thread, page_queue))
+
+    for i in range(min(max_workers, len(ranges))):
+        start_next()
+
+    try:
+        for index in range(len(ranges)):
+            thread, page_queue = started[index]
+            while True:
+                page = page_queue.get()
+                if page is _DONE:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+            #this range is finished, start listing the next one not yet started
+            start_next()
+    finally:
+        stop.set()
+    return
+
+
+def first_epoch(fs, folder):
+    """
+    Get the unix time of the first image in a products folder, with one listing request.
+    Input:
+        fs - fsspec filesystem
+        folder - (string) products folder
+    Output:
+        epoch - (int) unix time at the start of the first filename that starts with one, or None if
+                there is none in the first page of the listing
+    """
+
+    for page in iter_pages(fs, folder):
+        for info in page:
+            digits = info['name'].rsplit("/", 1)[-1].split(".", 1)[0]
+            if len(digits) == 10 and digits.isdigit():
+                return int(digits)
+        #only the first page is checked
+        return None
+    return None
+
+
+def time_boundaries(start_time, end_time, shards):
+    """
+    Split a time span into shards of about the same length, as filename boundaries for iter_objects_sharded().
+    Input:
+        start_time - (int) unix time
+        end_time - (int) unix time
+        shards - (int) number of ranges
+    Output:
+        boundaries - list of 10 digit unix time strings between start_time and end_time, ex. ['1576260000', ...]
+    """
+
+    if shards < 2 or end_time <= start_time:
+        return []
+    step = (end_time - start_time) / shards
+    boundaries = sorted(set("%010d" % int(start_time + step * i) for i in range(1, shards)))
+    return [boundary for boundary in boundaries if str(int(start_time)) < boundary < str(int(end_time))]
+
+
+def iter_objects_time_range(fs, folder, start_time=None, end_time=None, shards=8, max_workers=8, read_ahead=4,
+                            page_size=MAX_PAGE_SIZE, metrics=None):
+    """
+    List the images of a products folder taken in the time window [start_time, end_time), in time order.
+    Filenames start with a 10 digit unix time, so S3 lists them in time order and the window is a
+    range of keys. The listing starts at start_time (StartAfter) and stops at end_time, and the window
+    is split into shards listed at the same time. Nothing outside the window is listed.
+    With no start_time, the first image of the folder is found with one listing request and files
+    before it (ex. filenames that do not start with a unix time) are still listed. With no end_time,
+    every file after start_time is listed.
+    Input:
+        fs - fsspec filesystem
+        folder - (string) products folder, ex. "s3://cmgp-coastcam/cameras/caco-01/products/"
+        start_time - (int) optional unix time of the first image to list
+        end_time - (int) optional unix time after the last image to list
+        shards - (int) number of time ranges the window is split into
+        max_workers, read_ahead, page_size, metrics - same as iter_objects_sharded()
+    Output:
+        file info dictionaries, in the same order as iter_objects()
+    """
+
+    start_after = start_after_for(str(int(start_time))) if start_time is not None else None
+    end_before = str(int(end_time)) if end_time is not None else None
+
+    span_start = start_time if start_time is not None else first_epoch(fs, folder)
+    span_end = end_time if end_time is not None else time.time()
+    boundaries = []
+    if span_start is not None:
+        boundaries = time_boundaries(span_start, span_end, shards)
+    if len(boundaries) == 0:
+        yield from iter_objects(fs, folder, page_size, start_after, end_before, metrics)
+        return
+    yield from iter_objects_sharded(fs, folder, boundaries, max_workers, read_ahead, page_size, metrics,
+                                    start_after, end_before)
+
+
+def iter_keys_time_range(fs, folder, start_time=None, end_time=None, shards=8, max_workers=8, read_ahead=4,
+                         page_size=MAX_PAGE_SIZE, metrics=None):
+    """
+    Generator of the filepaths of the images of a products folder taken in the time window [start_time, end_time).
+    Input:
+        same as iter_objects_time_range()
+    Output:
+        filepaths in the format "[bucket]/[key]", in time order
+    """
+
+    for info in iter_objects_time_range(fs, folder, start_time, end_time, shards, max_workers, read_ahead,
+                                        page_size, metrics):
+        yield info['name']
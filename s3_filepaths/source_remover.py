@@ -0,0 +1,352 @@
+"""
+Purpose: finish a migration as a move by removing each old products/ key once its copy is verified.
+The copy scripts only copy, so the old keys stay in the bucket. Removing them later one DeleteObject
+request at a time would take as many requests as the copy did.
+SourceRemover takes (source file info, destination filepath) pairs from the copy loop and, in a
+background thread,
+    - verifies the copies a batch at a time. The destination folders of the batch are listed (one
+      request per 1000 keys), rather than sending a HEAD request for each copy. A copy is good if it
+      has the same size as the source and, if it was copied with one CopyObject request, the same ETag.
+    - removes the sources of the good copies with DeleteObjects requests of up to 1000 keys
+Sources whose copy is missing or different are not removed and are passed to on_error (ex. to be
+written to the csv log), so they can be copied again by a later run. Throttled or dropped listing and
+delete requests, and keys DeleteObjects could not delete because of throttling, are retried with
+backoff (copy_engine.py).
+Example:
+    with SourceRemover(fs, on_error=lambda source, message: copy_log.write("s3://" + source, message)) as remover:
+        for info in iter_objects(fs, source_folder):
+            dest_filepath = copy_s3_image(info['name'])
+            remover.add(info, dest_filepath)
+"""
+
+#####REQUIRED PACKAGES#####
+import posixpath
+import queue
+import threading
+import time
+#will need fs3 package to use s3 in fsspec
+from fsspec.asyn import sync
+from s3_listing import is_s3_filesystem
+from copy_engine import is_retryable_error, backoff_delay, THROTTLE_CODES, RETRYABLE_CODES
+
+
+#####GLOBALS#####
+#most keys S3 deletes with one DeleteObjects request
+MAX_DELETE_KEYS = 1000
+
+#marks the end of the work
+_CLOSE = object()
+
+#seconds add() waits for room in the queue before checking the background thread is still running
+PUT_TIMEOUT = 1.0
+
+
+#####FUNCTIONS#####
+def _strip_protocol(filepath):
+    """
+    Filepath in the format "[bucket]/[key]", without "s3://".
+    """
+
+    if filepath.startswith("s3://"):
+        return filepath[5:]
+    return filepath
+
+
+def _retry(function, max_retries, base_delay, max_delay):
+    """
+    Call function() and return its result, retrying throttling and connection errors with backoff.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception as error:
+            if not is_retryable_error(error) or attempt >= max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+
+
+def _etag(info):
+    """
+    ETag of a file info dictionary without quotes, or None if the filesystem does not give ETags.
+    """
+
+    etag = info.get('ETag', info.get('etag'))
+    if etag is None:
+        return None
+    return etag.strip('"')
+
+
+def same_object(source_info, dest_info):
+    """
+    Check if a copy matches its source.
+    A copy made with CopyObject has the same ETag as its source. An object made as a multipart upload
+    (a copy from multipart_copy.py, or a source that was uploaded in parts) has an ETag ending in
+    "-[number of parts]", which depends on the part size, so then only the size is compared.
+    Input:
+        source_info - (dict) file info of the source from the listing, with 'size' and 'ETag'
+        dest_info - (dict) file info of the copy
+    Output:
+        (bool) True if the copy matches
+    """
+
+    if source_info['size'] != dest_info['size']:
+        return False
+    source_etag = _etag(source_info)
+    dest_etag = _etag(dest_info)
+    if source_etag is None or dest_etag is None or '-' in source_etag or '-' in dest_etag:
+        return True
+    return source_etag == dest_etag
+
+
+def verify_batch(fs, batch, max_retries=0, base_delay=0.1, max_delay=20.0):
+    """
+    Check a batch of copies by listing the folders they were copied to.
+    Input:
+        fs - fsspec filesystem
+        batch - list of (source file info, destination filepath)
+        max_retries, base_delay, max_delay - retries of each listing (see copy_engine.backoff_delay())
+    Output:
+        good - list of source filepaths whose copy matches
+        bad - list of (source filepath, message) whose copy is missing or different
+    """
+
+    folders = {}
+    for source_info, dest_filepath in batch:
+        dest_filepath = _strip_protocol(dest_filepath)
+        folders.setdefault(posixpath.dirname(dest_filepath), []).append((source_info, dest_filepath))
+
+    good = []
+    bad = []
+    for folder, copies in folders.items():
+        try:
+            listing = {info['name']: info for info in
+                       _retry(lambda: fs.ls(folder, detail=True, refresh=True), max_retries, base_delay, max_delay)}
+        except FileNotFoundError:
+            listing = {}
+        for source_info, dest_filepath in copies:
+            dest_info = listing.get(dest_filepath)
+            if dest_info is None:
+                bad.append((source_info['name'], 'Copy not found. Not deleted.'))
+            elif not same_object(source_info, dest_info):
+                bad.append((source_info['name'], 'Copy does not match. Not deleted.'))
+            else:
+                good.append(source_info['name'])
+    return good, bad
+
+
+def delete_keys(fs, filepaths, max_retries=0, base_delay=0.1, max_delay=20.0):
+    """
+    Delete files with DeleteObjects requests of up to 1000 keys.
+    Keys that were not deleted because of throttling or an S3 internal error are sent again.
+    Input:
+        fs - fsspec filesystem
+        filepaths - list of (string) filepaths, with or without "s3://"
+        max_retries, base_delay, max_delay - retries of each request (see copy_engine.backoff_delay())
+    Output:
+        failed - list of (filepath, message) of files that were not deleted
+    """
+
+    failed = []
+    if not is_s3_filesystem(fs):
+        for filepath in filepaths:
+            try:
+                _retry(lambda: fs.rm_file(filepath), max_retries, base_delay, max_delay)
+            except Exception as error:
+                failed.append((filepath, 'Delete failed: ' + repr(error) + '.'))
+        return failed
+
+    by_bucket = {}
+    for filepath in filepaths:
+        bucket, key = _strip_protocol(filepath).split("/", 1)
+        by_bucket.setdefault(bucket, []).append(key)
+    for bucket, keys in by_bucket.items():
+        for start in range(0, len(keys), MAX_DELETE_KEYS):
+            chunk = keys[start:start + MAX_DELETE_KEYS]
+            attempt = 0
+            while len(chunk) > 0:
+                #Quiet: the response only lists the keys that could not be deleted
+                response = _retry(lambda: sync(fs.loop, fs._call_s3, "delete_objects", Bucket=bucket,
+                                               Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}),
+                                  max_retries, base_delay, max_delay)
+                retry_keys = []
+                for error in response.get('Errors', []):
+                    code = error.get('Code', '')
+                    if (code in THROTTLE_CODES or code in RETRYABLE_CODES) and attempt < max_retries:
+                        retry_keys.append(error['Key'])
+                    else:
+                        failed.append((bucket + "/" + error['Key'], 'Delete failed: ' + code + '.'))
+                chunk = retry_keys
+                if len(chunk) > 0:
+                    time.sleep(backoff_delay(attempt, base_delay, max_delay))
+                    attempt += 1
+    fs.invalidate_cache()
+    return failed
+
+
+def note_sources(objects, source_infos):
+    """
+    Generator that passes on the file info dictionaries of a listing and keeps each one in source_infos,
+    so it can be given to SourceRemover.add() once the file is copied.
+    Input:
+        objects - iterable of file info dictionaries, ex. from s3_listing.iter_objects()
+        source_infos - (dict) filled with filepath -> file info. Remove entries with source_infos.pop()
+                       once they are no longer needed, so it only holds files being copied.
+    Output:
+        file info dictionaries of objects
+    """
+
+    for info in objects:
+        source_infos[info['name']] = info
+        yield info
+
+
+#####CLASSES#####
+class SourceRemover:
+    """
+    Verify copies and delete their sources in batches from a background thread.
+    Use as a context manager so the last batch is deleted when the run ends.
+    """
+
+    def __init__(self, fs, batch_size=MAX_DELETE_KEYS, flush_interval=10.0, queue_size=10000, on_error=None,
+                 max_retries=5, base_delay=0.1, max_delay=20.0):
+        """
+        Input:
+            fs - fsspec filesystem
+            batch_size - (int) most copies verified and deleted at a time
+            flush_interval - (float) most seconds a copy waits before its batch is verified
+            queue_size - (int) most copies waiting. add() waits if the queue is full.
+            on_error - function called with (source filepath, message) for sources that are not
+                       deleted. Called from the background thread.
+            max_retries - (int) retries of each listing or delete request
+            base_delay - (float) seconds of the first backoff
+            max_delay - (float) longest backoff in seconds
+        """
+
+        self.fs = fs
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.verified = 0
+        self.deleted = 0
+        self.not_deleted = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _finish_batch(self, batch):
+        """
+        Verify a batch of copies and delete the sources of the good ones.
+        """
+
+        good, bad = verify_batch(self.fs, batch, self.max_retries, self.base_delay, self.max_delay)
+        self.verified += len(good)
+        failed = delete_keys(self.fs, good, self.max_retries, self.base_delay, self.max_delay)
+        self.deleted += len(good) - len(failed)
+        bad += failed
+        self.not_deleted += len(bad)
+        if self.on_error is not None:
+            for source_filepath, message in bad:
+                self.on_error(source_filepath, message)
+        return
+
+    def _run(self):
+        """
+        Background thread. Collects copies from the queue and finishes them in batches.
+        """
+
+        batch = []
+        batch_start = None
+        try:
+            while True:
+                timeout = self.flush_interval
+                if batch_start is not None:
+                    timeout = max(0.0, batch_start + self.flush_interval - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _CLOSE:
+                    break
+                if item is not None:
+                    if len(batch) == 0:
+                        batch_start = time.monotonic()
+                    batch.append(item)
+                if len(batch) > 0 and (len(batch) >= self.batch_size
+                                       or time.monotonic() - batch_start >= self.flush_interval):
+                    self._finish_batch(batch)
+                    batch = []
+                    batch_start = None
+            if len(batch) > 0:
+                self._finish_batch(batch)
+        except Exception as error:
+            #raised again by add() or close() in the copy loop
+            self._error = error
+        return
+
+    def _put(self, item):
+        """
+        Put an item in the queue. Waits while the queue is full, but raises the error of the
+        background thread if it stops, rather than waiting for room that never comes.
+        """
+
+        while True:
+            if self._error is not None:
+                raise self._error
+            if not self._thread.is_alive():
+                raise RuntimeError("SourceRemover is closed")
+            try:
+                self._queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def add(self, source_info, dest_filepath):
+        """
+        Add a finished copy. Messages (dest_filepath not starting with "s3://", ex. 'Not an image. Not copied.')
+        are ignored, so every result of the copy loop can be passed in.
+        Input:
+            source_info - (dict) file info of the source from the listing, with 'name', 'size' and 'ETag'
+            dest_filepath - (string) filepath the source was copied to
+        Output:
+            None
+        """
+
+        if self._error is not None:
+            raise self._error
+        if not dest_filepath.startswith("s3://"):
+            return
+        self._put((source_info, dest_filepath))
+        return
+
+    def close(self):
+        """
+        Finish the remaining copies and stop the background thread.
+        """
+
+        if self._thread.is_alive():
+            try:
+                self._put(_CLOSE)
+            except Exception:
+                #stopped with an error, raised below
+                pass
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __str__(self):
+        return "verified: %d, deleted: %d, not deleted: %d" % (self.verified, self.deleted, self.not_deleted)
@@ -0,0 +1,136 @@
+"""
+Purpose: convert unix times (from image filenames) to dates and day folder names quickly.
+unix2datetime() used to be copied into every copy script. It made a datetime and formatted it as a
+string for every image, and the scripts sliced the string back apart to get the year and day.
+Images are taken about every 30 minutes, so thousands of images share the same day. Here
+    - day_folder() caches the year and day folder names of each day number (unix time // 86400)
+    - day_folders() converts a whole array of unix times at once. The folders of each different
+      day are worked out once with NumPy datetime64 arithmetic and looked up by index.
+    - unix2datetime() has the same inputs and outputs as the old function, with the date of each
+      day cached, for code that still uses it (ex. calc_sunrise_sunset.py)
+Day folders are in the format ddd_Mmm.nn. ddd is the day of the year (no leading zeros, same as the
+folders already in the bucket), Mmm is the 3 letter abbreviation of the month and nn is the 2 digit
+day of the month. Times are in UTC.
+"""
+
+#####REQUIRED PACKAGES#####
+import datetime
+import functools
+import numpy as np
+
+
+#####GLOBALS#####
+#month abbreviations used in day folder names. Not taken from calendar, which depends on the locale
+MONTH_ABBREVIATIONS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+SECONDS_PER_DAY = 86400
+
+
+#####FUNCTIONS#####
+@functools.lru_cache(maxsize=4096)
+def day_folder(day_number):
+    """
+    Get the year and day folder names for a day.
+    The last digit of the unix time in filenames other than snaps is not part of the time stamp,
+    but day boundaries are multiples of 10 seconds so it never changes the day.
+    Input:
+        day_number - (int) days since 1970-01-01 (unix time // 86400)
+    Output:
+        year - (string) ex. '2019'
+        day - (string) ex. '347_Dec.13'
+    """
+
+    years, days = day_folder_table(np.array([day_number]))
+    return years[0], days[0]
+
+
+def epoch_day_folder(epoch):
+    """
+    Get the year and day folder names of a unix time.
+    Input:
+        epoch - (int or string) unix time, ex. 1576260000 or '1576260000'
+    Output:
+        year - (string) ex. '2019'
+        day - (string) ex. '347_Dec.13'
+    """
+
+    return day_folder(int(epoch) // SECONDS_PER_DAY)
+
+
+def day_folder_table(day_numbers):
+    """
+    Get the year and day folder names for an array of days, using NumPy datetime64 arithmetic.
+    Input:
+        day_numbers - (numpy array of int) days since 1970-01-01
+    Output:
+        years - (list of strings) ex. ['2019', ...]
+        days - (list of strings) ex. ['347_Dec.13', ...]
+    """
+
+    dates = np.asarray(day_numbers, dtype=np.int64).astype('datetime64[D]')
+    year_starts = dates.astype('datetime64[Y]')
+    month_starts = dates.astype('datetime64[M]')
+
+    years = year_starts.astype(np.int64) + 1970
+    day_of_year = (dates - year_starts.astype('datetime64[D]')).astype(np.int64) + 1
+    months = month_starts.astype(np.int64) % 12
+    day_of_month = (dates - month_starts.astype('datetime64[D]')).astype(np.int64) + 1
+
+    year_strings = [str(year) for year in years.tolist()]
+    day_strings = ['%d_%s.%02d' % (doy, MONTH_ABBREVIATIONS[month], dom)
+                   for doy, month, dom in zip(day_of_year.tolist(), months.tolist(), day_of_month.tolist())]
+    return year_strings, day_strings
+
+
+def day_folders(epochs):
+    """
+    Get the year and day folder names for an array of unix times.
+    The folders of each different day are only worked out once, so a million images from a few
+    hundred days take a few hundred conversions.
+    Input:
+        epochs - (numpy array or list of int) unix times
+    Output:
+        years - (numpy array of strings) ex. ['2019', ...], same shape as epochs
+        days - (numpy array of strings) ex. ['347_Dec.13', ...], same shape as epochs
+    """
+
+    epochs = np.asarray(epochs, dtype=np.int64)
+    unique_days, day_index = np.unique(epochs // SECONDS_PER_DAY, return_inverse=True)
+    years, days = day_folder_table(unique_days)
+    day_index = day_index.reshape(epochs.shape)
+    return np.array(years, dtype=str)[day_index], np.array(days, dtype=str)[day_index]
+
+
+@functools.lru_cache(maxsize=4096)
+def _utc_date(day_number):
+    """
+    (year, month, day) of a day number.
+    """
+
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(days=day_number)
+    return date.year, date.month, date.day
+
+
+def unix2datetime(unixnumber):
+    """
+    Developed from unix2dts by Chris Sherwood. Updates by Eric Swanson.
+    Get datetime object and string (in UTC) from unix/epoch time. datetime object is "aware",
+    meaning it always references a specific point in time rather than a time relative to local time.
+    datetime object will be the same regardless of what timezone the function is run in.
+    The date of each day is cached, so only the time of day is worked out for each call.
+    Input:
+        unixnumber - string containing unix time (aka epoch)
+    Returns:
+        date_time_string, date_time_object in utc
+    """
+
+    # images other than "snaps" end in 1, 2,...but these are not part of the time stamp.
+    # replace with zero
+    ts = int(str(unixnumber)[:-1] + '0')
+    day_number, seconds = divmod(ts, SECONDS_PER_DAY)
+    year, month, day = _utc_date(day_number)
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    date_time_obj = datetime.datetime(year, month, day, hour, minute, second, tzinfo=datetime.timezone.utc)
+    date_time_str = '%04d-%02d-%02d %02d:%02d:%02d' % (year, month, day, hour, minute, second)
+    return date_time_str, date_time_obj